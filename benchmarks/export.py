@@ -0,0 +1,95 @@
+"""Compares the streaming fleet export with walking the paginated listing.
+
+Seeds one author with a growing number of fleets, then fetches them all
+through GET /api/users/<id>/fleets/export and through page after page of
+GET /api/users/<id>/fleets, reporting time to the first chunk, total time
+and peak memory allocated while serving.
+
+    % source setup.sh
+    % python -m benchmarks.export --per-page 100
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from fleeter import create_app, db
+from fleeter.models import User, Fleet
+
+
+HISTORIES = [1000, 10000, 100000]
+
+
+def seed(fleets: int) -> int:
+    db.drop_all()
+    db.create_all()
+    db.session.execute(User.__table__.insert(), [{'username': 'author'}])
+    author, = db.session.query(User.id).one()
+    start = datetime(2020, 1, 1)
+    db.session.execute(Fleet.__table__.insert(), [
+        {'post': f'fleet {n}', 'user_id': author,
+         'created_at': start + timedelta(seconds=n)}
+        for n in range(fleets)])
+    db.session.commit()
+    User.recount()
+    return author
+
+
+def measure(fetch) -> tuple:
+    """Runs fetch, returning first chunk and total ms, and peak MB."""
+    tracemalloc.start()
+    begin = time.perf_counter()
+    first = fetch(begin)
+    total = time.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first * 1000, total * 1000, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--per-page', type=int, default=100)
+    args = parser.parse_args()
+
+    app = create_app('config.BenchmarkConfig')
+    client = app.test_client()
+
+    def export(user_id):
+        def fetch(begin):
+            res = client.get(f'/api/users/{user_id}/fleets/export',
+                             buffered=False)
+            chunks = iter(res.response)
+            next(chunks)
+            first = time.perf_counter() - begin
+            for _ in chunks:
+                pass
+            res.close()
+            return first
+        return fetch
+
+    def pages(user_id):
+        def fetch(begin):
+            first, page = None, 1
+            while True:
+                res = client.get(f'/api/users/{user_id}/fleets?page={page}'
+                                 f'&per_page={args.per_page}')
+                if first is None:
+                    first = time.perf_counter() - begin
+                if res.status_code != 200:
+                    return first
+                page += 1
+        return fetch
+
+    with app.app_context():
+        print(f'{"fleets":>7} {"fetch":>6} {"first ms":>9} {"total ms":>9} '
+              f'{"peak MB":>8}')
+        for fleets in HISTORIES:
+            user_id = seed(fleets)
+            for name, fetch in [('export', export), ('pages', pages)]:
+                first, total, peak = measure(fetch(user_id))
+                print(f'{fleets:>7} {name:>6} {first:>9.1f} {total:>9.1f} '
+                      f'{peak:>8.2f}')
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
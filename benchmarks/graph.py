@@ -0,0 +1,41 @@
+"""Seeded synthetic social graphs with power-law popularity and activity."""
+import random
+from itertools import accumulate
+
+
+def zipf_cum_weights(n: int, exponent: float) -> list:
+    """Cumulative weights giving the item of rank r a share of 1 / r^s."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+
+def follow_edges(users: int, mean_following: int, exponent: float = 1.1,
+                 seed: int = 0):
+    """Yields (follower, followee) user indexes without duplicates.
+
+    Out-degrees are exponentially distributed around mean_following, while
+    followees are drawn by a Zipf law, so a few users collect most followers.
+    """
+    rng = random.Random(seed)
+    cum_weights = zipf_cum_weights(users, exponent)
+    population = range(users)
+    for follower in population:
+        k = min(users - 1, int(rng.expovariate(1 / mean_following)) + 1)
+        followees = set(rng.choices(population, cum_weights=cum_weights, k=k))
+        followees.discard(follower)
+        for followee in sorted(followees):
+            yield follower, followee
+
+
+def fleet_authors(users: int, fleets: int, exponent: float = 1.1,
+                  seed: int = 0):
+    """Yields the author index of each fleet, posting rates by a Zipf law.
+
+    Activity ranks are shuffled, so prolific users are not simply the most
+    followed ones.
+    """
+    rng = random.Random(seed + 1)
+    ranked = list(range(users))
+    rng.shuffle(ranked)
+    cum_weights = zipf_cum_weights(users, exponent)
+    for _ in range(fleets):
+        yield rng.choices(ranked, cum_weights=cum_weights)[0]
@@ -0,0 +1,332 @@
+"""Times every API endpoint on a synthetic graph, against a baseline.
+
+Loads a graph from benchmarks.seed (unless --reuse), then calls each
+endpoint of fleeter/api.py --requests times in process, as random users.
+Tokens are signed by a throwaway RSA key, whose public half is served to
+the app by a local JWKS stand-in, so authentication runs as in production.
+Reports throughput and p50/p95/p99 per endpoint, saves them with --save,
+and with --baseline flags endpoints slower than the saved run by more than
+--tolerance, exiting with status 1.
+
+    % source setup.sh
+    % python -m benchmarks.harness --users 10000 --fleets 200000 --save b.json
+    % python -m benchmarks.harness --reuse --baseline b.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import rsa
+from jose import jwk, jwt
+from sqlalchemy import func
+from config import BenchmarkConfig
+from fleeter import create_app, db
+from fleeter import auth
+from fleeter.models import User, Fleet, PurgeJob
+from benchmarks import seed
+from benchmarks.stats import percentiles_ms
+
+
+USER_PERMISSIONS = ['get:newsfeed', 'post:fleets', 'patch:fleets',
+                    'delete:fleets', 'follow/unfollow', 'get:user_follow']
+MOD_PERMISSIONS = ['delete:fleets', 'delete:users', 'get:user_follow']
+MOD_SUBJECT = 'bench|moderator'
+POINTS = (50, 95, 99)
+
+
+class JWKSStandIn:
+    """Serves the public half of an RSA key as a JWKS document.
+
+    The key is fresh, or loaded from key_file (created when missing) so
+    that a long running server keeps trusting it across runs.
+    """
+
+    def __init__(self, port: int = 0, key_file: str = None):
+        if key_file and os.path.exists(key_file):
+            with open(key_file, 'rb') as f:
+                private = rsa.PrivateKey.load_pkcs1(f.read())
+            public = rsa.PublicKey(private.n, private.e)
+        else:
+            public, private = rsa.newkeys(2048)
+            if key_file:
+                with open(key_file, 'wb') as f:
+                    f.write(private.save_pkcs1())
+        self.kid = sha256(str(public.n).encode()).hexdigest()[:16]
+        self.private_key = private.save_pkcs1().decode()
+        key = jwk.construct(public.save_pkcs1().decode(), 'RS256').to_dict()
+        # Some python-jose versions give n and e as bytes
+        key = {k: v.decode() if isinstance(v, bytes) else v
+               for k, v in key.items()}
+        key.update({'kid': self.kid, 'use': 'sig'})
+        body = json.dumps({'keys': [key]}).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', port), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/' \
+                   f'.well-known/jwks.json'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def sign(self, sub: str, permissions: list, ttl: int = 86400) -> str:
+        now = int(time.time())
+        claims = {'iss': f'https://{auth.AUTH0_DOMAIN}/', 'sub': sub,
+                  'aud': auth.API_AUDIENCE, 'iat': now, 'exp': now + ttl,
+                  'permissions': permissions}
+        return jwt.encode(claims, self.private_key, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+
+class Workload:
+    """Builds requests for random users of the loaded graph."""
+
+    def __init__(self, jwks: JWKSStandIn, requests: int, seed: int = 0):
+        self.jwks = jwks
+        self.rng = random.Random(seed + 3)
+        self._tokens = {}
+        # Users left by earlier runs, deleted ones aside
+        self._ids = dict(db.session.query(User.auth0_id, User.id)
+                         .filter(User.auth0_id.like('bench|%'))
+                         .order_by(User.id))
+        self.subjects = list(self._ids)
+        self.mod_token = jwks.sign(MOD_SUBJECT, MOD_PERMISSIONS)
+        # Fleets to patch and to delete, each with its author's index
+        sample = db.session.query(Fleet.id, User.auth0_id)\
+            .join(User, User.id == Fleet.user_id)\
+            .order_by(func.random()).limit(2 * requests).all()
+        if len(sample) < 2 * requests:
+            raise ValueError(f'{2 * requests} fleets needed, '
+                             f'{len(sample)} found')
+        self.to_patch = sample[:requests]
+        self.to_delete = sample[requests:]
+        self.followed = []
+        self.jobs = []
+
+    def user(self) -> str:
+        return self.rng.choice(self.subjects)
+
+    def user_id(self, auth0_id: str = None) -> int:
+        return self._ids[auth0_id or self.user()]
+
+    def headers(self, auth0_id: str) -> dict:
+        token = self._tokens.get(auth0_id)
+        if token is None:
+            token = self._tokens[auth0_id] = self.jwks.sign(
+                auth0_id, USER_PERMISSIONS)
+        return {'Authorization': f'Bearer {token}'}
+
+    def moderator(self) -> dict:
+        return {'Authorization': f'Bearer {self.mod_token}'}
+
+    def follow(self):
+        follower, followee = self.user(), self.user_id()
+        self.followed.append((follower, followee))
+        return 'POST', f'/api/follows/{followee}', None, \
+            self.headers(follower)
+
+    def unfollow(self):
+        follower, followee = self.followed.pop() if self.followed \
+            else (self.user(), self.user_id())
+        return 'DELETE', f'/api/follows/{followee}', None, \
+            self.headers(follower)
+
+    def follow_many(self, method: str):
+        ids = [self.user_id() for _ in range(20)]
+        return method, '/api/follows', {'ids': ids}, \
+            self.headers(self.user())
+
+    def patch_fleet(self):
+        fleet_id, author = self.to_patch.pop()
+        return 'PATCH', f'/api/fleets/{fleet_id}', \
+            {'post': seed._post(self.rng)}, self.headers(author)
+
+    def delete_fleet(self):
+        fleet_id, author = self.to_delete.pop()
+        return 'DELETE', f'/api/fleets/{fleet_id}', None, \
+            self.headers(author)
+
+    def delete_user(self, asynchronous: bool):
+        subject = self.subjects.pop(self.rng.randrange(len(self.subjects)))
+        url = f'/api/users/{self._ids.pop(subject)}'
+        return 'DELETE', url + ('?async=true' if asynchronous else ''), \
+            None, self.moderator()
+
+    def get_job(self):
+        return 'GET', f'/api/jobs/{self.rng.choice(self.jobs)}', None, \
+            self.moderator()
+
+
+# Endpoint -> request builder, run in this order as writes change the graph
+ENDPOINTS = {
+    'GET /api/': lambda w: ('GET', '/api/', None, None),
+    'GET /api/users/<id>/fleets': lambda w: (
+        'GET', f'/api/users/{w.user_id()}/fleets', None, None),
+    'GET /api/users/<id>/fleets/export': lambda w: (
+        'GET', f'/api/users/{w.user_id()}/fleets/export', None, None),
+    'GET /api/users/<id>/following': lambda w: (
+        'GET', f'/api/users/{w.user_id()}/following', None,
+        w.headers(w.user())),
+    'GET /api/users/<id>/followers': lambda w: (
+        'GET', f'/api/users/{w.user_id()}/followers', None,
+        w.headers(w.user())),
+    'GET /api/fleets/newsfeed': lambda w: (
+        'GET', '/api/fleets/newsfeed', None, w.headers(w.user())),
+    'POST /api/fleets': lambda w: (
+        'POST', '/api/fleets', {'post': seed._post(w.rng)},
+        w.headers(w.user())),
+    'POST /api/fleets/batch': lambda w: (
+        'POST', '/api/fleets/batch',
+        {'posts': [seed._post(w.rng) for _ in range(10)]},
+        w.headers(w.user())),
+    'PATCH /api/fleets/<id>': Workload.patch_fleet,
+    'DELETE /api/fleets/<id>': Workload.delete_fleet,
+    'POST /api/follows/<id>': Workload.follow,
+    'DELETE /api/follows/<id>': Workload.unfollow,
+    'POST /api/follows': lambda w: w.follow_many('POST'),
+    'DELETE /api/follows': lambda w: w.follow_many('DELETE'),
+    'DELETE /api/users/<id>': lambda w: w.delete_user(False),
+    'DELETE /api/users/<id>?async=true': lambda w: w.delete_user(True),
+    'GET /api/jobs/<id>': Workload.get_job,
+}
+
+
+def _wait_for_job(job_id: int, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.session.commit()  # Sees the purge thread's latest commit
+        if db.session.query(PurgeJob.status)\
+                .filter(PurgeJob.id == job_id).scalar() not in \
+                ('pending', 'running'):
+            return
+        time.sleep(0.01)
+
+
+def run(client, workload: Workload, requests: int) -> dict:
+    """Calls every endpoint, returning throughput and latency of each."""
+    results = {}
+    for name, build in ENDPOINTS.items():
+        timings, errors = [], 0
+        for _ in range(requests):
+            method, url, body, headers = build(workload)
+            begin = time.perf_counter()
+            res = client.open(url, method=method, json=body, headers=headers)
+            res.get_data()  # Streamed bodies are produced while read
+            timings.append(time.perf_counter() - begin)
+            if res.status_code >= 400:
+                errors += 1
+            elif name.endswith('async=true') and res.status_code == 202:
+                workload.jobs.append(res.get_json()['job_id'])
+                # Lets the purge finish, untimed, so it does not slow down
+                # the requests that follow
+                _wait_for_job(workload.jobs[-1])
+        latency = percentiles_ms(timings, POINTS)
+        results[name] = {'requests': requests, 'errors': errors,
+                         'rps': len(timings) / sum(timings),
+                         **{f'p{p}': latency[p] for p in POINTS}}
+    return results
+
+
+def report(results: dict, baseline: dict = None,
+           tolerance: float = 0.2) -> list:
+    """Prints results, returning endpoints slower than the baseline."""
+    regressions = []
+    width = max([36] + [len(name) for name in results])
+    header = f'{"endpoint":<{width}} {"errors":>6} {"req/s":>8} ' + \
+        ' '.join(f'{f"p{p} ms":>9}' for p in POINTS)
+    print(header + ('  vs baseline' if baseline else ''))
+    for name, result in results.items():
+        line = f'{name:<{width}} {result["errors"]:>6} ' \
+            f'{result["rps"]:>8.1f} ' + \
+            ' '.join(f'{result[f"p{p}"]:>9.2f}' for p in POINTS)
+        before = (baseline or {}).get(name)
+        if before is not None:
+            changes = {key: result[key] / before[key] - 1
+                       for key in [f'p{p}' for p in POINTS]}
+            worst = max(changes, key=changes.get)
+            line += f'  {worst} {changes[worst]:+.0%}'
+            if changes['p50'] > tolerance or changes['p99'] > tolerance:
+                regressions.append(name)
+                line += ' REGRESSION'
+        print(line)
+    return regressions
+
+
+def add_report_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--save', help='file to save results to')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown of p50 or p99 flagged, 0.2 is 20%%')
+
+
+def conclude(results: dict, params: dict, args) -> None:
+    """Reports results against --baseline, saves them to --save, and
+    exits with status 1 on regressions."""
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved['params'] != params:
+            print(f'Baseline ran with {saved["params"]}\n', file=sys.stderr)
+        baseline = saved['results']
+    regressions = report(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    seed.add_arguments(parser)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per endpoint')
+    parser.add_argument('--reuse', action='store_true',
+                        help='run on the graph already loaded')
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    params = {k: getattr(args, k) for k in
+              ['users', 'mean_following', 'fleets', 'days', 'seed',
+               'requests']}
+
+    with JWKSStandIn() as jwks:
+        config = type('HarnessConfig', (BenchmarkConfig,),
+                      {'JWKS_URL': jwks.url})
+        app = create_app(config)
+        with app.app_context():
+            if not args.reuse:
+                counts = seed.load(args.users, args.mean_following,
+                                   args.fleets, args.days, args.seed,
+                                   args.chunk_size)
+                print(f'Loaded {counts["fleets"]} fleets and '
+                      f'{counts["follows"]} follows of {counts["users"]} '
+                      f'users in {counts["seconds"]:.1f}s\n')
+            workload = Workload(jwks, args.requests, args.seed)
+            results = run(app.test_client(), workload, args.requests)
+
+    conclude(results, params, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Compares pure fan-out-on-write with the hybrid push/pull newsfeed.
+
+Builds a power-law follow graph, then for each mode posts fleets through the
+ORM (so timeline fan-out runs as in POST /api/fleets) and reads first pages
+of random readers' newsfeeds, reporting p50 and p99 of both.
+
+    % source setup.sh
+    % python -m benchmarks.newsfeed --users 2000 --fleets 5000 --threshold 100
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from fleeter import create_app, db
+from fleeter.models import User, Fleet, Follow
+from benchmarks.graph import follow_edges, fleet_authors
+from benchmarks.stats import percentiles_ms
+
+
+def seed_graph(users: int, mean_following: int, seed: int) -> list:
+    db.drop_all()
+    db.create_all()
+    db.session.execute(User.__table__.insert(),
+                       [{'username': f'user{i}'} for i in range(users)])
+    ids = [i for i, in db.session.query(User.id).order_by(User.id)]
+    db.session.execute(Follow.__table__.insert(), [
+        {'follower_id': ids[a], 'followee_id': ids[b]}
+        for a, b in follow_edges(users, mean_following, seed=seed)])
+    db.session.commit()
+    User.recount()
+    return ids
+
+
+def post_fleets(ids: list, fleets: int, seed: int) -> list:
+    timings = []
+    start = datetime(2020, 1, 1)
+    for i, author in enumerate(fleet_authors(len(ids), fleets, seed=seed)):
+        fleet = Fleet(post=f'fleet {i}', user_id=ids[author],
+                      created_at=start + timedelta(seconds=i))
+        begin = time.perf_counter()
+        fleet.insert()
+        timings.append(time.perf_counter() - begin)
+    return timings
+
+
+def read_newsfeeds(ids: list, reads: int, per_page: int, hybrid: bool,
+                   seed: int) -> list:
+    timings = []
+    rng = random.Random(seed)
+    for _ in range(reads):
+        db.session.expire_all()
+        begin = time.perf_counter()
+        user = User.query.get(rng.choice(ids))
+        if hybrid:
+            user.merged_timeline(limit=per_page)
+        else:
+            user.timeline.limit(per_page).all()
+        timings.append(time.perf_counter() - begin)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--mean-following', type=int, default=20)
+    parser.add_argument('--fleets', type=int, default=5000)
+    parser.add_argument('--reads', type=int, default=1000)
+    parser.add_argument('--threshold', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_app('config.BenchmarkConfig')
+    with app.app_context():
+        per_page = app.config['FLEETS_PER_PAGE']
+        print(f'{"mode":>8} {"write p50":>10} {"write p99":>10} '
+              f'{"read p50":>10} {"read p99":>10}  (ms)')
+        for mode, threshold in [('push', None), ('hybrid', args.threshold)]:
+            app.config['FANOUT_FOLLOWER_THRESHOLD'] = threshold
+            ids = seed_graph(args.users, args.mean_following, args.seed)
+            writes = percentiles_ms(post_fleets(ids, args.fleets, args.seed))
+            reads = percentiles_ms(read_newsfeeds(
+                ids, args.reads, per_page, threshold is not None, args.seed))
+            print(f'{mode:>8} {writes[50]:>10.2f} {writes[99]:>10.2f} '
+                  f'{reads[50]:>10.2f} {reads[99]:>10.2f}')
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
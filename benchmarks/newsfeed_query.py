@@ -0,0 +1,92 @@
+"""Compares the single-query newsfeed with the former UNION + re-sort one.
+
+Seeds one reader following a growing number of authors, each with the same
+number of fleets, then times the first and a deep (cursor) page of the
+reader's newsfeed built both ways, reporting p50 and p99.
+
+    % source setup.sh
+    % python -m benchmarks.newsfeed_query --fleets-per-author 50
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from fleeter import create_app, db
+from fleeter.models import User, Fleet, Follow, seek_before
+from benchmarks.stats import percentiles_ms
+
+
+FOLLOWEES = [10, 100, 1000]
+
+
+def union_newsfeed(user: User):
+    """The newsfeed as built before, a UNION of own and followees' fleets."""
+    own = Fleet.query.filter(Fleet.user_id == user.id)
+    others = Fleet.query.\
+        join(Follow, (Follow.followee_id == Fleet.user_id))\
+        .filter(Follow.follower_id == user.id)
+    return own.union(others)\
+        .order_by(Fleet.created_at.desc(), Fleet.id.desc())
+
+
+def seed(followees: int, fleets_per_author: int) -> int:
+    db.drop_all()
+    db.create_all()
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{i}'} for i in range(followees + 1)])
+    ids = [i for i, in db.session.query(User.id).order_by(User.id)]
+    reader, authors = ids[0], ids[1:]
+    db.session.execute(Follow.__table__.insert(), [
+        {'follower_id': reader, 'followee_id': i} for i in authors])
+
+    start = datetime(2020, 1, 1)
+    db.session.execute(Fleet.__table__.insert(), [
+        {'post': f'fleet {n}', 'user_id': ids[n % len(ids)],
+         'created_at': start + timedelta(seconds=n)}
+        for n in range(len(ids) * fleets_per_author)])
+    db.session.commit()
+    User.recount()
+    return reader
+
+
+def time_pages(build, user: User, per_page: int, deep: tuple,
+               repeat: int) -> dict:
+    timings = {'first': [], 'deep': []}
+    for _ in range(repeat):
+        for page, key in [('first', None), ('deep', deep)]:
+            query = seek_before(build(user), Fleet.created_at, Fleet.id, key)
+            begin = time.perf_counter()
+            query.limit(per_page).all()
+            timings[page].append(time.perf_counter() - begin)
+    return {page: percentiles_ms(t) for page, t in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fleets-per-author', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app('config.BenchmarkConfig')
+    with app.app_context():
+        per_page = app.config['FLEETS_PER_PAGE']
+        print(f'{"followees":>9} {"query":>6} {"first p50":>10} '
+              f'{"first p99":>10} {"deep p50":>10} {"deep p99":>10}  (ms)')
+        for followees in FOLLOWEES:
+            user = User.query.get(seed(followees, args.fleets_per_author))
+            # A page halfway down the newsfeed
+            middle = user.newsfeed.offset(user.newsfeed.count() // 2)\
+                .first()
+            deep = (middle.created_at, middle.id)
+            for name, build in [('union', union_newsfeed),
+                                ('single', lambda u: u.newsfeed)]:
+                result = time_pages(build, user, per_page, deep, args.repeat)
+                print(f'{followees:>9} {name:>6} '
+                      f'{result["first"][50]:>10.2f} '
+                      f'{result["first"][99]:>10.2f} '
+                      f'{result["deep"][50]:>10.2f} '
+                      f'{result["deep"][99]:>10.2f}')
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Compares OFFSET and keyset (cursor) pagination of a user's fleets.
+
+Seeds one user with enough fleets to reach the deepest page, then times
+GET /api/users/<id>/fleets at each page depth with both parameters.
+
+    % source setup.sh
+    % python -m benchmarks.pagination --per-page 10 --repeat 20
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from fleeter import create_app, db
+from fleeter.api import _encode_cursor
+from fleeter.models import User, Fleet
+
+
+PAGES = [1, 100, 10000]
+CHUNK_SIZE = 10000
+
+
+def seed(total: int) -> int:
+    db.drop_all()
+    db.create_all()
+    user = User(username='bench')
+    user.insert()
+
+    start = datetime(2020, 1, 1)
+    rows = ({'post': f'fleet {i}', 'user_id': user.id,
+             'created_at': start + timedelta(seconds=i)}
+            for i in range(total))
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        db.session.execute(Fleet.__table__.insert(), chunk)
+    db.session.commit()
+    User.recount([user.id])
+    return user.id
+
+
+def cursor_before(user: User, page: int, per_page: int) -> str:
+    """Returns the cursor a client would hold when asking for page."""
+    if page == 1:
+        return ''
+    last = user.fleets.offset((page - 1) * per_page - 1).first()
+    return _encode_cursor(last.created_at, last.id)
+
+
+def median_ms(client, url: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert res.status_code == 200, res.status_code
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app('config.BenchmarkConfig')
+    with app.app_context():
+        user_id = seed(max(PAGES) * args.per_page)
+        user = User.query.get(user_id)
+        cursors = {p: cursor_before(user, p, args.per_page) for p in PAGES}
+        client = app.test_client()
+        url = f'/api/users/{user_id}/fleets?per_page={args.per_page}'
+
+        print(f'{"page":>6} {"offset ms":>10} {"cursor ms":>10}')
+        for page in PAGES:
+            offset = median_ms(client, f'{url}&page={page}', args.repeat)
+            keyset = median_ms(client, f'{url}&cursor={cursors[page]}',
+                               args.repeat)
+            print(f'{page:>6} {offset:>10.2f} {keyset:>10.2f}')
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Replays captured API traffic against a running instance.
+
+Sends the requests of a file recorded with CAPTURE_PATH set (see
+fleeter/capture.py) to --url, keeping their original spacing divided by
+--speed: 1 replays in real time, 10 ten times faster, and 0 as fast as
+--concurrency allows. Callers are mapped onto the users of a graph loaded
+by benchmarks.seed, user and fleet ids in paths and bodies onto its ids,
+and tokens are signed by a key the target must trust through JWKS_URL.
+Reports latency per route as benchmarks.harness does, with --save and
+--baseline to compare runs.
+
+    % source setup.sh
+    % python -m benchmarks.seed --users 10000 --fleets 100000
+    % DATABASE_URL=sqlite:////tmp/fleeter_bench.db \\
+      JWKS_URL=http://127.0.0.1:8765/.well-known/jwks.json flask run &
+    % python -m benchmarks.replay capture.jsonl --speed 10 --save r.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from fleeter.capture import read_capture
+from benchmarks import seed
+from benchmarks.harness import JWKSStandIn, USER_PERMISSIONS, \
+    MOD_PERMISSIONS, POINTS, add_report_arguments, conclude
+from benchmarks.stats import percentiles_ms
+
+
+# Every permission, as captures do not tell users from moderators
+PERMISSIONS = sorted(set(USER_PERMISSIONS + MOD_PERMISSIONS))
+
+
+class Replayer:
+    """Turns capture records into requests on a seeded graph."""
+
+    def __init__(self, jwks: JWKSStandIn, url: str, users: int, fleets: int):
+        self.jwks = jwks
+        self.url = url.rstrip('/')
+        self.users = users
+        self.fleets = fleets
+        self._tokens = {}
+
+    def _remap(self, segment: str, value: str) -> str:
+        if segment == '<int:user_id>':
+            return str((int(value) - 1) % self.users + 1)
+        if segment == '<int:fleet_id>':
+            return str((int(value) - 1) % self.fleets + 1)
+        return value
+
+    def path(self, record: dict) -> str:
+        segments = zip(record['route'].split('/'),
+                       record['path'].split('/'))
+        return '/'.join(self._remap(s, v) for s, v in segments)
+
+    def body(self, record: dict):
+        body = record['body']
+        if isinstance(body, dict) and isinstance(body.get('ids'), list):
+            body = dict(body, ids=[
+                (i - 1) % self.users + 1 if isinstance(i, int) else i
+                for i in body['ids']])
+        return body
+
+    def headers(self, actor: str) -> dict:
+        headers = {'Accept-Encoding': 'gzip'}
+        if actor is not None:
+            subject = seed.auth0_id(int(actor, 16) % self.users)
+            token = self._tokens.get(subject)
+            if token is None:
+                token = self._tokens[subject] = self.jwks.sign(
+                    subject, PERMISSIONS)
+            headers['Authorization'] = f'Bearer {token}'
+        return headers
+
+    def request(self, record: dict) -> Request:
+        url = self.url + self.path(record)
+        if record['query']:
+            url += '?' + urlencode([tuple(p) for p in record['query']])
+        headers = self.headers(record['actor'])
+        body = self.body(record)
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        return Request(url, data, headers, method=record['method'])
+
+
+def _send(request: Request) -> int:
+    try:
+        with urlopen(request, timeout=30) as res:
+            res.read()  # Streamed bodies are produced while read
+            return res.status
+    except HTTPError as e:
+        e.read()
+        return e.code
+
+
+def replay(replayer: Replayer, records: list, speed: float = 1,
+           concurrency: int = 16) -> dict:
+    """Sends records at their pace, returning latency per route."""
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    lag = []  # Seconds requests started after they were due
+    lock = threading.Lock()
+
+    def send(record, request, due):
+        begin = time.perf_counter()
+        try:
+            status = _send(request)
+        except (URLError, OSError):
+            status = None
+        elapsed = time.perf_counter() - begin
+        name = f'{record["method"]} {record["route"]}'
+        with lock:
+            timings[name].append(elapsed)
+            lag.append(begin - due)
+            if status is None or status >= 500:
+                errors[name] += 1
+
+    first = records[0]['ts'] if records else 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for record in records:
+            due = start + ((record['ts'] - first) / speed if speed else 0)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            pool.submit(send, record, replayer.request(record), due)
+    seconds = time.perf_counter() - start
+
+    results = {}
+    for name in sorted(timings):
+        latency = percentiles_ms(timings[name], POINTS)
+        results[name] = {'requests': len(timings[name]),
+                         'errors': errors[name],
+                         'rps': len(timings[name]) / seconds,
+                         **{f'p{p}': latency[p] for p in POINTS}}
+    print(f'Replayed {len(records)} requests in {seconds:.1f}s' +
+          (f', up to {max(lag, default=0):.2f}s behind schedule'
+           if speed else '') + '\n')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', type=argparse.FileType('r'),
+                        help='JSON lines file written by CAPTURE_PATH')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='times real time, 0 for as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='requests in flight at most')
+    parser.add_argument('--users', type=int, default=10000,
+                        help='users of the seeded graph')
+    parser.add_argument('--fleets', type=int, default=100000,
+                        help='fleets of the seeded graph')
+    parser.add_argument('--jwks-port', type=int, default=8765)
+    parser.add_argument('--key-file', default=os.path.join(
+        tempfile.gettempdir(), 'fleeter_replay_key.pem'),
+        help='signing key, kept so the target keeps trusting it')
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    records = read_capture(args.capture)
+    params = {'capture': os.path.basename(args.capture.name),
+              'speed': args.speed, 'concurrency': args.concurrency,
+              'users': args.users, 'fleets': args.fleets}
+
+    with JWKSStandIn(args.jwks_port, args.key_file) as jwks:
+        replayer = Replayer(jwks, args.url, args.users, args.fleets)
+        results = replay(replayer, records, args.speed, args.concurrency)
+
+    conclude(results, params, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Generates a seeded synthetic social graph and bulk loads it.
+
+Users follow each other by a power law (see benchmarks.graph), and post at
+exponentially distributed intervals with Zipf distributed activity, so a
+few users write most fleets. Events go through fleeter.importer, which
+loads millions of fleets in minutes, or are written as NDJSON for
+`flask fleeter import`. The same seed always yields the same graph.
+
+    % source setup.sh
+    % python -m benchmarks.seed --users 100000 --fleets 5000000
+    % python -m benchmarks.seed --users 1000 --fleets 10000 -o graph.ndjson
+"""
+import argparse
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+from fleeter import create_app, db
+from fleeter.importer import import_events
+from benchmarks.graph import follow_edges, fleet_authors
+
+
+START = datetime(2020, 1, 1)
+WORDS = ('Los', 'Santos', 'Vinewood', 'heist', 'Franklin', 'Michael',
+         'Trevor', 'Lamar', 'Chop', 'Paleto', 'Bay', 'Sandy', 'Shores',
+         'Maze', 'Bank', 'score', 'chase', 'yoga', 'therapy', 'cable',
+         'car', 'plane', 'Lifeinvader', 'Fame', 'or', 'Shame', 'the', 'a',
+         'just', 'again', 'never', 'best', 'day', 'ever', 'lol', '#GTAV')
+
+
+def username(index: int) -> str:
+    return f'user{index}'
+
+
+def auth0_id(index: int) -> str:
+    """The token subject the benchmark harness signs for user index."""
+    return f'bench|{index}'
+
+
+def _post(rng: random.Random) -> str:
+    return ' '.join(rng.choices(WORDS, k=rng.randint(2, 30)))[:280]
+
+
+def generate_events(users: int, mean_following: int, fleets: int,
+                    days: float = 30, seed: int = 0):
+    """Yields importer events: users, their follows, then fleets by time.
+
+    Follows all date from the start, and fleets follow one another over
+    `days` at exponentially distributed intervals.
+    """
+    rng = random.Random(seed + 2)
+    for i in range(users):
+        yield {'type': 'user', 'username': username(i),
+               'auth0_id': auth0_id(i)}
+
+    created_at = START.isoformat()
+    for follower, followee in follow_edges(users, mean_following, seed=seed):
+        yield {'type': 'follow', 'follower': username(follower),
+               'followee': username(followee), 'created_at': created_at}
+
+    mean_interval = days * 86400 / max(fleets, 1)
+    at = START
+    for author in fleet_authors(users, fleets, seed=seed):
+        at += timedelta(seconds=rng.expovariate(1 / mean_interval))
+        yield {'type': 'fleet', 'username': username(author),
+               'post': _post(rng), 'created_at': at.isoformat()}
+
+
+def load(users: int, mean_following: int, fleets: int, days: float = 30,
+         seed: int = 0, chunk_size: int = 10000, progress=None) -> dict:
+    """Recreates the schema and imports a generated graph into it."""
+    db.drop_all()
+    db.create_all()
+    return import_events(
+        generate_events(users, mean_following, fleets, days, seed),
+        chunk_size, progress)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--mean-following', type=int, default=20)
+    parser.add_argument('--fleets', type=int, default=100000)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('-o', '--output',
+                        help='NDJSON file to write instead of loading')
+    args = parser.parse_args()
+
+    events = generate_events(args.users, args.mean_following, args.fleets,
+                             args.days, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        return
+
+    def progress(counts):
+        print(f'\r{counts["users"]} users, {counts["follows"]} follows, '
+              f'{counts["fleets"]} fleets', end='', file=sys.stderr)
+
+    app = create_app('config.BenchmarkConfig')
+    with app.app_context():
+        counts = load(args.users, args.mean_following, args.fleets,
+                      args.days, args.seed, args.chunk_size, progress)
+    rows = counts['users'] + counts['follows'] + counts['fleets']
+    print(f'\nLoaded {rows} rows in {counts["seconds"]:.1f}s '
+          f'({rows / counts["seconds"]:.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
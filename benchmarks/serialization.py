@@ -0,0 +1,90 @@
+"""Compares JSON serializers and response compression on endpoint payloads.
+
+Seeds one user with fleets and followers, builds the payloads of the fleets,
+newsfeed and followers listings as the endpoints do, then reports encodes
+per second and MB/s of each serializer, and the size of each payload once
+compressed with every available encoding.
+
+    % source setup.sh
+    % python -m benchmarks.serialization --per-page 100
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from fleeter import create_app, db
+from fleeter.api import _get_paginated_user_items
+from fleeter.compress import compress
+from fleeter.models import User, Fleet, Follow
+from fleeter.serializer import SERIALIZERS
+
+
+FIELDS = [('fleets', 'fleets'), ('newsfeed', 'newsfeed'),
+          ('followers', 'followers')]
+
+
+def seed(followers: int, fleets: int) -> int:
+    db.drop_all()
+    db.create_all()
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{i}'} for i in range(followers + 1)])
+    ids = [i for i, in db.session.query(User.id).order_by(User.id)]
+    author = ids[0]
+    db.session.execute(Follow.__table__.insert(), [
+        {'follower_id': i, 'followee_id': author} for i in ids[1:]])
+    start = datetime(2020, 1, 1)
+    db.session.execute(Fleet.__table__.insert(), [
+        {'post': f'Fleet number {n}, posted from Los Santos ☀',
+         'user_id': author, 'created_at': start + timedelta(seconds=n)}
+        for n in range(fleets)])
+    db.session.commit()
+    User.recount()
+    return author
+
+
+def time_encodes(dumps, payload, seconds: float) -> tuple:
+    """Encodes payload for about `seconds`, returning encodes/s and MB/s."""
+    count, size = 0, len(dumps(payload))
+    begin = time.perf_counter()
+    while time.perf_counter() - begin < seconds:
+        dumps(payload)
+        count += 1
+    elapsed = time.perf_counter() - begin
+    return count / elapsed, count * size / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    app = create_app('config.BenchmarkConfig')
+    with app.app_context():
+        author = seed(args.per_page, args.per_page)
+        payloads = {}
+        for field, source in FIELDS:
+            with app.test_request_context(f'/?per_page={args.per_page}'):
+                payloads[field] = _get_paginated_user_items(
+                    user_id=author, field=field, source=source)
+
+        print(f'{"payload":>9} {"serializer":>10} {"bytes":>8} '
+              f'{"encodes/s":>10} {"MB/s":>8}')
+        for field, payload in payloads.items():
+            for name, dumps in SERIALIZERS.items():
+                rate, throughput = time_encodes(dumps, payload, args.seconds)
+                print(f'{field:>9} {name:>10} {len(dumps(payload)):>8} '
+                      f'{rate:>10.0f} {throughput:>8.1f}')
+
+        print(f'\n{"payload":>9} {"encoding":>10} {"bytes":>8} {"ms":>8}')
+        for field, payload in payloads.items():
+            data = SERIALIZERS['json'](payload)
+            for name, encode in compress.encodings:
+                begin = time.perf_counter()
+                size = len(encode(data, app.config['COMPRESS_LEVEL']))
+                elapsed = (time.perf_counter() - begin) * 1000
+                print(f'{field:>9} {name:>10} {size:>8} {elapsed:>8.2f}')
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import statistics
+
+
+def percentiles_ms(timings: list, points=(50, 99)) -> dict:
+    """Maps each percentile point to the timing (seconds) in milliseconds."""
+    if len(timings) == 1:
+        return {p: timings[0] * 1000 for p in points}
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return {p: cuts[p - 1] * 1000 for p in points}
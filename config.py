@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 class Config(object):
@@ -6,10 +7,69 @@ class Config(object):
     TESTING = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Read replicas, as binds replica0, replica1... from a comma separated
+    # list of URLs
+    SQLALCHEMY_BINDS = {f'replica{i}': url for i, url in enumerate(
+        filter(None, os.environ.get('REPLICA_DATABASE_URLS', '').split(',')))}
+    REPLICA_BLUEPRINTS = ('api',)  # Whose GET requests read from replicas
+    REPLICA_CHECK_INTERVAL = 5  # Seconds between health checks of a replica
+    # Seconds a bearer token reads from the primary after writing, None off
+    READ_YOUR_WRITES_WINDOW = 5
+    # Where recent writers are kept: None (per worker) or a Redis URL
+    READ_YOUR_WRITES_URL = os.environ.get('READ_YOUR_WRITES_URL')
+    READ_YOUR_WRITES_SIZE = 10000  # Writers kept per worker when local
     FLEETS_PER_PAGE = 10
     USERS_PER_PAGE = 2
+    # Cache-Control of public fleet listings, None to leave it out
+    FLEETS_CACHE_CONTROL = 'public, no-cache'
+    FLEETS_BATCH_MAX = 50  # Posts accepted by POST /api/fleets/batch
+    FOLLOWS_BATCH_MAX = 200  # User ids accepted by POST/DELETE /api/follows
+    PURGE_CHUNK_SIZE = 1000  # Rows deleted per transaction by user purges
+    TIMELINE_ENABLED = True  # Serve newsfeeds from materialized timelines
+    TIMELINE_LENGTH = 800  # Newest entries kept in each timeline
+    # Fleets posted by users with more followers are pulled at read time
+    # instead of pushed to followers' timelines, None pushes everything
+    FANOUT_FOLLOWER_THRESHOLD = 10000
+    # Newsfeed page cache: None (off), 'local' (per worker) or a Redis URL
+    NEWSFEED_CACHE_URL = os.environ.get('NEWSFEED_CACHE_URL')
+    NEWSFEED_CACHE_SIZE = 10000  # Pages kept per worker by the local backend
+    NEWSFEED_CACHE_TTL = 30  # Seconds, bounds staleness of pulled fleets
+    EXPORT_CHUNK_SIZE = 1000  # Rows fetched and written at a time
+    JSON_SERIALIZER = None  # 'json' or 'orjson', None picks the fastest
+    COMPRESS_MIN_SIZE = 1024  # Bytes, smaller responses are sent as is
+    COMPRESS_LEVEL = 6  # gzip level, brotli quality is mapped from it
+    # Directory shared by worker processes to add up their metrics, None
+    # keeps them per process. Clear it before (re)starting the server.
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 1  # Seconds between writes of worker metrics
+    METRICS_PATH = '/metrics'  # Where Prometheus scrapes, None to hide
+    # JSON lines file where sanitized requests are recorded for replay (see
+    # benchmarks.replay), None off
+    CAPTURE_PATH = os.environ.get('CAPTURE_PATH')
+    CAPTURE_SAMPLE_RATE = 1.0  # Share of requests recorded
+    CAPTURE_BLUEPRINTS = ('api',)  # Whose requests are recorded
+    # Query parameters recorded, others are left out
+    CAPTURE_QUERY_PARAMS = ('page', 'per_page', 'cursor', 'include_length',
+                            'async')
+    # Seconds past which SQL statements are logged as slow, None off
+    SLOW_QUERY_THRESHOLD = 0.5
+    # JSON lines file of slow statements, None logs them as warnings of the
+    # fleeter.slowlog logger
+    SLOW_QUERY_LOG_PATH = os.environ.get('SLOW_QUERY_LOG_PATH')
+    SLOW_QUERY_EXPLAIN = False  # Add EXPLAIN ANALYZE plans on PostgreSQL
+    SLOW_QUERY_EXPLAIN_INTERVAL = 60  # Seconds before explaining one again
+    JWKS_URL = os.environ.get('JWKS_URL')  # Defaults to the Auth0 tenant's
+    JWKS_TTL = 600  # Seconds before cached signing keys are refreshed
+    JWKS_MIN_REFETCH_INTERVAL = 30  # Seconds between refetches on unknown kid
+    TOKEN_CACHE_SIZE = 4096  # Verified tokens kept per worker
 
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL')
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'BENCH_DATABASE_URL',
+        f'sqlite:///{tempfile.gettempdir()}/fleeter_bench.db')
@@ -1,19 +1,41 @@
 import os
+import sqlite3
 from flask import Flask, redirect
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from flask_migrate import Migrate
 from flask_cors import CORS
+from fleeter.cache import newsfeed_cache
+from fleeter.capture import capture
+from fleeter.compress import compress
+from fleeter.metrics import metrics
+from fleeter.replicas import RoutingSQLAlchemy, replicas
+from fleeter.slowlog import slowlog
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 
 
+# SQLite only enforces foreign keys, and so ON DELETE CASCADE, when asked to
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+
 def create_app(config='config.Config'):
     app = Flask(__name__)
     app.config.from_object(config)
 
     db.init_app(app)
     migrate.init_app(app, db)
+    replicas.init_app(app, db)
+    newsfeed_cache.init_app(app)
+    compress.init_app(app)
+    metrics.init_app(app)
+    capture.init_app(app)
+    slowlog.init_app(app)
+    metrics.add_collector('fleeter_newsfeed_cache', newsfeed_cache.stats)
     CORS(app)
 
     @app.after_request
@@ -30,7 +52,13 @@ def create_app(config='config.Config'):
     from fleeter.api import bp as api_bp
     app.register_blueprint(api_bp)
 
-    from fleeter.auth import AUTH0_DOMAIN, API_AUDIENCE
+    from fleeter.commands import cli
+    app.cli.add_command(cli)
+
+    from fleeter.auth import AUTH0_DOMAIN, API_AUDIENCE, jwks, token_cache
+    jwks.init_app(app)
+    token_cache.max_size = app.config['TOKEN_CACHE_SIZE']
+    metrics.add_collector('fleeter_token_cache', token_cache.stats)
     CLIENT_ID = os.environ['CLIENT_ID']
 
     @app.route('/')
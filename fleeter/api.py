@@ -1,8 +1,18 @@
 from __future__ import annotations
 
-from flask import Blueprint, request, current_app, abort, jsonify
-from fleeter.models import User, Fleet
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from hashlib import sha256
+from urllib.parse import urlencode
+from flask import Blueprint, request, current_app, abort, g, \
+    stream_with_context
+from fleeter.cache import newsfeed_cache
+from fleeter.models import User, Fleet, Follow, Timeline, PurgeJob, \
+    seek_before
+from fleeter.purge import start_purge
 from fleeter.auth import requires_auth, AuthError
+from fleeter.serializer import dumps, jsonify
 
 
 bp = Blueprint('api', __name__, url_prefix='/api')
@@ -20,14 +30,43 @@ def _get_user(auth0_id: str, raise_404: bool = True) -> User:
     user = User.query.filter_by(auth0_id=auth0_id).one_or_none()
     if user is None and raise_404:
         abort(404)
+    if user is not None:
+        g.user_id = user.id  # Attributes slow queries to the caller
     return user
 
 
-def _get_paginated_user_items(user_id: int, field: str):
+# Columns the items of each paginated field are sorted by, newest first
+_SORT_KEYS = {
+    'fleets': (Fleet.created_at, Fleet.id),
+    'newsfeed': (Fleet.created_at, Fleet.id),
+    'timeline': (Timeline.created_at, Timeline.fleet_id),
+    'following': (Follow.created_at, Follow.followee_id),
+    'followers': (Follow.created_at, Follow.follower_id),
+}
+
+
+def _encode_cursor(created_at: datetime, item_id: int) -> str:
+    key = json.dumps([created_at.isoformat(), item_id]).encode()
+    return urlsafe_b64encode(key).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        key = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, item_id = json.loads(key)
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, TypeError):
+        abort(400)
+
+
+def _get_paginated_user_items(user_id: int, field: str, source: str = None):
+    """Paginates user.<source> (default to field) into response[field]."""
+    source = source or field
     user = User.query.get_or_404(user_id)
     response = user.to_dict()
 
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     if field.startswith('follow'):
         default_per_page = current_app.config['USERS_PER_PAGE']
     else:
@@ -36,37 +75,138 @@ def _get_paginated_user_items(user_id: int, field: str):
     if page <= 0 or per_page <= 0:
         abort(422)
 
-    query = getattr(user, field)
-    paginated = query.paginate(page=page, per_page=per_page).items
-    response[field] = [i.to_dict() for i in paginated]
-    if field == 'newsfeed':
-        response['newsfeed_length'] = query.count()
+    last_key = _decode_cursor(cursor) if cursor else None
+    offset = 0 if cursor else (page - 1) * per_page
+    # One extra row tells whether there is a next page, without a COUNT
+    if source == 'merged_timeline':
+        rows = user.merged_timeline(limit=per_page + 1, offset=offset,
+                                    before=last_key)
+    else:
+        query = getattr(user, source)
+        created_at, item_id = _SORT_KEYS[source]
+        if field.startswith('follow'):
+            query = query.add_columns(created_at)
+        # Cursors seek past the last item seen, at any depth
+        query = seek_before(query, created_at, item_id, last_key)
+        rows = query.offset(offset).limit(per_page + 1).all()
+    if not rows and page != 1 and not cursor:
+        abort(404)
+
+    if field.startswith('follow'):
+        items = [u for u, _ in rows]
+        keys = [(c, u.id) for u, c in rows]
+    else:
+        items = rows
+        keys = [(f.created_at, f.id) for f in rows]
+    response[field] = [i.to_dict() for i in items[:per_page]]
+    response['next_cursor'] = _encode_cursor(*keys[per_page - 1]) \
+        if len(rows) > per_page else None
+    if field == 'newsfeed' and \
+            request.args.get('include_length', 'true') != 'false':
+        response['newsfeed_length'] = user.newsfeed_length
     response['success'] = True
-    return jsonify(response)
+    return response
+
+
+def _newsfeed_readers(user: User) -> list:
+    """Lists ids of users whose cached newsfeeds show fleets of user."""
+    return user.newsfeed_readers() if newsfeed_cache.enabled else []
+
+
+def _last_modified(user: User) -> datetime:
+    """Returns updated_at of user in naive UTC, to the second as in HTTP."""
+    updated_at = user.updated_at
+    if updated_at.tzinfo is not None:
+        updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return updated_at.replace(microsecond=0)
 
 
 @bp.route('/users/<int:user_id>/fleets', methods=['GET'])
 def get_user_fleets(user_id):
-    return _get_paginated_user_items(user_id=user_id, field='fleets')
+    # Unchanged listings are answered after a single lookup of the user
+    user = User.query.get_or_404(user_id)
+    version = f'{user.id}:{user.updated_at.isoformat()}:' \
+              f'{request.query_string.decode()}'
+    etag = sha256(version.encode()).hexdigest()[:32]
+    last_modified = _last_modified(user)
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        fresh = since is not None and last_modified <= since
+
+    if fresh:
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(_get_paginated_user_items(user_id=user_id,
+                                                     field='fleets'))
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    if current_app.config['FLEETS_CACHE_CONTROL']:
+        response.headers['Cache-Control'] = \
+            current_app.config['FLEETS_CACHE_CONTROL']
+    return response
+
+
+@bp.route('/users/<int:user_id>/fleets/export', methods=['GET'])
+def export_user_fleets(user_id):
+    user = User.query.get_or_404(user_id)
+    username = user.username
+    chunk_size = current_app.config['EXPORT_CHUNK_SIZE']
+    rows = user.export_fleets(chunk_size)
+
+    # Streamed one chunk of lines at a time, without OFFSET or COUNT
+    def generate():
+        lines = []
+        for fleet_id, post, created_at in rows:
+            lines.append(dumps({'id': fleet_id, 'post': post,
+                                'username': username,
+                                'created_at': created_at}))
+            if len(lines) == chunk_size:
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+
+    return current_app.response_class(stream_with_context(generate()),
+                                      mimetype='application/x-ndjson')
 
 
 @bp.route('/users/<int:user_id>/following', methods=['GET'])
 @requires_auth(permission='get:user_follow')
 def get_user_following(payload, user_id):
-    return _get_paginated_user_items(user_id=user_id, field='following')
+    return jsonify(_get_paginated_user_items(user_id=user_id,
+                                             field='following'))
 
 
 @bp.route('/users/<int:user_id>/followers', methods=['GET'])
 @requires_auth(permission='get:user_follow')
 def get_user_followers(payload, user_id):
-    return _get_paginated_user_items(user_id=user_id, field='followers')
+    return jsonify(_get_paginated_user_items(user_id=user_id,
+                                             field='followers'))
 
 
 @bp.route('/fleets/newsfeed', methods=['GET'])
 @requires_auth(permission='get:newsfeed')
 def get_newsfeed(payload):
     user_id = _get_user(payload['sub']).id
-    return _get_paginated_user_items(user_id=user_id, field='newsfeed')
+    if not current_app.config['TIMELINE_ENABLED']:
+        source = 'newsfeed'
+    elif current_app.config['FANOUT_FOLLOWER_THRESHOLD'] is None:
+        source = 'timeline'
+    else:
+        source = 'merged_timeline'
+    if not newsfeed_cache.enabled:
+        return jsonify(_get_paginated_user_items(
+            user_id=user_id, field='newsfeed', source=source))
+
+    page_key = urlencode(sorted(request.args.items(multi=True)))
+    version, response = newsfeed_cache.get(user_id, page_key)
+    if response is None:
+        response = _get_paginated_user_items(user_id=user_id,
+                                             field='newsfeed', source=source)
+        newsfeed_cache.set(user_id, version, page_key, response)
+    return jsonify(response)
 
 
 def _post_or_patch_fleet(auth0_id: str, patch: bool, fleet_id: int = None):
@@ -95,6 +235,7 @@ def _post_or_patch_fleet(auth0_id: str, patch: bool, fleet_id: int = None):
         fleet.update() if patch else fleet.insert()
     except:
         abort(500)
+    newsfeed_cache.invalidate(_newsfeed_readers(user))
     return jsonify({'success': True, 'id': fleet.id})
 
 
@@ -104,6 +245,40 @@ def post_fleet(payload):
     return _post_or_patch_fleet(payload['sub'], patch=False)
 
 
+@bp.route('/fleets/batch', methods=['POST'])
+@requires_auth(permission='post:fleets')
+def post_fleets_batch(payload):
+    user = _get_user(payload['sub'])
+    data = request.get_json()
+    try:
+        posts = data['posts']
+        assert isinstance(posts, list)
+    except (KeyError, TypeError, AssertionError):
+        abort(400)
+    if not 0 < len(posts) <= current_app.config['FLEETS_BATCH_MAX']:
+        abort(422)
+    partial = data.get('partial') is True
+
+    max_length = Fleet.post.type.length
+    valid = [isinstance(p, str) and 0 < len(p) <= max_length for p in posts]
+    if not partial and not all(valid):
+        abort(422)
+
+    try:
+        new_ids = iter(Fleet.insert_many(
+            user.id, [p for p, ok in zip(posts, valid) if ok]))
+    except:
+        abort(500)
+    newsfeed_cache.invalidate(_newsfeed_readers(user))
+    response = {'success': True,
+                'ids': [next(new_ids) if ok else None for ok in valid]}
+    if partial:
+        response['errors'] = [{'index': i, 'error': 422,
+                               'message': 'Unprocessable'}
+                              for i, ok in enumerate(valid) if not ok]
+    return jsonify(response)
+
+
 @bp.route('/fleets/<int:fleet_id>', methods=['PATCH'])
 @requires_auth(permission='patch:fleets')
 def patch_fleet(payload, fleet_id):
@@ -121,10 +296,12 @@ def delete_fleet(payload, fleet_id):
             'description': 'Access forbidden.'
         }, 403)
 
+    readers = _newsfeed_readers(fleet.user)
     try:
         fleet.delete()
     except:
         abort(500)
+    newsfeed_cache.invalidate(readers)
     return jsonify({'success': True, 'id': fleet_id})
 
 
@@ -132,26 +309,90 @@ def delete_fleet(payload, fleet_id):
 @requires_auth(permission='follow/unfollow')
 def follow_or_unfollow(payload, user_id):
     user = _get_user(payload['sub'])
+    reader_id = user.id  # Read before the commit expires user
     other = User.query.get_or_404(user_id)
 
     try:
         action = 'follow' if request.method == 'POST' else 'unfollow'
-        getattr(user, action)(other)
+        changed = getattr(user, action)(other)
         user.update()
     except AssertionError:
         abort(422)
     except:
         abort(500)
+    if changed:
+        newsfeed_cache.invalidate([reader_id])
     return jsonify({'success': True, 'id': user_id})
 
 
+@bp.route('/follows', methods=['POST', 'DELETE'])
+@requires_auth(permission='follow/unfollow')
+def follow_or_unfollow_many(payload):
+    user = _get_user(payload['sub'])
+    reader_id = user.id  # Read before the commit expires user
+    data = request.get_json()
+    try:
+        user_ids = data['ids']
+        assert isinstance(user_ids, list)
+        assert all(type(i) is int for i in user_ids)
+    except (KeyError, TypeError, AssertionError):
+        abort(400)
+    user_ids = list(dict.fromkeys(user_ids))
+    if not 0 < len(user_ids) <= current_app.config['FOLLOWS_BATCH_MAX']:
+        abort(422)
+
+    follow = request.method == 'POST'
+    states = user.follow_states(user_ids)
+    results = []
+    for i in user_ids:
+        if i == reader_id:
+            result = 'self'
+        elif i not in states:
+            result = 'not_found'
+        elif follow:
+            result = 'already_following' if states[i] else 'followed'
+        else:
+            result = 'unfollowed' if states[i] else 'not_following'
+        results.append({'id': i, 'result': result})
+
+    # States may have changed since read, results follow the rows written
+    requested = [r['id'] for r in results
+                 if r['result'] in ('followed', 'unfollowed')]
+    if follow:
+        changed = set(user.follow_many(requested))
+        missed = 'already_following'
+    else:
+        changed = set(user.unfollow_many(requested))
+        missed = 'not_following'
+    for r in results:
+        if r['result'] in ('followed', 'unfollowed') \
+                and r['id'] not in changed:
+            r['result'] = missed
+    if changed:
+        newsfeed_cache.invalidate([reader_id])
+    return jsonify({'success': True, 'results': results})
+
+
 @bp.route('/users/<int:user_id>', methods=['DELETE'])
 @requires_auth(permission='delete:users')
 def delete_user(payload, user_id):
     user = User.query.get_or_404(user_id)
+    if request.args.get('async') == 'true':
+        job = start_purge(user.id)
+        return jsonify({'success': True, 'id': user_id,
+                        'job_id': job.id}), 202
 
+    readers = _newsfeed_readers(user)
     try:
         user.delete()
     except:
         abort(500)
+    newsfeed_cache.invalidate(readers)
     return jsonify({'success': True, 'id': user_id})
+
+
+@bp.route('/jobs/<int:job_id>', methods=['GET'])
+@requires_auth(permission='delete:users')
+def get_job(payload, job_id):
+    job = PurgeJob.query.get_or_404(job_id)
+    return jsonify(dict(job.to_dict(), success=True))
@@ -1,9 +1,11 @@
 import os
-import json
+import hashlib
 from flask import request
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+from fleeter.cache import LRUCache
+from fleeter.jwks import JWKSKeyStore
+from fleeter.metrics import metrics
 
 '''
 Implementations in this module are largely based on
@@ -15,6 +17,11 @@ AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = [os.environ['ALGORITHM']]
 API_AUDIENCE = os.environ['API_AUDIENCE']
 
+jwks = JWKSKeyStore(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+# Decoded payloads of verified tokens, keyed by token digest, until they expire
+token_cache = LRUCache()
+jwks.listeners.append(token_cache.clear)
+
 
 class AuthError(Exception):
     def __init__(self, error, status_code):
@@ -54,8 +61,18 @@ def get_token_auth_header():
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+
+    payload = _verify_decode_jwt(token)
+    if 'exp' in payload:
+        token_cache.set(digest, payload, expires_at=payload['exp'])
+    return payload
+
+
+def _verify_decode_jwt(token):
     unverified_header = jwt.get_unverified_header(token)
     rsa_key = {}
     if 'kid' not in unverified_header:
@@ -64,15 +81,21 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        key = jwks.get_key(unverified_header['kid'])
+    except Exception:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch signing keys.'
+        }, 503)
+    if key is not None:
+        rsa_key = {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        }
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -128,9 +151,10 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with metrics.timer('fleeter_auth_seconds'):
+                token = get_token_auth_header()
+                payload = verify_decode_jwt(token)
+                check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
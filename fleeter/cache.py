@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from fleeter import serializer
+
+
+class LRUCache:
+    """A bounded, thread-safe LRU mapping local to the worker process.
+
+    Entries may carry an absolute expiry time (seconds since the epoch), past
+    which they are dropped on access.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None \
+                    and entry[1] <= time.time():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires_at: float = None) -> None:
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'size': len(self._data), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+
+class LocalBackend:
+    """Cache backend living in the worker process.
+
+    Version stamps are kept apart from pages so that page churn never evicts
+    them, but neither is shared between gunicorn workers.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.pages = LRUCache(max_size)
+        self.versions = LRUCache(max_size * 16)
+
+    def _lru(self, key: str) -> LRUCache:
+        return self.versions if key.startswith('v:') else self.pages
+
+    def get_many(self, keys: list) -> list:
+        return [self._lru(k).get(k) for k in keys]
+
+    def set_many(self, mapping: dict, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        for key, value in mapping.items():
+            self._lru(key).set(key, value, expires_at=expires_at)
+
+    def stats(self) -> dict:
+        return {'evictions': self.pages.evictions}
+
+
+class RedisBackend:
+    """Cache backend on any server speaking the Redis protocol."""
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get_many(self, keys: list) -> list:
+        return self.client.mget(keys)
+
+    def set_many(self, mapping: dict, ttl: float) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, value, ex=int(ttl))
+        pipe.execute()
+
+    def stats(self) -> dict:
+        return {'evictions': self.client.info('stats').get('evicted_keys', 0)}
+
+
+class NewsfeedCache:
+    """Caches rendered newsfeed pages per reader.
+
+    Page keys embed the reader's version stamp, so bumping the stamp of a
+    reader invalidates all of their pages at once. Pages also expire after
+    `ttl` seconds, bounding staleness for changes that bump no stamp.
+    """
+
+    def __init__(self, backend=None, ttl: float = 30,
+                 version_ttl: float = 86400):
+        self.backend = backend
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        url = app.config.get('NEWSFEED_CACHE_URL')
+        if url == 'local':
+            self.backend = LocalBackend(app.config['NEWSFEED_CACHE_SIZE'])
+        elif url:
+            self.backend = RedisBackend(url)
+        else:
+            self.backend = None
+        self.ttl = app.config.get('NEWSFEED_CACHE_TTL', self.ttl)
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get(self, user_id: int, page_key: str) -> tuple:
+        """Returns the reader's version stamp and the cached page, or None.
+
+        The stamp must be handed back to `set`, so that a page rendered while
+        the reader got invalidated is stored under a stamp already dead.
+        """
+        version, = self.backend.get_many([f'v:{user_id}'])
+        version = int(version or 0)
+        page, = self.backend.get_many([f'nf:{user_id}:{version}:{page_key}'])
+        if page is None:
+            self.misses += 1
+            return version, None
+        self.hits += 1
+        return version, json.loads(page)
+
+    def set(self, user_id: int, version: int, page_key: str,
+            page: dict) -> None:
+        self.backend.set_many({f'nf:{user_id}:{version}:{page_key}':
+                               serializer.dumps(page)}, self.ttl)
+
+    def invalidate(self, user_ids: list) -> None:
+        """Bumps the version stamps of the given readers."""
+        if not self.enabled or not user_ids:
+            return
+        stamp = time.time_ns()
+        self.backend.set_many({f'v:{i}': stamp for i in user_ids},
+                              self.version_ttl)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {'hits': self.hits, 'misses': self.misses,
+                 'hit_ratio': self.hits / lookups if lookups else 0.0}
+        if self.enabled:
+            stats.update(self.backend.stats())
+        return stats
+
+
+newsfeed_cache = NewsfeedCache()
@@ -0,0 +1,95 @@
+import json
+import os
+import random
+import time
+from hashlib import sha256
+from flask import g, request
+from jose import jwt
+from fleeter.serializer import dumps
+
+
+def _mask(value):
+    """Replaces strings by as many x, keeping the shape of a JSON body."""
+    if isinstance(value, str):
+        return 'x' * len(value)
+    if isinstance(value, list):
+        return [_mask(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _mask(v) for k, v in value.items()}
+    return value
+
+
+def _actor(authorization: str):
+    """A pseudonym of the token subject, stable across the user's tokens."""
+    try:
+        sub = jwt.get_unverified_claims(authorization.split()[1])['sub']
+    except Exception:
+        return None
+    return sha256(sub.encode()).hexdigest()[:16]
+
+
+class TrafficCapture:
+    """Appends sanitized records of requests to a JSON lines file.
+
+    Each record has the start time, method, route, path, allowed query
+    parameters, the JSON body with its strings masked, a pseudonym of the
+    caller, the status and the duration, streaming included. Tokens,
+    headers and post contents are never written. Records are appended with
+    a single write each, so gunicorn workers can share the file.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._fd = None
+
+    def init_app(self, app):
+        self.path = app.config['CAPTURE_PATH']
+        if not self.path:
+            return
+        self.sample_rate = app.config['CAPTURE_SAMPLE_RATE']
+        self.blueprints = app.config['CAPTURE_BLUEPRINTS']
+        self.query_params = set(app.config['CAPTURE_QUERY_PARAMS'])
+        self._fd = os.open(self.path,
+                           os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        if request.blueprint in self.blueprints \
+                and random.random() < self.sample_rate:
+            g.capture_ts = time.time()
+            g.capture_start = time.perf_counter()
+
+    def after_request(self, response):
+        if 'capture_start' in g:
+            g.capture_status = response.status_code
+        return response
+
+    def teardown_request(self, exc=None):
+        start = g.pop('capture_start', None)
+        if start is None:
+            return
+        authorization = request.headers.get('Authorization')
+        record = {
+            'ts': round(g.pop('capture_ts'), 6),
+            'method': request.method,
+            'route': request.url_rule.rule,
+            'path': request.path,
+            'query': [[k, v] for k, v in request.args.items(multi=True)
+                      if k in self.query_params],
+            'body': _mask(request.get_json(silent=True)),
+            'actor': _actor(authorization) if authorization else None,
+            'status': g.pop('capture_status', 500),
+            'duration': round(time.perf_counter() - start, 6),
+        }
+        os.write(self._fd, dumps(record) + b'\n')
+
+
+def read_capture(file) -> list:
+    """Loads the records of a capture file, oldest first."""
+    records = [json.loads(line) for line in file if line.strip()]
+    return sorted(records, key=lambda r: r['ts'])
+
+
+capture = TrafficCapture()
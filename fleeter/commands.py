@@ -0,0 +1,66 @@
+import click
+from flask.cli import AppGroup
+from fleeter.importer import EventError, import_events, read_csv, \
+    read_ndjson
+from fleeter.models import User
+from fleeter.purge import resume_purges
+
+
+cli = AppGroup('fleeter', help='Fleeter maintenance commands.')
+
+
+@cli.command('check-counters')
+@click.option('--repair', is_flag=True,
+              help='Recompute the counters found to be wrong.')
+def check_counters(repair):
+    """Checks denormalized user counters against the real row counts."""
+    drift = User.counter_drift()
+    for user_id, counter, stored, actual in drift:
+        click.echo(f'user {user_id}: {counter} is {stored}, '
+                   f'should be {actual}')
+    if not drift:
+        click.echo('All counters are correct.')
+    elif repair:
+        User.recount(sorted({user_id for user_id, *_ in drift}))
+        click.echo(f'Repaired {len(drift)} counter(s).')
+    else:
+        raise SystemExit(1)
+
+
+@cli.command('import')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              help='Input format, default to the file extension.')
+@click.option('--chunk-size', default=10000, show_default=True,
+              help='Events inserted per transaction.')
+def import_(file, fmt, chunk_size):
+    """Bulk imports users, fleets and follows from a CSV or NDJSON FILE.
+
+    CSV rows are `username,event[,created_at]` as in data/gtav_events.csv,
+    NDJSON lines are objects with a `type` of user, fleet or follow.
+    """
+    if fmt is None:
+        fmt = 'ndjson' if file.name.endswith(('.ndjson', '.jsonl')) \
+            else 'csv'
+    events = read_ndjson(file) if fmt == 'ndjson' else read_csv(file)
+
+    def progress(counts):
+        click.echo(', '.join(f'{n} {table}' for table, n in counts.items()),
+                   err=True)
+
+    try:
+        result = import_events(events, chunk_size, progress)
+    except EventError as e:
+        raise click.UsageError(f'{file.name}, line {e.line}: {e}')
+    seconds = result.pop('seconds')
+    for table, rows in result.items():
+        click.echo(f'Imported {rows} {table} '
+                   f'({rows / seconds:.0f} rows/s).')
+    click.echo(f'Done in {seconds:.2f}s.')
+
+
+@cli.command('resume-purges')
+def resume_purges_():
+    """Runs again user purges left unfinished or failed."""
+    for job in resume_purges():
+        click.echo(f'Purge job {job.id} (user {job.user_id}): {job.status}')
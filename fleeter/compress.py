@@ -0,0 +1,58 @@
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _brotli(data: bytes, level: int) -> bytes:
+    # Brotli qualities run to 11, map gzip's 1-9 onto them
+    return brotli.compress(data, quality=min(11, level + 2))
+
+
+def _gzip(data: bytes, level: int) -> bytes:
+    return gzip.compress(data, compresslevel=level)
+
+
+class Compress:
+    """Compresses JSON responses above a size threshold.
+
+    Brotli is preferred when installed and accepted by the client, then
+    gzip. Streamed responses are left alone, so they start right away.
+    """
+
+    def __init__(self, min_size: int = 1024, level: int = 6):
+        self.min_size = min_size
+        self.level = level
+        self.encodings = [('gzip', _gzip)]
+        if brotli is not None:
+            self.encodings.insert(0, ('br', _brotli))
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', self.min_size)
+        self.level = app.config.get('COMPRESS_LEVEL', self.level)
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        if self.min_size is None or response.is_streamed \
+                or response.direct_passthrough \
+                or response.mimetype != 'application/json':
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 \
+                or 'Content-Encoding' in response.headers:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        for name, compress in self.encodings:
+            if request.accept_encodings[name] > 0:
+                response.set_data(compress(data, self.level))
+                response.headers['Content-Encoding'] = name
+                break
+        return response
+
+
+compress = Compress()
@@ -1,6 +1,7 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint
 from fleeter import db
 from fleeter.auth import AuthError
+from fleeter.serializer import jsonify
 
 
 bp = Blueprint('errors', __name__)
@@ -0,0 +1,248 @@
+import csv
+import io
+import json
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from sqlalchemy import tuple_
+from fleeter import db
+from fleeter.cache import newsfeed_cache
+from fleeter.models import User, Fleet, Follow, mark_unpushed, \
+    rebuild_timelines
+
+
+# Fields each type of event must have
+REQUIRED = {
+    'user': ('username',),
+    'fleet': ('username', 'post'),
+    'follow': ('follower', 'followee'),
+}
+# Longest values of fields, as their columns allow
+MAX_LENGTHS = {
+    'username': User.__table__.c.username.type.length,
+    'follower': User.__table__.c.username.type.length,
+    'followee': User.__table__.c.username.type.length,
+    'auth0_id': User.__table__.c.auth0_id.type.length,
+    'post': Fleet.__table__.c.post.type.length,
+}
+
+
+class EventError(Exception):
+    """An event that cannot be imported, with the line it was read from."""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(message)
+        self.line = line
+
+
+def _checked(event, line: int) -> dict:
+    if not isinstance(event, dict):
+        raise EventError(line, 'expected a JSON object')
+    if event.get('type') not in REQUIRED:
+        raise EventError(line, f'type must be one of {", ".join(REQUIRED)}')
+    for key in REQUIRED[event['type']]:
+        if not isinstance(event.get(key), str):
+            raise EventError(line, f'{event["type"]} event without {key}')
+    for key, length in MAX_LENGTHS.items():
+        value = event.get(key)
+        if value is not None and not isinstance(value, str):
+            raise EventError(line, f'{key} must be a string')
+        if value is not None and len(value) > length:
+            raise EventError(line, f'{key} longer than {length} characters')
+    created_at = event.get('created_at')
+    if created_at:
+        try:
+            datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise EventError(line, f'invalid created_at {created_at!r}')
+    event['line'] = line
+    return event
+
+
+def read_csv(lines):
+    """Yields events from `username,event[,created_at]` rows.
+
+    As in data/gtav_events.csv, an event `follow <username>` follows that
+    user, and any other event is posted as a fleet. Events carry the
+    `line` they were read from.
+    """
+    reader = csv.reader(lines)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 2:
+            raise EventError(reader.line_num,
+                             'expected username,event[,created_at]')
+        username, event, *rest = row
+        created_at = rest[0] if rest else None
+        if event.startswith('follow '):
+            event = {'type': 'follow', 'follower': username,
+                     'followee': event[len('follow '):],
+                     'created_at': created_at}
+        else:
+            event = {'type': 'fleet', 'username': username, 'post': event,
+                     'created_at': created_at}
+        yield _checked(event, reader.line_num)
+
+
+def read_ndjson(lines):
+    """Yields events from lines of JSON objects.
+
+    Each object has a `type` of `user` (`username`, optional `auth0_id`),
+    `fleet` (`username`, `post`) or `follow` (`follower`, `followee`), and
+    fleets and follows may carry an ISO 8601 `created_at`. Events carry the
+    `line` they were read from.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError as e:
+            raise EventError(number, f'invalid JSON: {e}')
+        yield _checked(event, number)
+
+
+def _chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Importer:
+    """Bulk loads events chunk by chunk, without building ORM objects.
+
+    Usernames are resolved through an in-memory map of every user, so each
+    chunk costs one INSERT per table (COPY for fleets on PostgreSQL).
+    Counters and timelines of the users touched are recomputed at the end.
+    """
+
+    def __init__(self, session, chunk_size: int = 10000):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.user_ids = dict(session.query(User.username, User.id))
+        self.auth0_ids = {i for i, in session.query(User.auth0_id)
+                          .filter(User.auth0_id.isnot(None))}
+        self.counts = {'users': 0, 'fleets': 0, 'follows': 0}
+        self.authors = set()
+        self.followers = set()
+        self.followees = set()
+        self.now = datetime.now(timezone.utc)
+
+    def run(self, events, progress=None) -> None:
+        try:
+            for chunk in _chunks(events, self.chunk_size):
+                self._load(chunk)
+                self.session.commit()
+                if progress is not None:
+                    progress(self.counts)
+        except EventError:
+            # Chunks before the invalid event are in, keep them consistent
+            self._finish()
+            raise
+        self._finish()
+
+    def _created_at(self, event: dict) -> datetime:
+        created_at = event.get('created_at')
+        return datetime.fromisoformat(created_at) if created_at else self.now
+
+    def _load(self, chunk: list) -> None:
+        new_users = {}
+        for event in chunk:
+            for key in ('username', 'follower', 'followee'):
+                name = event.get(key)
+                if name is not None and name not in self.user_ids:
+                    new_users.setdefault(name, None)
+            if event['type'] != 'user' or event['username'] not in new_users:
+                continue
+            name, auth0_id = event['username'], event.get('auth0_id')
+            if auth0_id is not None and auth0_id != new_users[name]:
+                # Unique in the table, so COPY or INSERT would fail on it
+                if auth0_id in self.auth0_ids:
+                    raise EventError(event.get('line'),
+                                     f'auth0_id {auth0_id!r} already taken')
+                self.auth0_ids.discard(new_users[name])
+                self.auth0_ids.add(auth0_id)
+                new_users[name] = auth0_id
+        if new_users:
+            self.session.execute(User.__table__.insert(), [
+                {'username': name, 'auth0_id': auth0_id}
+                for name, auth0_id in new_users.items()])
+            self.user_ids.update(
+                self.session.query(User.username, User.id)
+                .filter(User.username.in_(list(new_users))))
+            self.counts['users'] += len(new_users)
+
+        ids = self.user_ids
+        fleets = [(e['post'], ids[e['username']], self._created_at(e))
+                  for e in chunk if e['type'] == 'fleet']
+        if fleets:
+            self._insert_fleets(fleets)
+            self.authors.update(user_id for _, user_id, _ in fleets)
+            self.counts['fleets'] += len(fleets)
+
+        follows = {}
+        for e in chunk:
+            if e['type'] == 'follow' and e['follower'] != e['followee']:
+                key = ids[e['follower']], ids[e['followee']]
+                follows.setdefault(key, self._created_at(e))
+        if follows:
+            existing = self.session.query(Follow.follower_id,
+                                          Follow.followee_id)\
+                .filter(tuple_(Follow.follower_id, Follow.followee_id)
+                        .in_(list(follows)))
+            for key in existing:
+                del follows[tuple(key)]
+        if follows:
+            self.session.execute(Follow.__table__.insert(), [
+                {'follower_id': follower, 'followee_id': followee,
+                 'created_at': created_at}
+                for (follower, followee), created_at in follows.items()])
+            self.followers.update(follower for follower, _ in follows)
+            self.followees.update(followee for _, followee in follows)
+            self.counts['follows'] += len(follows)
+
+    def _insert_fleets(self, rows: list) -> None:
+        connection = self.session.connection()
+        if connection.dialect.name != 'postgresql':
+            self.session.execute(Fleet.__table__.insert(), [
+                {'post': post, 'user_id': user_id, 'created_at': created_at}
+                for post, user_id, created_at in rows])
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert('COPY fleets (post, user_id, created_at) '
+                               'FROM STDIN WITH (FORMAT csv)', buffer)
+
+    def _finish(self) -> None:
+        touched = self.authors | self.followers | self.followees
+        for chunk in _chunks(sorted(touched), self.chunk_size):
+            User.recount(chunk)
+
+        # Timelines showing fleets of the authors, or of the followees, once
+        # fleets of popular authors are left to be pulled. Kept up to date
+        # whatever TIMELINE_ENABLED, as inserts through the ORM keep them
+        readers = set(self.followers)
+        for chunk in _chunks(sorted(self.authors), self.chunk_size):
+            mark_unpushed(self.session.connection(),
+                          Fleet.__table__.c.user_id.in_(chunk))
+            readers.update(chunk)
+            readers.update(i for i, in self.session.query(Follow.follower_id)
+                           .filter(Follow.followee_id.in_(chunk)))
+        for chunk in _chunks(sorted(readers), self.chunk_size):
+            rebuild_timelines(self.session.connection(), chunk)
+            self.session.commit()
+            newsfeed_cache.invalidate(chunk)
+
+
+def import_events(events, chunk_size: int = 10000, progress=None) -> dict:
+    """Imports events, returning rows inserted per table and elapsed time."""
+    start = time.perf_counter()
+    importer = Importer(db.session, chunk_size)
+    importer.run(events, progress)
+    return dict(importer.counts, seconds=time.perf_counter() - start)
@@ -0,0 +1,116 @@
+import json
+import logging
+import threading
+import time
+from urllib.request import urlopen
+from fleeter.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_jwks(url: str, timeout: float = 5) -> dict:
+    """Fetches and parses the JWKS document served at url."""
+    with urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class JWKSKeyStore:
+    """Keeps the signing keys of a JWKS endpoint in process memory.
+
+    Keys are considered fresh for `ttl` seconds. Stale keys keep being served
+    while a background thread fetches the document again, and stay in use for
+    as long as the identity provider cannot be reached. A token signed with an
+    unknown `kid` triggers a blocking refetch, at most once every
+    `min_refetch_interval` seconds. Callables in `listeners` are invoked
+    whenever a fetch brings a key set different from the one in use.
+    """
+
+    def __init__(self, url: str = None, fetcher=fetch_jwks,
+                 ttl: float = 600, min_refetch_interval: float = 30):
+        self.url = url
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.listeners = []
+
+    def init_app(self, app):
+        self.url = app.config.get('JWKS_URL') or self.url
+        self.ttl = app.config.get('JWKS_TTL', self.ttl)
+        self.min_refetch_interval = app.config.get(
+            'JWKS_MIN_REFETCH_INTERVAL', self.min_refetch_interval)
+
+    @property
+    def stale(self) -> bool:
+        return self._fetched_at is None or \
+            time.monotonic() - self._fetched_at >= self.ttl
+
+    def get_key(self, kid: str) -> dict:
+        """Returns the JWK with the given kid, or None if it is unknown.
+
+        Raises whatever the fetcher raises if no key set could ever be loaded.
+        """
+        if self._fetched_at is None:
+            self.refresh()
+        elif self.stale:
+            self.refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._may_refetch():
+            try:
+                self.refresh(rate_limited=True)
+            except Exception:
+                logger.warning('JWKS refetch for unknown kid %s failed', kid,
+                               exc_info=True)
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self, rate_limited: bool = False) -> None:
+        """Fetches the key set synchronously and swaps it in on success."""
+        with self._lock:
+            if rate_limited and not self._may_refetch():
+                return  # Another thread refetched while we were waiting
+            self._attempted_at = time.monotonic()
+            try:
+                with metrics.timer('fleeter_jwks_fetch_seconds'):
+                    jwks = self.fetcher(self.url)
+            except Exception:
+                metrics.inc('fleeter_jwks_fetch_errors_total')
+                raise
+            keys = {k['kid']: k for k in jwks['keys']}
+            rotated = self._fetched_at is not None and keys != self._keys
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        if rotated:
+            for listener in self.listeners:
+                listener()
+
+    def refresh_in_background(self) -> None:
+        # Never wait here: a held lock means a fetch is already under way
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._refreshing or not self._may_refetch():
+                return
+            self._refreshing = True
+        finally:
+            self._lock.release()
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.warning('JWKS refresh failed, serving stale keys',
+                           exc_info=True)
+        finally:
+            self._refreshing = False
+
+    def _may_refetch(self) -> bool:
+        return self._attempted_at is None or \
+            time.monotonic() - self._attempted_at >= self.min_refetch_interval
@@ -0,0 +1,285 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from flask import current_app, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Upper bounds of histogram buckets, in seconds or in queries
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+HELP = {
+    'fleeter_requests_total': 'Requests served, by route, method and status.',
+    'fleeter_request_duration_seconds': 'Request latency, streaming included.',
+    'fleeter_request_db_queries': 'SQL statements executed per request.',
+    'fleeter_request_db_seconds': 'Time spent in SQL statements per request.',
+    'fleeter_db_query_duration_seconds': 'Latency of each SQL statement.',
+    'fleeter_auth_seconds': 'Time to check the bearer token of a request.',
+    'fleeter_jwks_fetch_seconds': 'Time to fetch the signing key set.',
+    'fleeter_jwks_fetch_errors_total': 'Failed fetches of the key set.',
+    'fleeter_serialize_seconds': 'Time to encode JSON response bodies.',
+    'fleeter_slow_queries_total': 'SQL statements over the slow query '
+                                  'threshold.',
+}
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"')
+               .replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in
+                          zip(pairs, escaped)) + '}'
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """Counters, histograms and gauges of the worker process.
+
+    With `directory` set, each process writes its samples to a file of its
+    own there, at most every `flush_interval` seconds, and `collect` adds up
+    the files of all processes, so any gunicorn worker serves the totals.
+    Counters and histograms of exited workers keep counting, whereas gauges
+    (from `add_collector`) only come from processes still alive.
+    """
+
+    def __init__(self, directory: str = None, flush_interval: float = 1):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.collectors = {}  # Prefix -> stats
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        # Also run in forked workers, which must not count their parent's
+        self._pid = os.getpid()
+        self._started = time.time_ns()
+        self._counters = {}
+        self._histograms = {}
+        self._flushed_at = time.monotonic()
+
+    def init_app(self, app):
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        if self.directory:
+            Path(self.directory).mkdir(parents=True, exist_ok=True)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        if app.config['METRICS_PATH']:
+            app.add_url_rule(app.config['METRICS_PATH'], 'metrics',
+                             self.view)
+        if not event.contains(Engine, 'before_cursor_execute',
+                              _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         _after_cursor_execute)
+
+    def add_collector(self, prefix: str, stats) -> None:
+        """Exposes numbers returned by stats() as gauges named prefix_key.
+
+        Ratios are left out, as they do not add up across workers. Adding a
+        prefix again replaces its collector, as each app created does.
+        """
+        self.collectors[prefix] = stats
+
+    def inc(self, name: str, labels: dict = None, value: float = 1) -> None:
+        key = name, _labels(labels)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: dict = None,
+                buckets: tuple = DURATION_BUCKETS) -> None:
+        key = name, _labels(labels)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = \
+                    [list(buckets), [0] * len(buckets), 0, 0.0]
+            bounds, counts, _, _ = histogram
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            histogram[2] += 1
+            histogram[3] += value
+
+    @contextmanager
+    def timer(self, name: str, labels: dict = None,
+              buckets: tuple = DURATION_BUCKETS):
+        """Observes the time spent in the block, even when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels, buckets)
+
+    def _snapshot(self) -> dict:
+        gauges = []
+        for prefix, stats in list(self.collectors.items()):
+            for key, value in stats().items():
+                if not key.endswith('ratio') and \
+                        isinstance(value, (int, float)):
+                    gauges.append([f'{prefix}_{key}', [], value])
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            return {'pid': self._pid,
+                    'counters': [[name, labels, value] for (name, labels),
+                                 value in self._counters.items()],
+                    'histograms': [[name, labels] + list(histogram)
+                                   for (name, labels), histogram
+                                   in self._histograms.items()],
+                    'gauges': gauges}
+
+    def flush(self) -> None:
+        """Writes the samples of this process for others to add up."""
+        if not self.directory:
+            return
+        snapshot = self._snapshot()
+        path = Path(self.directory) / \
+            f'metrics-{snapshot["pid"]}-{self._started}.json'
+        partial = path.with_suffix('.tmp')
+        partial.write_text(json.dumps(snapshot))
+        os.replace(partial, path)
+        self._flushed_at = time.monotonic()
+
+    def collect(self) -> tuple:
+        """Adds up counters, histograms and gauges of all processes."""
+        if self.directory:
+            self.flush()
+            snapshots = []
+            for path in Path(self.directory).glob('metrics-*.json'):
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue  # Replaced or removed while being read
+        else:
+            snapshots = [self._snapshot()]
+
+        counters, histograms, gauges = {}, {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = name, tuple(map(tuple, labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, bounds, counts, count, total in \
+                    snapshot['histograms']:
+                key = name, tuple(map(tuple, labels))
+                merged = histograms.setdefault(
+                    key, [bounds, [0] * len(bounds), 0, 0.0])
+                merged[1] = [a + b for a, b in zip(merged[1], counts)]
+                merged[2] += count
+                merged[3] += total
+            if snapshot['pid'] == os.getpid() or _alive(snapshot['pid']):
+                for name, labels, value in snapshot['gauges']:
+                    key = name, tuple(map(tuple, labels))
+                    gauges[key] = gauges.get(key, 0) + value
+        return counters, histograms, gauges
+
+    def render(self) -> str:
+        """Formats all samples in the Prometheus text exposition format."""
+        counters, histograms, gauges = self.collect()
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in HELP:
+                    lines.append(f'# HELP {name} {HELP[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), (bounds, counts, count, total) in \
+                sorted(histograms.items()):
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                le = _format_labels(labels, [('le', bound)])
+                lines.append(f'{name}_bucket{le} {cumulative}')
+            le = _format_labels(labels, [('le', '+Inf')])
+            lines.append(f'{name}_bucket{le} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        for (name, labels), value in sorted(gauges.items()):
+            describe(name, 'gauge')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        return current_app.response_class(
+            self.render(), content_type='text/plain; version=0.0.4; '
+                                        'charset=utf-8')
+
+    def before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+
+    def after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def teardown_request(self, exc=None):
+        # Runs once streamed responses are done, so their queries count too
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = g.pop('metrics_status', 500)
+        self.inc('fleeter_requests_total', {
+            'route': route, 'method': request.method, 'status': status})
+        self.observe('fleeter_request_duration_seconds',
+                     time.perf_counter() - start,
+                     {'route': route, 'method': request.method})
+        self.observe('fleeter_request_db_queries', g.pop('db_queries'),
+                     {'route': route}, COUNT_BUCKETS)
+        self.observe('fleeter_request_db_seconds', g.pop('db_seconds'),
+                     {'route': route})
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    metrics.observe('fleeter_db_query_duration_seconds', elapsed)
+    if has_request_context() and 'metrics_start' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+metrics = Metrics()
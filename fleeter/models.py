@@ -1,15 +1,34 @@
 from __future__ import annotations
 
-from sqlalchemy import func
+import heapq
+from datetime import datetime, timezone
+from itertools import groupby, islice
+from operator import attrgetter
+from flask import current_app
+from sqlalchemy import and_, func, or_, tuple_, union_all
+from sqlalchemy.dialects import postgresql
 from fleeter import db
 
 
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class Follow(db.Model):
     __tablename__ = 'follow'
+    # Serve following and followers listings in index order
+    __table_args__ = (
+        db.Index('ix_follow_follower_id_created_at',
+                 'follower_id', 'created_at', 'followee_id'),
+        db.Index('ix_follow_followee_id_created_at',
+                 'followee_id', 'created_at', 'follower_id'),
+    )
 
-    follower_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+    follower_id = db.Column(db.Integer,
+                            db.ForeignKey('users.id', ondelete='CASCADE'),
                             primary_key=True)
-    followee_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+    followee_id = db.Column(db.Integer,
+                            db.ForeignKey('users.id', ondelete='CASCADE'),
                             primary_key=True)
     created_at = db.Column(db.TIMESTAMP(timezone=True), nullable=False,
                            server_default=func.now())
@@ -22,17 +41,37 @@ class User(db.Model):
     username = db.Column(db.String(30), index=True,
                          nullable=False, unique=True)
     auth0_id = db.Column(db.String(60), index=True, unique=True)
-    fleets = db.relationship('Fleet', order_by='Fleet.created_at.desc()',
-                             backref='user', cascade='all, delete-orphan',
-                             lazy='dynamic')
+    # Denormalized counters, maintained by the mapper events below
+    total_fleets = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
+    total_following = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+    total_followers = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+    # Version of everything listings of the user show, bumped by any UPDATE
+    # of the row, counters included
+    updated_at = db.Column(db.TIMESTAMP(timezone=True), nullable=False,
+                           default=_now, onupdate=_now,
+                           server_default=func.now())
+    # Authors are joined into every fleet query, as fleets are never
+    # serialized without their username. Rows referencing a deleted user go
+    # away by ON DELETE CASCADE, rather than being loaded and deleted here.
+    fleets = db.relationship('Fleet',
+                             order_by='[Fleet.created_at.desc(), '
+                                      'Fleet.id.desc()]',
+                             backref=db.backref('user', lazy='joined'),
+                             cascade='all, delete-orphan',
+                             passive_deletes=True, lazy='dynamic')
     following = db.relationship(
         'User', secondary='follow',
         primaryjoin=(Follow.follower_id == id),
         secondaryjoin=(Follow.followee_id == id),
-        order_by=Follow.created_at.desc(),
-        backref=db.backref('followers', order_by=Follow.created_at.desc(),
-                           lazy='dynamic'),
-        cascade='all', lazy='dynamic'
+        order_by=[Follow.created_at.desc(), Follow.followee_id.desc()],
+        backref=db.backref('followers',
+                           order_by=[Follow.created_at.desc(),
+                                     Follow.follower_id.desc()],
+                           passive_deletes=True, lazy='dynamic'),
+        passive_deletes=True, lazy='dynamic'
     )
 
     def __repr__(self):
@@ -40,17 +79,102 @@ class User(db.Model):
 
     def to_dict(self):
         return {'id': self.id, 'username': self.username,
-                'total_fleets': self.fleets.count(),
-                'total_following': self.following.count(),
-                'total_followers': self.followers.count()}
+                'total_fleets': self.total_fleets,
+                'total_following': self.total_following,
+                'total_followers': self.total_followers}
 
     @property
     def newsfeed(self):
-        """Fetches fleets of a user's own and other users being followed."""
-        others = Fleet.query.\
-            join(Follow, (Follow.followee_id == Fleet.user_id))\
-            .filter(Follow.follower_id == self.id)
-        return self.fleets.union(others).order_by(Fleet.created_at.desc())
+        """Fetches fleets of a user's own and other users being followed.
+
+        A single query over fleets rather than a UNION per author. Fleets of
+        each author are read through the (user_id, created_at) index, then
+        all of them are sorted, so a page costs every fleet of self and
+        followees, not just the page.
+        """
+        followees = db.session.query(Follow.followee_id)\
+            .filter(Follow.follower_id == self.id).subquery()
+        return Fleet.query.filter(or_(Fleet.user_id == self.id,
+                                      Fleet.user_id.in_(followees)))\
+            .order_by(Fleet.created_at.desc(), Fleet.id.desc())
+
+    def export_fleets(self, chunk_size: int = 1000):
+        """Fetches (id, post, created_at) of all fleets, oldest first.
+
+        Rows come chunk_size at a time from a server-side cursor (on
+        PostgreSQL), so memory stays flat however long the history is.
+        """
+        return db.session.query(Fleet.id, Fleet.post, Fleet.created_at)\
+            .filter(Fleet.user_id == self.id)\
+            .order_by(Fleet.created_at, Fleet.id).yield_per(chunk_size)
+
+    @property
+    def newsfeed_length(self) -> int:
+        """Counts the newsfeed pages can serve, from fleet counters of self
+        and followees.
+
+        With TIMELINE_ENABLED, timelines keep TIMELINE_LENGTH entries, so
+        longer newsfeeds are capped at that many pushed fleets, plus the
+        followees' fleets that are pulled rather than pushed.
+        """
+        followees = db.session.query(func.sum(User.total_fleets))\
+            .join(Follow, Follow.followee_id == User.id)\
+            .filter(Follow.follower_id == self.id).scalar()
+        length = self.total_fleets + (followees or 0)
+        cap = current_app.config['TIMELINE_LENGTH']
+        if not current_app.config['TIMELINE_ENABLED'] or length <= cap:
+            return length
+        pulled = 0
+        if current_app.config['FANOUT_FOLLOWER_THRESHOLD'] is not None:
+            pulled = self.pulled_fleets.order_by(None).count()
+        return min(length - pulled, cap) + pulled
+
+    @property
+    def timeline(self):
+        """Fetches the newsfeed materialized in the user's timeline."""
+        return Fleet.query.join(Timeline, Timeline.fleet_id == Fleet.id)\
+            .filter(Timeline.user_id == self.id)\
+            .order_by(Timeline.created_at.desc(), Timeline.fleet_id.desc())
+
+    def newsfeed_readers(self) -> list:
+        """Lists ids of users whose newsfeeds directly show fleets of self.
+
+        Followers who pull fleets of self at read time are left out.
+        """
+        readers = [self.id]
+        threshold = current_app.config['FANOUT_FOLLOWER_THRESHOLD']
+        if not current_app.config['TIMELINE_ENABLED'] or threshold is None \
+                or self.total_followers <= threshold:
+            readers += [i for i, in db.session.query(Follow.follower_id)
+                        .filter(Follow.followee_id == self.id)]
+        return readers
+
+    @property
+    def pulled_fleets(self):
+        """Fetches fleets of followees that were not pushed to timelines."""
+        followees = db.session.query(Follow.followee_id)\
+            .filter(Follow.follower_id == self.id).subquery()
+        return Fleet.query.filter(Fleet.user_id.in_(followees),
+                                  Fleet.pushed.is_(False))\
+            .order_by(Fleet.created_at.desc(), Fleet.id.desc())
+
+    def merged_timeline(self, limit: int, offset: int = 0,
+                        before: tuple = None) -> list:
+        """Merges the timeline with fleets of followees that are not pushed.
+
+        Fleets posted while their author was above FANOUT_FOLLOWER_THRESHOLD
+        are read with one query, whatever the author's follower count now,
+        and merged into the timeline by (created_at, id).
+        """
+        sources = [seek_before(self.timeline, Timeline.created_at,
+                               Timeline.fleet_id, before),
+                   seek_before(self.pulled_fleets, Fleet.created_at,
+                               Fleet.id, before)]
+        streams = [q.limit(offset + limit).all() for q in sources]
+        merged = heapq.merge(*streams, key=attrgetter('created_at', 'id'),
+                             reverse=True)
+        unique = (next(g) for _, g in groupby(merged, key=attrgetter('id')))
+        return list(islice(unique, offset, offset + limit))
 
     def is_following(self, other: User) -> bool:
         """Checks whether current user is following the other user."""
@@ -58,15 +182,161 @@ class User(db.Model):
         follow = self.following.filter_by(id=other.id).one_or_none()
         return follow is not None
 
-    def follow(self, other: User) -> None:
-        """Follows the other user if not currently following"""
-        if not self.is_following(other):
-            self.following.append(other)
+    def follow(self, other: User) -> bool:
+        """Follows the other user, returning whether it was not followed yet.
 
-    def unfollow(self, other: User) -> None:
-        """Unfollows the other user if currently following"""
-        if self.is_following(other):
-            self.following.remove(other)
+        A single INSERT skipping an existing row, so that concurrent requests
+        cannot race into a primary key violation.
+        """
+        assert self != other
+        connection = db.session.connection()
+        row = {'follower_id': self.id, 'followee_id': other.id}
+        if connection.dialect.name == 'postgresql':
+            statement = postgresql.insert(Follow.__table__).values(row)\
+                .on_conflict_do_nothing()
+        else:
+            statement = Follow.__table__.insert().values(row)\
+                .prefix_with('OR IGNORE')
+        if not connection.execute(statement).rowcount:
+            return False
+        _followed(connection, self.id, [other.id])
+        return True
+
+    def unfollow(self, other: User) -> bool:
+        """Unfollows the other user, returning whether it was followed."""
+        assert self != other
+        connection = db.session.connection()
+        follow = Follow.__table__
+        deleted = connection.execute(
+            follow.delete().where(follow.c.follower_id == self.id)
+            .where(follow.c.followee_id == other.id)).rowcount
+        if not deleted:
+            return False
+        _unfollowed(connection, self.id, [other.id])
+        return True
+
+    def follow_states(self, user_ids: list) -> dict:
+        """Maps each existing user of user_ids to whether self follows them."""
+        rows = db.session.query(User.id, Follow.followee_id)\
+            .outerjoin(Follow, (Follow.followee_id == User.id) &
+                       (Follow.follower_id == self.id))\
+            .filter(User.id.in_(user_ids))
+        return {i: followee_id is not None for i, followee_id in rows}
+
+    def follow_many(self, user_ids: list) -> list:
+        """Follows users with one multi-row INSERT, returning those that were
+        not followed yet.
+
+        As with follow, existing rows are skipped rather than raising, and
+        only rows actually inserted update counters and the timeline.
+        Dialects without RETURNING fall back to one INSERT per user.
+        """
+        if not user_ids:
+            return []
+        connection = db.session.connection()
+        follow = Follow.__table__
+        rows = [{'follower_id': self.id, 'followee_id': i} for i in user_ids]
+        if connection.dialect.name == 'postgresql':
+            followed = [i for i, in connection.execute(
+                postgresql.insert(follow).values(rows)
+                .on_conflict_do_nothing().returning(follow.c.followee_id))]
+        else:
+            statement = follow.insert().prefix_with('OR IGNORE')
+            followed = [row['followee_id'] for row in rows
+                        if connection.execute(statement.values(row))
+                        .rowcount]
+        if followed:
+            _followed(connection, self.id, followed)
+        db.session.commit()
+        return followed
+
+    def unfollow_many(self, user_ids: list) -> list:
+        """Unfollows users with one DELETE, returning those that were
+        followed.
+
+        Only rows actually deleted update counters and the timeline, so
+        concurrent unfollows cannot decrement them twice. Dialects without
+        RETURNING fall back to one DELETE per user.
+        """
+        if not user_ids:
+            return []
+        connection = db.session.connection()
+        follow = Follow.__table__
+        theirs = follow.delete().where(follow.c.follower_id == self.id)
+        if connection.dialect.name == 'postgresql':
+            unfollowed = [i for i, in connection.execute(
+                theirs.where(follow.c.followee_id.in_(user_ids))
+                .returning(follow.c.followee_id))]
+        else:
+            unfollowed = [i for i in user_ids if connection.execute(
+                theirs.where(follow.c.followee_id == i)).rowcount]
+        if unfollowed:
+            _unfollowed(connection, self.id, unfollowed)
+        db.session.commit()
+        return unfollowed
+
+    def remove_followers(self, follower_ids: list) -> list:
+        """Makes users stop following self with one DELETE, returning those
+        that were following.
+
+        As with unfollow_many, only rows actually deleted update counters
+        and timelines, and dialects without RETURNING fall back to one
+        DELETE per follower.
+        """
+        if not follower_ids:
+            return []
+        connection = db.session.connection()
+        follow, timeline = Follow.__table__, Timeline.__table__
+        fleets = Fleet.__table__
+        theirs = follow.delete().where(follow.c.followee_id == self.id)
+        if connection.dialect.name == 'postgresql':
+            removed = [i for i, in connection.execute(
+                theirs.where(follow.c.follower_id.in_(follower_ids))
+                .returning(follow.c.follower_id))]
+        else:
+            removed = [i for i in follower_ids if connection.execute(
+                theirs.where(follow.c.follower_id == i)).rowcount]
+        if removed:
+            _bump_many(connection, removed, User.total_following, -1)
+            _bump(connection, self.id, User.total_followers, -len(removed))
+            mine = db.select([fleets.c.id])\
+                .where(fleets.c.user_id == self.id)
+            connection.execute(timeline.delete()
+                               .where(timeline.c.user_id.in_(removed))
+                               .where(timeline.c.fleet_id.in_(mine)))
+        db.session.commit()
+        return removed
+
+    def delete_fleets(self, limit: int) -> int:
+        """Deletes up to limit fleets of self, returning how many were."""
+        fleets = Fleet.__table__
+        chunk = db.select([fleets.c.id]).where(fleets.c.user_id == self.id)\
+            .limit(limit)
+        connection = db.session.connection()
+        deleted = connection.execute(
+            fleets.delete().where(fleets.c.id.in_(chunk))).rowcount
+        _bump(connection, self.id, User.total_fleets, -deleted)
+        db.session.commit()
+        return deleted
+
+    @staticmethod
+    def counter_drift() -> list:
+        """Lists (user id, counter, stored, actual) for every wrong counter."""
+        drift = []
+        for column, actual in _COUNTERS.items():
+            rows = db.session.query(User.id, column, actual)\
+                .filter(column != actual)
+            drift += [(i, column.key, s, a) for i, s, a in rows]
+        return sorted(drift)
+
+    @staticmethod
+    def recount(user_ids: list = None) -> None:
+        """Recomputes counters of given users (default all) from real rows."""
+        query = User.query
+        if user_ids is not None:
+            query = query.filter(User.id.in_(user_ids))
+        query.update(_COUNTERS, synchronize_session=False)
+        db.session.commit()
 
     def insert(self):
         db.session.add(self)
@@ -76,18 +346,46 @@ class User(db.Model):
         db.session.commit()
 
     def delete(self):
+        # Fleets, follow and timeline rows go away by ON DELETE CASCADE,
+        # bypassing the mapper events, so the other side's counters are fixed
+        # here
+        followees = db.session.query(Follow.followee_id)\
+            .filter(Follow.follower_id == self.id)
+        User.query.filter(User.id.in_(followees.subquery()))\
+            .update({User.total_followers: User.total_followers - 1},
+                    synchronize_session=False)
+        followers = db.session.query(Follow.follower_id)\
+            .filter(Follow.followee_id == self.id)
+        User.query.filter(User.id.in_(followers.subquery()))\
+            .update({User.total_following: User.total_following - 1},
+                    synchronize_session=False)
         db.session.delete(self)
         db.session.commit()
 
 
 class Fleet(db.Model):
     __tablename__ = 'fleets'
+    # Serve fleets of a user in index order, and fleets pulled at read time
+    __table_args__ = (
+        db.Index('ix_fleets_user_id_created_at',
+                 'user_id', 'created_at', 'id'),
+        db.Index('ix_fleets_unpushed_user_id_created_at',
+                 'user_id', 'created_at', 'id',
+                 postgresql_where=db.text('NOT pushed'),
+                 sqlite_where=db.text('NOT pushed')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     post = db.Column(db.String(280), nullable=False)
     created_at = db.Column(db.TIMESTAMP(timezone=True), index=True,
                            nullable=False, server_default=func.now())
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id', ondelete='CASCADE'),
+                        nullable=False)
+    # False when posted while the author was above FANOUT_FOLLOWER_THRESHOLD,
+    # followers then pull the fleet at read time instead of from timelines
+    pushed = db.Column(db.Boolean, nullable=False, default=True,
+                       server_default=db.true())
 
     def __repr__(self):
         return f'<Fleet "{self.post}" by ' \
@@ -96,15 +394,307 @@ class Fleet(db.Model):
     def to_dict(self):
         return {'id': self.id, 'post': self.post,
                 'username': self.user.username,
-                'created_at': str(self.created_at)}
+                'created_at': self.created_at}
 
     def insert(self):
         db.session.add(self)
         db.session.commit()
 
+    @staticmethod
+    def insert_many(user_id: int, posts: list) -> list:
+        """Inserts posts of a user with one multi-row INSERT, returning ids.
+
+        Mapper events do not fire for the core INSERT, so the counter and
+        timelines are updated here. Dialects without RETURNING fall back to
+        one INSERT per post.
+        """
+        if not posts:
+            return []
+        fleets = Fleet.__table__
+        connection = db.session.connection()
+        rows = [{'post': post, 'user_id': user_id,
+                 'pushed': _pushed_when_posted(user_id)} for post in posts]
+        if connection.dialect.name == 'postgresql':
+            ids = [i for i, in connection.execute(
+                fleets.insert().values(rows).returning(fleets.c.id))]
+        else:
+            ids = [connection.execute(fleets.insert().values(row))
+                   .inserted_primary_key[0] for row in rows]
+        _bump(connection, user_id, User.total_fleets, len(ids))
+        push_to_timelines(connection, ids)
+        db.session.commit()
+        return ids
+
     def update(self):
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+
+
+class Timeline(db.Model):
+    """Fan-out-on-write newsfeed: one row per fleet pushed to a reader."""
+    __tablename__ = 'timeline'
+    # Serves a reader's timeline in order, and finds the rows of a fleet
+    # deleted, as cascades from fleets do
+    __table_args__ = (db.Index('ix_timeline_user_id_created_at',
+                               'user_id', 'created_at', 'fleet_id'),
+                      db.Index('ix_timeline_fleet_id', 'fleet_id'))
+
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id', ondelete='CASCADE'),
+                        primary_key=True)
+    fleet_id = db.Column(db.Integer,
+                         db.ForeignKey('fleets.id', ondelete='CASCADE'),
+                         primary_key=True)
+    created_at = db.Column(db.TIMESTAMP(timezone=True), nullable=False)
+
+
+class PurgeJob(db.Model):
+    """Deletion of a user running in the background, see fleeter.purge."""
+    __tablename__ = 'purge_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Not a foreign key, the job outlives the user
+    user_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending',
+                       server_default='pending')
+    deleted_follows = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+    deleted_fleets = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    created_at = db.Column(db.TIMESTAMP(timezone=True), nullable=False,
+                           server_default=func.now())
+    finished_at = db.Column(db.TIMESTAMP(timezone=True))
+
+    def to_dict(self):
+        return {'id': self.id, 'user_id': self.user_id,
+                'status': self.status,
+                'deleted_follows': self.deleted_follows,
+                'deleted_fleets': self.deleted_fleets,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at}
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+
+def _count(column):
+    return db.select([func.count()]).where(column == User.id)\
+        .correlate(User).as_scalar()
+
+
+# Counter column -> correlated subquery computing its real value
+_COUNTERS = {
+    User.total_fleets: _count(Fleet.user_id),
+    User.total_following: _count(Follow.follower_id),
+    User.total_followers: _count(Follow.followee_id),
+}
+
+
+def _bump(connection, user_id: int, column, delta: int) -> None:
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id == user_id)
+                       .values({column.key: users.c[column.key] + delta}))
+
+
+def _bump_many(connection, user_ids: list, column, delta: int) -> None:
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id.in_(user_ids))
+                       .values({column.key: users.c[column.key] + delta}))
+
+
+@db.event.listens_for(Fleet, 'before_insert')
+def _before_fleet_insert(mapper, connection, fleet):
+    fleet.pushed = _pushed_when_posted(fleet.user_id)
+
+
+@db.event.listens_for(Fleet, 'after_insert')
+def _after_fleet_insert(mapper, connection, fleet):
+    _bump(connection, fleet.user_id, User.total_fleets, 1)
+    push_to_timelines(connection, [fleet.id])
+
+
+@db.event.listens_for(Fleet, 'after_update')
+def _after_fleet_update(mapper, connection, fleet):
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id == fleet.user_id)
+                       .values(updated_at=_now()))
+
+
+@db.event.listens_for(Fleet, 'after_delete')
+def _after_fleet_delete(mapper, connection, fleet):
+    _bump(connection, fleet.user_id, User.total_fleets, -1)
+
+
+def _followed(connection, follower_id: int, followee_ids: list) -> None:
+    """Updates counters and the timeline for follow rows just inserted."""
+    _bump(connection, follower_id, User.total_following, len(followee_ids))
+    _bump_many(connection, followee_ids, User.total_followers, 1)
+    backfill_timeline(connection, follower_id, followee_ids)
+
+
+def _unfollowed(connection, follower_id: int, followee_ids: list) -> None:
+    """Updates counters and the timeline for follow rows just deleted."""
+    _bump(connection, follower_id, User.total_following, -len(followee_ids))
+    _bump_many(connection, followee_ids, User.total_followers, -1)
+    prune_timeline(connection, follower_id, followee_ids)
+
+
+@db.event.listens_for(Follow, 'after_insert')
+def _after_follow_insert(mapper, connection, follow):
+    _followed(connection, follow.follower_id, [follow.followee_id])
+
+
+@db.event.listens_for(Follow, 'after_delete')
+def _after_follow_delete(mapper, connection, follow):
+    _unfollowed(connection, follow.follower_id, [follow.followee_id])
+
+
+def seek_before(query, created_at, item_id, key: tuple = None):
+    """Filters a newest-first query to items older than key (keyset)."""
+    if key is None:
+        return query
+    last_created_at, last_id = key
+    return query.filter(created_at <= last_created_at,
+                        or_(created_at < last_created_at, item_id < last_id))
+
+
+def _is_pushed(author_id):
+    """Criterion on authors whose fleets are pushed to their followers."""
+    threshold = current_app.config['FANOUT_FOLLOWER_THRESHOLD']
+    if threshold is None:
+        return db.true()
+    users = User.__table__
+    return author_id.in_(db.select([users.c.id])
+                         .where(users.c.total_followers <= threshold))
+
+
+def _pushed_when_posted(user_id):
+    """Whether a fleet is pushed, computed within its INSERT."""
+    threshold = current_app.config['FANOUT_FOLLOWER_THRESHOLD']
+    if threshold is None:
+        return True
+    users = User.__table__
+    return db.select([users.c.total_followers <= threshold])\
+        .where(users.c.id == user_id).as_scalar()
+
+
+def mark_unpushed(connection, criterion) -> None:
+    """Flags fleets matching criterion as not pushed when their authors are
+    above FANOUT_FOLLOWER_THRESHOLD, so followers pull them at read time."""
+    if current_app.config['FANOUT_FOLLOWER_THRESHOLD'] is None:
+        return
+    fleets = Fleet.__table__
+    connection.execute(fleets.update().where(criterion)
+                       .where(fleets.c.pushed)
+                       .where(~_is_pushed(fleets.c.user_id))
+                       .values(pushed=False))
+
+
+def push_to_timelines(connection, fleet_ids: list) -> None:
+    """Pushes fleets to the timelines of their authors and followers.
+
+    Fleets not pushed, as their authors were above FANOUT_FOLLOWER_THRESHOLD
+    when posting, skip followers who pull them at read time instead.
+    """
+    timeline, fleets = Timeline.__table__, Fleet.__table__
+    follow = Follow.__table__
+    own = db.select([fleets.c.user_id, fleets.c.id, fleets.c.created_at])\
+        .where(fleets.c.id.in_(fleet_ids))
+    followers = db.select([follow.c.follower_id, fleets.c.id,
+                           fleets.c.created_at])\
+        .select_from(fleets.join(follow,
+                                 follow.c.followee_id == fleets.c.user_id))\
+        .where(fleets.c.id.in_(fleet_ids))\
+        .where(fleets.c.pushed)
+    connection.execute(timeline.insert().from_select(
+        ['user_id', 'fleet_id', 'created_at'], union_all(own, followers)))
+    readers = union_all(own.with_only_columns([fleets.c.user_id]),
+                        followers.with_only_columns([follow.c.follower_id]))
+    trim_timelines(connection, readers)
+
+
+def backfill_timeline(connection, follower_id: int,
+                      followee_ids: list) -> None:
+    """Pulls the recent pushed fleets of newly followed users into a
+    timeline."""
+    timeline, fleets = Timeline.__table__, Fleet.__table__
+    present = db.select([timeline.c.fleet_id])\
+        .where(timeline.c.user_id == follower_id)
+    recent = db.select([db.literal(follower_id), fleets.c.id,
+                        fleets.c.created_at])\
+        .where(fleets.c.user_id.in_(followee_ids))\
+        .where(fleets.c.pushed)\
+        .where(fleets.c.id.notin_(present))\
+        .order_by(fleets.c.created_at.desc(), fleets.c.id.desc())\
+        .limit(current_app.config['TIMELINE_LENGTH'])
+    connection.execute(timeline.insert().from_select(
+        ['user_id', 'fleet_id', 'created_at'], recent))
+    trim_timelines(connection, [follower_id])
+
+
+def prune_timeline(connection, follower_id: int, followee_ids: list) -> None:
+    """Removes fleets of unfollowed users from a timeline."""
+    timeline, fleets = Timeline.__table__, Fleet.__table__
+    theirs = db.select([fleets.c.id]).where(fleets.c.user_id.in_(followee_ids))
+    connection.execute(timeline.delete()
+                       .where(timeline.c.user_id == follower_id)
+                       .where(timeline.c.fleet_id.in_(theirs)))
+
+
+def trim_timelines(connection, user_ids) -> None:
+    """Keeps only the newest TIMELINE_LENGTH entries of given timelines.
+
+    The first entry past the cap is sought through the (user_id,
+    created_at) index of each reader, and only timelines that have one
+    delete it and the entries older, so readers under the cap cost one
+    short index walk and no write.
+    """
+    timeline, users = Timeline.__table__, User.__table__
+    newest = timeline.alias()
+    first_over = db.select([newest.c.fleet_id])\
+        .where(newest.c.user_id == users.c.id)\
+        .order_by(newest.c.created_at.desc(), newest.c.fleet_id.desc())\
+        .limit(1).offset(current_app.config['TIMELINE_LENGTH']).as_scalar()
+    cut = db.select([users.c.id.label('user_id'),
+                     first_over.label('fleet_id')])\
+        .where(users.c.id.in_(user_ids)).alias()
+    edge, entries = timeline.alias(), timeline.alias()
+    overflow = db.select([entries.c.user_id, entries.c.fleet_id])\
+        .select_from(cut.join(edge, (edge.c.user_id == cut.c.user_id) &
+                              (edge.c.fleet_id == cut.c.fleet_id))
+                     .join(entries, entries.c.user_id == cut.c.user_id))\
+        .where(or_(entries.c.created_at < edge.c.created_at,
+                   and_(entries.c.created_at == edge.c.created_at,
+                        entries.c.fleet_id <= edge.c.fleet_id)))
+    connection.execute(timeline.delete().where(
+        tuple_(timeline.c.user_id, timeline.c.fleet_id).in_(overflow)))
+
+
+def rebuild_timelines(connection, user_ids) -> None:
+    """Recomputes given timelines from fleets of their users and followees."""
+    timeline, fleets = Timeline.__table__, Fleet.__table__
+    follow = Follow.__table__
+    connection.execute(timeline.delete()
+                       .where(timeline.c.user_id.in_(user_ids)))
+    own = db.select([fleets.c.user_id, fleets.c.id, fleets.c.created_at])\
+        .where(fleets.c.user_id.in_(user_ids))
+    followed = db.select([follow.c.follower_id, fleets.c.id,
+                          fleets.c.created_at])\
+        .select_from(fleets.join(follow,
+                                 follow.c.followee_id == fleets.c.user_id))\
+        .where(follow.c.follower_id.in_(user_ids))\
+        .where(fleets.c.pushed)
+    entries = union_all(own, followed).alias()
+    rank = func.row_number().over(
+        partition_by=entries.c.user_id,
+        order_by=[entries.c.created_at.desc(), entries.c.id.desc()])
+    ranked = db.select([entries.c.user_id, entries.c.id,
+                        entries.c.created_at, rank.label('rank')]).alias()
+    newest = db.select([ranked.c.user_id, ranked.c.id, ranked.c.created_at])\
+        .where(ranked.c.rank <= current_app.config['TIMELINE_LENGTH'])
+    connection.execute(timeline.insert().from_select(
+        ['user_id', 'fleet_id', 'created_at'], newest))
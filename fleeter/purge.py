@@ -0,0 +1,76 @@
+import threading
+from datetime import datetime, timezone
+from flask import current_app
+from fleeter import db
+from fleeter.cache import newsfeed_cache
+from fleeter.models import User, Follow, PurgeJob
+
+
+def start_purge(user_id: int) -> PurgeJob:
+    """Records a purge job for a user and runs it in a background thread."""
+    job = PurgeJob(user_id=user_id)
+    job.insert()
+    app = current_app._get_current_object()
+    threading.Thread(target=_run, args=(app, job.id), daemon=True).start()
+    return job
+
+
+def _run(app, job_id: int) -> None:
+    with app.app_context():
+        purge_user(job_id)
+
+
+def purge_user(job_id: int) -> None:
+    """Deletes a user's follows, then fleets, then the user, in chunks.
+
+    Each chunk of PURGE_CHUNK_SIZE rows commits on its own, so that no lock
+    is held for long, and a job interrupted halfway can simply run again.
+    """
+    job = PurgeJob.query.get(job_id)
+    job.status = 'running'
+    db.session.commit()
+    chunk_size = current_app.config['PURGE_CHUNK_SIZE']
+    try:
+        user = User.query.get(job.user_id)
+        while user is not None:
+            follower_ids = _first_ids(Follow.follower_id,
+                                      Follow.followee_id == user.id,
+                                      chunk_size)
+            followee_ids = [] if follower_ids else \
+                _first_ids(Follow.followee_id, Follow.follower_id == user.id,
+                           chunk_size)
+            if follower_ids:
+                removed = user.remove_followers(follower_ids)
+                newsfeed_cache.invalidate(removed)
+                job.deleted_follows += len(removed)
+            elif followee_ids:
+                job.deleted_follows += len(user.unfollow_many(followee_ids))
+            else:
+                deleted = user.delete_fleets(chunk_size)
+                job.deleted_fleets += deleted
+                if not deleted:
+                    db.session.delete(user)
+                    user = None
+            db.session.commit()
+        job.status = 'done'
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Purge job %s failed', job_id)
+        job.status = 'failed'
+    job.finished_at = datetime.now(timezone.utc)
+    db.session.commit()
+
+
+def _first_ids(column, criterion, limit: int) -> list:
+    return [i for i, in db.session.query(column).filter(criterion)
+            .limit(limit)]
+
+
+def resume_purges() -> list:
+    """Runs again the jobs left unfinished, e.g. by a restarted worker."""
+    jobs = PurgeJob.query.filter(PurgeJob.status.in_(['pending', 'running',
+                                                      'failed']))\
+        .order_by(PurgeJob.id).all()
+    for job in jobs:
+        purge_user(job.id)
+    return jobs
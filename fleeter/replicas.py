@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from hashlib import sha256
+from flask import g, request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.exc import SQLAlchemyError
+from fleeter.cache import LocalBackend, RedisBackend
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingSession(SignallingSession):
+    """Sends the statements of a request routed to a replica to its bind."""
+
+    def get_bind(self, mapper=None, clause=None):
+        bind_key = g.get('replica_bind') if has_request_context() else None
+        if bind_key is None:
+            return super().get_bind(mapper, clause)
+        return get_state(self.app).db.get_engine(self.app, bind=bind_key)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    """Routes read-only requests to replica binds, round-robin.
+
+    Replicas are the `SQLALCHEMY_BINDS` named `replica*`. GET and HEAD
+    requests to `REPLICA_BLUEPRINTS` read from the next healthy one, each
+    checked with a `SELECT 1` every `REPLICA_CHECK_INTERVAL` seconds. Checks
+    run in a background thread, one at a time per replica, so requests only
+    read their last result: a replica is unhealthy until its first check
+    answers, and as long as a check hangs past the interval.
+    For `READ_YOUR_WRITES_WINDOW` seconds after a successful POST, PATCH or
+    DELETE, requests with the same bearer token read from the primary, so
+    clients see their own writes despite replication lag. Should the store
+    of recent writers fail, requests read from the primary.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.app = None
+        self.binds = []
+        self.blueprints = ('api',)
+        self.check_interval = 5
+        self.window = 5
+        self.writes = LocalBackend()
+        self._next = 0
+        self._health = {}
+        self._checking = {}  # Bind -> (started at, thread) of running checks
+        self._lock = threading.Lock()
+
+    def init_app(self, app, db):
+        self.db = db
+        self.app = app
+        self.binds = sorted(k for k in app.config.get('SQLALCHEMY_BINDS') or {}
+                            if k.startswith('replica'))
+        self.blueprints = app.config['REPLICA_BLUEPRINTS']
+        self.check_interval = app.config['REPLICA_CHECK_INTERVAL']
+        self.window = app.config['READ_YOUR_WRITES_WINDOW']
+        url = app.config['READ_YOUR_WRITES_URL']
+        self.writes = RedisBackend(url) if url else LocalBackend(
+            app.config['READ_YOUR_WRITES_SIZE'])
+        self._next = 0
+        self._health = {}
+        self._checking = {}
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def check(self, bind_key: str) -> bool:
+        """Runs the health check of a replica and records its result."""
+        try:
+            engine = self.db.get_engine(self.app, bind=bind_key)
+            with engine.connect() as connection:
+                connection.execute('SELECT 1')
+            healthy = True
+        except SQLAlchemyError:
+            healthy = False
+        with self._lock:
+            self._health[bind_key] = (healthy, time.monotonic())
+            _, thread = self._checking.get(bind_key, (None, None))
+            if thread is threading.current_thread():
+                del self._checking[bind_key]
+        return healthy
+
+    def healthy(self, bind_key: str) -> bool:
+        """Tells whether the replica answered its last check, starting the
+        next one in the background when due."""
+        now = time.monotonic()
+        with self._lock:
+            healthy, checked_at = self._health.get(bind_key, (False, None))
+            running = self._checking.get(bind_key)
+            if running is not None:
+                if now - running[0] < self.check_interval:
+                    return healthy
+                healthy = False  # Hanging, e.g. on connect, try afresh
+            elif checked_at is not None \
+                    and now - checked_at < self.check_interval:
+                return healthy
+            thread = threading.Thread(target=self.check, args=(bind_key,),
+                                      daemon=True)
+            self._checking[bind_key] = (now, thread)
+            thread.start()
+        return healthy
+
+    def choose(self) -> str:
+        """Returns the next healthy replica bind, or None for the primary."""
+        if not self.binds:
+            return None
+        with self._lock:
+            start = self._next
+            self._next = (start + 1) % len(self.binds)
+        for i in range(len(self.binds)):
+            bind_key = self.binds[(start + i) % len(self.binds)]
+            if self.healthy(bind_key):
+                return bind_key
+        return None
+
+    @staticmethod
+    def _writer_key() -> str:
+        token = request.headers.get('Authorization')
+        return f'w:{sha256(token.encode()).hexdigest()}' if token else None
+
+    def before_request(self):
+        if not self.binds or request.method not in ('GET', 'HEAD') \
+                or request.blueprint not in self.blueprints:
+            return
+        key = self._writer_key()
+        if key is not None:
+            try:
+                if self.writes.get_many([key])[0] is not None:
+                    return
+            except Exception:
+                logger.exception('Could not look up recent writers')
+                return
+        g.replica_bind = self.choose()
+
+    def after_request(self, response):
+        if self.binds and self.window \
+                and request.method in ('POST', 'PATCH', 'DELETE') \
+                and response.status_code < 400:
+            key = self._writer_key()
+            if key is not None:
+                try:
+                    self.writes.set_many({key: 1}, self.window)
+                except Exception:
+                    logger.exception('Could not record a recent writer')
+        return response
+
+    def teardown_request(self, exc=None):
+        # g outlives the request when an app context was pushed beforehand,
+        # and streamed responses still read until this runs
+        g.pop('replica_bind', None)
+
+
+replicas = ReplicaRouter()
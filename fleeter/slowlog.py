@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import time
+import traceback
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from fleeter.cache import LRUCache
+from fleeter.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _shape(value):
+    """Describes bound parameters by type, never by value."""
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_shape(v) for v in value]
+    return type(value).__name__
+
+
+def app_stack(source: bool = False) -> list:
+    """Application frames of the current stack, outermost first, with their
+    source lines when source is set."""
+    return [f'{os.path.relpath(f.filename, os.path.dirname(PACKAGE_ROOT))}:'
+            f'{f.lineno} in {f.name}' + (f': {f.line}' if source else '')
+            for f in traceback.extract_stack()
+            if f.filename.startswith(PACKAGE_ROOT)
+            and f.filename != __file__]
+
+
+class SlowQueryLog:
+    """Records SQL statements slower than a threshold as JSON lines.
+
+    Records carry the statement, the types of its parameters, the Flask
+    endpoint and caller's user id when run by a request, and the
+    application frames that issued it. On PostgreSQL, slow SELECTs can be
+    run again under EXPLAIN (ANALYZE), in a savepoint and at most once per
+    `explain_interval` seconds for a given statement, for their plan.
+    """
+
+    def __init__(self):
+        self.threshold = None
+        self._fd = None
+
+    def init_app(self, app):
+        self.threshold = app.config['SLOW_QUERY_THRESHOLD']
+        self.explain = app.config['SLOW_QUERY_EXPLAIN']
+        self.explain_interval = app.config['SLOW_QUERY_EXPLAIN_INTERVAL']
+        self._explained = LRUCache()
+        if self.threshold is None:
+            return
+        path = app.config['SLOW_QUERY_LOG_PATH']
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if path:
+            self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                               0o600)
+        app.teardown_request(self.teardown_request)
+        if not event.contains(Engine, 'before_cursor_execute',
+                              _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         _after_cursor_execute)
+
+    def teardown_request(self, exc=None):
+        g.pop('user_id', None)
+
+    def record(self, conn, statement, parameters, executemany,
+               duration: float) -> dict:
+        if executemany and parameters:
+            # Batches are described by their size and first parameters
+            params = {'rows': len(parameters), 'each': _shape(parameters[0])}
+        else:
+            params = _shape(parameters)
+        record = {
+            'ts': round(time.time(), 6),
+            'duration': round(duration, 6),
+            'statement': ' '.join(statement.split()),
+            'params': params,
+            'executemany': executemany,
+            'endpoint': None,
+            'user_id': None,
+            'stack': app_stack(),
+        }
+        if has_request_context():
+            record.update(endpoint=request.endpoint, method=request.method,
+                          view_args=request.view_args,
+                          user_id=g.get('user_id'))
+        if self.explain and not executemany \
+                and conn.dialect.name == 'postgresql' \
+                and statement.lstrip()[:6].upper() == 'SELECT' \
+                and self._explained.get(statement) is None:
+            self._explained.set(statement, True,
+                                expires_at=time.time() + self.explain_interval)
+            record.update(self._explain(conn, statement, parameters))
+        return record
+
+    def _explain(self, conn, statement, parameters) -> dict:
+        # A failed statement would abort the request's transaction, unless
+        # rolled back to a savepoint
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + statement,
+                               parameters)
+                plan = cursor.fetchone()[0]
+            except Exception as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                return {'explain_error': str(e).strip()}
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return {'plan': plan}
+        finally:
+            cursor.close()
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, default=str)
+        if self._fd is None:
+            logger.warning(line)
+        else:
+            os.write(self._fd, line.encode() + b'\n')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context._slowlog_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    duration = time.perf_counter() - context._slowlog_start
+    if slowlog.threshold is None or duration < slowlog.threshold:
+        return
+    metrics.inc('fleeter_slow_queries_total')
+    try:
+        slowlog.write(slowlog.record(conn, statement, parameters,
+                                     executemany, duration))
+    except Exception:
+        logger.exception('Could not record a slow query')
+
+
+slowlog = SlowQueryLog()
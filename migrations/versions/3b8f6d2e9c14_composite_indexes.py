@@ -0,0 +1,28 @@
+"""composite indexes
+
+Revision ID: 3b8f6d2e9c14
+Revises: 9a7e4c1f2d58
+Create Date: 2026-10-18 14:21:05.317402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8f6d2e9c14'
+down_revision = '9a7e4c1f2d58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_fleets_user_id_created_at', 'fleets', ['user_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_follow_follower_id_created_at', 'follow', ['follower_id', 'created_at', 'followee_id'], unique=False)
+    op.create_index('ix_follow_followee_id_created_at', 'follow', ['followee_id', 'created_at', 'follower_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_follow_followee_id_created_at', table_name='follow')
+    op.drop_index('ix_follow_follower_id_created_at', table_name='follow')
+    op.drop_index('ix_fleets_user_id_created_at', table_name='fleets')
@@ -0,0 +1,35 @@
+"""user counters
+
+Revision ID: 5c1d0e2b7f43
+Revises: dbc11ac269cc
+Create Date: 2026-10-18 10:12:41.503217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1d0e2b7f43'
+down_revision = 'dbc11ac269cc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('total_fleets', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('total_following', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('total_followers', sa.Integer(), server_default='0', nullable=False))
+    op.execute('UPDATE users SET '
+               'total_fleets = (SELECT count(*) FROM fleets '
+               'WHERE fleets.user_id = users.id), '
+               'total_following = (SELECT count(*) FROM follow '
+               'WHERE follow.follower_id = users.id), '
+               'total_followers = (SELECT count(*) FROM follow '
+               'WHERE follow.followee_id = users.id)')
+
+
+def downgrade():
+    op.drop_column('users', 'total_followers')
+    op.drop_column('users', 'total_following')
+    op.drop_column('users', 'total_fleets')
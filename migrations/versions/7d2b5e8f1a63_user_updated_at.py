@@ -0,0 +1,24 @@
+"""user updated_at
+
+Revision ID: 7d2b5e8f1a63
+Revises: e4a1c7b9d302
+Create Date: 2026-10-18 17:12:09.640127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2b5e8f1a63'
+down_revision = 'e4a1c7b9d302'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'updated_at')
@@ -0,0 +1,48 @@
+"""timeline
+
+Revision ID: 9a7e4c1f2d58
+Revises: 5c1d0e2b7f43
+Create Date: 2026-10-18 11:03:27.880152
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a7e4c1f2d58'
+down_revision = '5c1d0e2b7f43'
+branch_labels = None
+depends_on = None
+
+TIMELINE_LENGTH = 800
+
+
+def upgrade():
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('fleet_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['fleet_id'], ['fleets.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'fleet_id')
+    )
+    op.create_index('ix_timeline_user_id_created_at', 'timeline', ['user_id', 'created_at', 'fleet_id'], unique=False)
+    op.create_index('ix_timeline_fleet_id', 'timeline', ['fleet_id'], unique=False)
+    op.execute('INSERT INTO timeline (user_id, fleet_id, created_at) '
+               'SELECT user_id, fleet_id, created_at FROM ('
+               'SELECT t.*, row_number() OVER (PARTITION BY user_id '
+               'ORDER BY created_at DESC, fleet_id DESC) AS rank FROM ('
+               'SELECT fleets.user_id, fleets.id AS fleet_id, '
+               'fleets.created_at FROM fleets '
+               'UNION ALL '
+               'SELECT follow.follower_id, fleets.id, fleets.created_at '
+               'FROM fleets JOIN follow '
+               'ON follow.followee_id = fleets.user_id) AS t) AS ranked '
+               f'WHERE rank <= {TIMELINE_LENGTH}')
+
+
+def downgrade():
+    op.drop_index('ix_timeline_fleet_id', table_name='timeline')
+    op.drop_index('ix_timeline_user_id_created_at', table_name='timeline')
+    op.drop_table('timeline')
@@ -0,0 +1,33 @@
+"""fleet pushed
+
+Revision ID: b6f0d3a9c27e
+Revises: 7d2b5e8f1a63
+Create Date: 2026-10-18 18:40:51.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6f0d3a9c27e'
+down_revision = '7d2b5e8f1a63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('fleets', sa.Column('pushed', sa.Boolean(), server_default=sa.true(), nullable=False))
+    op.create_index('ix_fleets_unpushed_user_id_created_at', 'fleets', ['user_id', 'created_at', 'id'], unique=False, postgresql_where=sa.text('NOT pushed'), sqlite_where=sa.text('NOT pushed'))
+    # Fleets of popular authors were never pushed to their followers
+    threshold = current_app.config['FANOUT_FOLLOWER_THRESHOLD']
+    if threshold is not None:
+        op.execute(sa.text('UPDATE fleets SET pushed = false WHERE user_id IN '
+                           '(SELECT id FROM users WHERE total_followers > :threshold)')
+                   .bindparams(threshold=threshold))
+
+
+def downgrade():
+    op.drop_index('ix_fleets_unpushed_user_id_created_at', table_name='fleets')
+    op.drop_column('fleets', 'pushed')
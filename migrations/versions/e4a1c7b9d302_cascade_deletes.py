@@ -0,0 +1,52 @@
+"""cascade deletes
+
+Revision ID: e4a1c7b9d302
+Revises: 3b8f6d2e9c14
+Create Date: 2026-10-18 16:02:44.508311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a1c7b9d302'
+down_revision = '3b8f6d2e9c14'
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table) of every foreign key made to cascade
+FOREIGN_KEYS = [
+    ('fleets', 'user_id', 'users'),
+    ('follow', 'follower_id', 'users'),
+    ('follow', 'followee_id', 'users'),
+    ('timeline', 'user_id', 'users'),
+    ('timeline', 'fleet_id', 'fleets'),
+]
+
+
+def _recreate_foreign_keys(ondelete):
+    for table, column, referred in FOREIGN_KEYS:
+        name = f'{table}_{column}_fkey'
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, referred, [column], ['id'],
+                              ondelete=ondelete)
+
+
+def upgrade():
+    _recreate_foreign_keys('CASCADE')
+    op.create_table('purge_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=10), server_default='pending', nullable=False),
+    sa.Column('deleted_follows', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('deleted_fleets', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('finished_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('purge_jobs')
+    _recreate_foreign_keys(None)
@@ -1,8 +1,18 @@
 import os
+import json
 import pytest
 import csv
+import time
+import threading
+import rsa
+import socketserver
+from jose import jwk, jwt
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
 from datetime import datetime, timedelta
+# Hooks and fixture of the query_budget marker
+from tests.query_budget import pytest_configure, \
+    pytest_runtest_makereport, query_recorder  # noqa: F401
 
 
 USER_CLIENT_ID = os.environ['USER_CLIENT_ID']
@@ -40,6 +50,19 @@ def session(db):
     db.drop_all()
 
 
+# Collects SQL statements sent to the database while the test runs
+@pytest.fixture(scope='function')
+def queries(db):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    db.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    db.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
 # Initiate test db state for every test
 @pytest.fixture(scope='function', autouse=True)
 def users(session, app):
@@ -71,3 +94,131 @@ def users(session, app):
     session.commit()
 
     return users
+
+
+class JWKSHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.hits += 1
+        if self.server.jwks is None:  # Simulates an unreachable IdP
+            self.send_error(503)
+            return
+        body = json.dumps(self.server.jwks).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# Local stand-in for the Auth0 JWKS endpoint
+@pytest.fixture(scope='function')
+def jwks_server():
+    server = HTTPServer(('127.0.0.1', 0), JWKSHandler)
+    server.jwks = {'keys': []}
+    server.hits = 0
+    server.url = f'http://127.0.0.1:{server.server_port}/.well-known/jwks.json'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope='session')
+def rsa_keys():
+    public, private = rsa.newkeys(1024)
+    return public.save_pkcs1().decode(), private.save_pkcs1().decode()
+
+
+# Serves a stub signing key through fresh auth caches, returns a token signer
+@pytest.fixture(scope='function')
+def sign_token(rsa_keys, monkeypatch):
+    from fleeter import auth
+    from fleeter.cache import LRUCache
+    from fleeter.jwks import JWKSKeyStore
+    public, private = rsa_keys
+    key = jwk.construct(public, 'RS256').to_dict()
+    key.update({'kid': 'stub', 'use': 'sig'})
+
+    store = JWKSKeyStore(fetcher=lambda url: {'keys': [key]})
+    cache = LRUCache()
+    store.listeners.append(cache.clear)
+    monkeypatch.setattr(auth, 'jwks', store)
+    monkeypatch.setattr(auth, 'token_cache', cache)
+
+    def sign(permissions=(), sub=USER_CLIENT_ID + '@clients', ttl=3600):
+        now = int(time.time())
+        claims = {'iss': f'https://{auth.AUTH0_DOMAIN}/', 'sub': sub,
+                  'aud': auth.API_AUDIENCE, 'iat': now, 'exp': now + ttl,
+                  'permissions': list(permissions)}
+        return jwt.encode(claims, private, algorithm='RS256',
+                          headers={'kid': 'stub'})
+
+    return sign
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough of the Redis protocol for the cache backend."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(value, list):
+            self.wfile.write(b'*%d\r\n' % len(value))
+            for item in value:
+                self.reply(item)
+        else:
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command, keys = args[0].upper(), args[1:]
+            now = time.time()
+            for key in keys:
+                if key in store and store[key][1] is not None \
+                        and store[key][1] <= now:
+                    del store[key]
+            if command == b'GET':
+                self.reply(store.get(keys[0], (None,))[0])
+            elif command == b'MGET':
+                self.reply([store.get(k, (None,))[0] for k in keys])
+            elif command == b'SET':
+                ttl = int(args[4]) if len(args) > 4 else None
+                store[args[1]] = (args[2], now + ttl if ttl else None)
+                self.wfile.write(b'+OK\r\n')
+            elif command == b'INFO':
+                self.reply(b'# Stats\r\nevicted_keys:0\r\n')
+            else:
+                self.wfile.write(b'-ERR unknown command\r\n')
+
+
+# Local stand-in for a Redis server
+@pytest.fixture(scope='function')
+def redis_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RedisHandler)
+    server.daemon_threads = True
+    server.store = {}
+    server.url = f'redis://127.0.0.1:{server.server_address[1]}/0'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,120 @@
+"""SQL budgets per request and N+1 detection for API tests.
+
+Mark a test, or a test class, with `@pytest.mark.query_budget(n)` to fail
+it whenever a request made through the Flask test client runs more than n
+SQL statements, or runs one statement more than `repeats` times (default
+to 1), which is how an N+1 pattern shows up. Failures list the offending
+statements along with the application frames that issued them.
+"""
+import threading
+from collections import Counter
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from fleeter.slowlog import app_stack
+
+
+class QueryRecorder:
+    """Groups SQL statements by the test client request that ran them."""
+
+    def __init__(self):
+        self.requests = []  # (method and path, [(statement, stack)])
+        self._current = None
+        self._thread = None
+
+    def wrap(self, wsgi_app):
+        def app(environ, start_response):
+            self._current = []
+            self._thread = threading.get_ident()
+            self.requests.append((f'{environ["REQUEST_METHOD"]} '
+                                  f'{environ["PATH_INFO"]}', self._current))
+            try:
+                iterable = wsgi_app(environ, start_response)
+            except BaseException:
+                self._current = None
+                raise
+            return self._drain(iterable)
+        return app
+
+    def _drain(self, iterable):
+        # Streamed bodies keep running statements while being read
+        try:
+            yield from iterable
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            self._current = None
+
+    def before_cursor_execute(self, conn, cursor, statement, *args):
+        # Background threads started by the request, e.g. purges, are not
+        # part of it
+        if self._current is not None \
+                and threading.get_ident() == self._thread:
+            self._current.append((statement, app_stack(source=True)))
+
+    def problems(self, budget: int, repeats: int = 1) -> list:
+        """Describes requests over budget and statements repeated in one."""
+        problems = []
+        for label, statements in self.requests:
+            if len(statements) > budget:
+                lines = [f'{label} ran {len(statements)} SQL statements, '
+                         f'over its budget of {budget}:']
+                for i, (statement, stack) in enumerate(statements, 1):
+                    caller = stack[-1] if stack else 'outside fleeter'
+                    lines.append(f'  {i}. {" ".join(statement.split())}')
+                    lines.append(f'     from {caller}')
+                problems.append('\n'.join(lines))
+            counts = Counter(statement for statement, _ in statements)
+            for statement, count in counts.items():
+                if count <= repeats:
+                    continue
+                lines = [f'{label} ran the same statement {count} times, '
+                         f'likely an N+1 query:',
+                         f'  {" ".join(statement.split())}']
+                stacks = []
+                for st, stack in statements:
+                    if st == statement and stack not in stacks:
+                        stacks.append(stack)
+                for stack in stacks:
+                    lines.append('  issued from:')
+                    lines += [f'    {frame}' for frame in stack]
+                problems.append('\n'.join(lines))
+        return problems
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'query_budget(n, repeats=1): fail requests running more '
+                   'than n SQL statements, or repeating one statement')
+
+
+@pytest.fixture(scope='function', autouse=True)
+def query_recorder(request):
+    """Records statements per request in tests marked with query_budget."""
+    if request.node.get_closest_marker('query_budget') is None:
+        yield None
+        return
+    app = request.getfixturevalue('app')
+    recorder = QueryRecorder()
+    wsgi_app = app.wsgi_app
+    app.wsgi_app = recorder.wrap(wsgi_app)
+    event.listen(Engine, 'before_cursor_execute',
+                 recorder.before_cursor_execute)
+    yield recorder
+    event.remove(Engine, 'before_cursor_execute',
+                 recorder.before_cursor_execute)
+    app.wsgi_app = wsgi_app
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    report = outcome.get_result()
+    recorder = item.funcargs.get('query_recorder')
+    if report.when != 'call' or not report.passed or recorder is None:
+        return
+    marker = item.get_closest_marker('query_budget')
+    problems = recorder.problems(*marker.args, **marker.kwargs)
+    if problems:
+        report.outcome = 'failed'
+        report.longrepr = '\n\n'.join(problems)
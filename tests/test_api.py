@@ -1,9 +1,11 @@
 import os
 import json
+import time
 import pytest
 import requests
 from fleeter.auth import AUTH0_DOMAIN, API_AUDIENCE
-from fleeter.models import Fleet, Follow, User
+from fleeter.cache import LocalBackend, newsfeed_cache
+from fleeter.models import Fleet, Follow, User, trim_timelines
 
 
 USER_CLIENT_ID = os.environ['USER_CLIENT_ID']
@@ -41,6 +43,7 @@ def mod_client(app):
     return mc
 
 
+@pytest.mark.query_budget(2)
 class TestGetUserFleets:
 
     url = '/api/users/4/fleets'  # Trevor
@@ -56,6 +59,32 @@ class TestGetUserFleets:
         assert data['total_followers'] == 1
         assert len(data['fleets']) <= app.config['FLEETS_PER_PAGE']
 
+    def test_cursor_pagination(self, client):
+        ids, cursor = [], ''
+        while cursor is not None:
+            res = client.get(self.url + f'?per_page=2&cursor={cursor}')
+            data = json.loads(res.data)
+            assert res.status_code == 200
+            assert len(data['fleets']) <= 2
+            ids += [f['id'] for f in data['fleets']]
+            cursor = data['next_cursor']
+
+        res = client.get(self.url + '?per_page=5')
+        data = json.loads(res.data)
+        assert ids == [f['id'] for f in data['fleets']]
+        assert data['next_cursor'] is None
+
+    def test_page_and_cursor_agree(self, client):
+        page1 = json.loads(client.get(self.url + '?per_page=2').data)
+        page2 = json.loads(client.get(self.url + '?per_page=2&page=2').data)
+        after = json.loads(client.get(
+            self.url + f'?per_page=2&cursor={page1["next_cursor"]}').data)
+        assert after['fleets'] == page2['fleets']
+
+    def test_400_malformed_cursor(self, client):
+        res = client.get(self.url + '?cursor=not-a-cursor')
+        assert res.status_code == 400
+
     def test_404_user_not_exist(self, client):
         res = client.get('/api/users/10/fleets')
         assert res.status_code == 404
@@ -71,7 +100,75 @@ class TestGetUserFleets:
         res = client.get(self.url + '?page=20')
         assert res.status_code == 404
 
+    def test_304_not_modified(self, client, session, queries, app):
+        headers = client.get(self.url).headers
+        assert headers['Cache-Control'] == app.config['FLEETS_CACHE_CONTROL']
+
+        session.expire_all()
+        queries.clear()
+        res = client.get(self.url,
+                         headers={'If-None-Match': headers['ETag']})
+        assert res.status_code == 304
+        assert res.data == b''
+        assert len(queries) == 1
+
+        res = client.get(self.url, headers={
+            'If-Modified-Since': headers['Last-Modified']})
+        assert res.status_code == 304
+
+    def test_etag_changes_with_content(self, client, users):
+        etags = {client.get(self.url).headers['ETag'],
+                 client.get(self.url + '?per_page=2').headers['ETag']}
+
+        fleet = users['Trevor'].fleets.first()
+        fleet.post = 'Minor Turbulence'
+        fleet.update()
+        etags.add(client.get(self.url).headers['ETag'])
+
+        users['Michael'].follow(users['Trevor'])
+        users['Michael'].update()
+        res = client.get(self.url, headers={'If-None-Match': etags.pop()})
+        assert res.status_code == 200
+        assert res.headers['ETag'] not in etags
+        assert len(etags) == 2
+
+
+@pytest.mark.query_budget(2)
+class TestExportUserFleets:
+
+    url = '/api/users/4/fleets/export'  # Trevor
+
+    def test_export(self, client, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'EXPORT_CHUNK_SIZE', 2)
+        res = client.get(self.url)
+        fleets = [json.loads(line) for line in res.data.splitlines()]
+        assert res.status_code == 200
+        assert res.mimetype == 'application/x-ndjson'
+        assert res.data.endswith(b'\n')
+
+        data = json.loads(client.get('/api/users/4/fleets').data)
+        assert fleets == data['fleets'][::-1]
+
+    def test_streamed(self, client):
+        res = client.get(self.url, buffered=False)
+        assert res.is_streamed
+        assert 'Content-Length' not in res.headers
+        assert next(res.response).startswith(b'{')
+        res.close()
+
+    def test_no_fleets(self, client, users):
+        for fleet in users['player'].fleets:
+            fleet.delete()
+        res = client.get('/api/users/1/fleets/export')
+        assert res.status_code == 200
+        assert res.data == b''
+
+    def test_404(self, client):
+        res = client.get('/api/users/1000/fleets/export')
+        assert res.status_code == 404
+
 
+@pytest.mark.query_budget(2)
 class TestGetUserFollowing:
 
     url = '/api/users/3/following'  # Franklin
@@ -108,6 +205,7 @@ class TestGetUserFollowing:
         assert res.status_code == 404
 
 
+@pytest.mark.query_budget(2)
 class TestGetUserFollowers:
 
     url = '/api/users/2/followers'  # Michael
@@ -128,6 +226,16 @@ class TestGetUserFollowers:
         assert data['total_followers'] == 3
         assert len(data['followers']) <= app.config['USERS_PER_PAGE']
 
+    def test_cursor_pagination(self, user_client):
+        usernames, cursor = [], ''
+        while cursor is not None:
+            res = user_client.get(self.url + f'?cursor={cursor}')
+            data = json.loads(res.data)
+            assert res.status_code == 200
+            usernames += [u['username'] for u in data['followers']]
+            cursor = data['next_cursor']
+        assert usernames == ['player', 'Trevor', 'Franklin']
+
     def test_404_user_not_exist(self, user_client):
         res = user_client.get('/api/users/10/followers')
         assert res.status_code == 404
@@ -144,6 +252,7 @@ class TestGetUserFollowers:
         assert res.status_code == 404
 
 
+@pytest.mark.query_budget(8)
 class TestGetNewsFeed:
 
     url = '/api/fleets/newsfeed'
@@ -170,6 +279,64 @@ class TestGetNewsFeed:
         assert data['newsfeed_length'] == 13
         assert len(data['newsfeed']) <= app.config['FLEETS_PER_PAGE']
 
+    def test_queries_independent_of_page_size(self, user_client, session,
+                                              queries):
+        # Fleet authors are joined in, so a page showing more authors must
+        # not run more queries
+        counts, authors = [], []
+        for per_page in [2, 10]:
+            session.expire_all()
+            queries.clear()
+            data = json.loads(user_client.get(
+                self.url + f'?per_page={per_page}').data)
+            counts.append(len(queries))
+            authors.append({f['username'] for f in data['newsfeed']})
+        assert len(authors[0]) < len(authors[1])
+        assert counts[0] == counts[1]
+
+    def test_length_capped_by_timeline(self, user_client, app, session,
+                                       monkeypatch):
+        monkeypatch.setitem(app.config, 'TIMELINE_LENGTH', 5)
+        trim_timelines(session.connection(), [1])
+        session.commit()
+        data = json.loads(user_client.get(self.url + '?per_page=5').data)
+        assert data['newsfeed_length'] == 5
+        assert len(data['newsfeed']) == 5
+        assert data['next_cursor'] is None
+        res = user_client.get(self.url + '?per_page=5&page=2')
+        assert res.status_code == 404
+
+    def test_exclude_length(self, user_client):
+        res = user_client.get(self.url + '?include_length=false')
+        data = json.loads(res.data)
+
+        assert res.status_code == 200
+        assert 'newsfeed_length' not in data
+        assert data['newsfeed']
+
+    def test_cursor_pagination(self, user_client):
+        ids, cursor = [], ''
+        while cursor is not None:
+            res = user_client.get(self.url + f'?per_page=4&cursor={cursor}')
+            data = json.loads(res.data)
+            assert res.status_code == 200
+            ids += [f['id'] for f in data['newsfeed']]
+            cursor = data['next_cursor']
+        assert len(ids) == len(set(ids)) == 13
+
+    def test_cached_until_invalidated(self, user_client, monkeypatch):
+        monkeypatch.setattr(newsfeed_cache, 'backend', LocalBackend())
+        url = self.url + '?per_page=20'
+        first = json.loads(user_client.get(url).data)
+        hits = newsfeed_cache.hits
+        assert json.loads(user_client.get(url).data) == first
+        assert newsfeed_cache.hits == hits + 1
+
+        res = user_client.post('/api/fleets', json={'post': 'Fame or Shame'})
+        fleet_id = json.loads(res.data)['id']
+        data = json.loads(user_client.get(url).data)
+        assert fleet_id in [f['id'] for f in data['newsfeed']]
+
     def test_422_non_positive_page_args(self, user_client):
         res1 = user_client.get(self.url + '?page=-1')
         assert res1.status_code == 422
@@ -182,6 +349,7 @@ class TestGetNewsFeed:
         assert res.status_code == 404
 
 
+@pytest.mark.query_budget(6)
 class TestPostFleet:
 
     url = '/api/fleets'
@@ -213,6 +381,59 @@ class TestPostFleet:
         assert post_res.status_code == 422
 
 
+# Fleet.insert_many inserts row by row outside PostgreSQL
+@pytest.mark.query_budget(6, repeats=2)
+class TestPostFleetsBatch:
+
+    url = '/api/fleets/batch'
+
+    def test_401_unauthorized(self, client):
+        res = client.post(self.url)
+        assert res.status_code == 401
+        assert json.loads(res.data)['code'] == 'authorization_header_missing'
+
+    def test_403_moderator(self, mod_client):
+        res = mod_client.post(self.url)
+        assert res.status_code == 403
+        assert json.loads(res.data)['code'] == 'forbidden'
+
+    def test_post_fleets(self, user_client):
+        posts = ['Fame or Shame', 'Dead Man Walking']
+        res = user_client.post(self.url, json={'posts': posts})
+        data = json.loads(res.data)
+        assert res.status_code == 200
+        assert data['success']
+        assert [Fleet.query.get(i).post for i in data['ids']] == posts
+        assert User.query.get(1).total_fleets == 3
+
+    def test_partial(self, user_client):
+        posts = ['Fame or Shame', '', None, 'x' * 281, 'Dead Man Walking']
+        res = user_client.post(self.url, json={'posts': posts,
+                                               'partial': True})
+        data = json.loads(res.data)
+        assert res.status_code == 200
+        assert data['ids'][1:4] == [None, None, None]
+        assert Fleet.query.get(data['ids'][4]).post == 'Dead Man Walking'
+        assert [e['index'] for e in data['errors']] == [1, 2, 3]
+        assert User.query.get(1).total_fleets == 3
+
+    def test_400_no_posts_arg(self, user_client):
+        res = user_client.post(self.url, json={'post': 'Fame or Shame'})
+        assert res.status_code == 400
+
+    def test_422_invalid_post(self, user_client):
+        res = user_client.post(self.url, json={'posts': ['Fame or Shame',
+                                                         '']})
+        assert res.status_code == 422
+        assert User.query.get(1).total_fleets == 1
+
+    def test_422_too_many_posts(self, user_client, app):
+        posts = ['Fame or Shame'] * (app.config['FLEETS_BATCH_MAX'] + 1)
+        res = user_client.post(self.url, json={'posts': posts})
+        assert res.status_code == 422
+
+
+@pytest.mark.query_budget(5)
 class TestPatchFleet:
 
     url = '/api/fleets/17'
@@ -256,6 +477,7 @@ class TestPatchFleet:
         assert res.status_code == 422
 
 
+@pytest.mark.query_budget(4)
 class TestDeleteFleet:
 
     url = '/api/fleets/17'
@@ -293,6 +515,7 @@ class TestDeleteFleet:
         assert res.status_code == 404
 
 
+@pytest.mark.query_budget(7)
 class TestFollow:
 
     url = '/api/follows/3'
@@ -317,6 +540,13 @@ class TestFollow:
         assert data['id'] == 3
         assert follow is not None
 
+    def test_follow_twice(self, user_client):
+        for _ in range(2):
+            res = user_client.post(self.url)
+            assert res.status_code == 200
+        assert User.query.get(1).total_following == 3
+        assert User.query.get(3).total_followers == 2
+
     def test_404_followee_not_exist(self, user_client):
         res = user_client.post('/api/follows/10')
         assert res.status_code == 404
@@ -326,6 +556,61 @@ class TestFollow:
         assert res.status_code == 422
 
 
+@pytest.mark.query_budget(8, repeats=2)
+class TestFollowMany:
+
+    url = '/api/follows'
+
+    def test_401_unauthorized(self, client):
+        res = client.post(self.url)
+        assert res.status_code == 401
+        assert json.loads(res.data)['code'] == 'authorization_header_missing'
+
+    def test_403_moderator(self, mod_client):
+        res = mod_client.post(self.url)
+        assert res.status_code == 403
+        assert json.loads(res.data)['code'] == 'forbidden'
+
+    def test_follow_many(self, user_client):
+        res = user_client.post(self.url, json={'ids': [3, 2, 1, 10, 3]})
+        data = json.loads(res.data)
+        assert res.status_code == 200
+        assert data['success']
+        assert data['results'] == [
+            {'id': 3, 'result': 'followed'},
+            {'id': 2, 'result': 'already_following'},
+            {'id': 1, 'result': 'self'},
+            {'id': 10, 'result': 'not_found'},
+        ]
+        assert Follow.query.get((1, 3)) is not None
+        assert User.query.get(1).total_following == 3
+        assert User.query.get(3).total_followers == 2
+
+    def test_unfollow_many(self, user_client):
+        res = user_client.delete(self.url, json={'ids': [2, 3, 4]})
+        data = json.loads(res.data)
+        assert res.status_code == 200
+        assert [r['result'] for r in data['results']] == [
+            'unfollowed', 'not_following', 'unfollowed']
+        assert Follow.query.filter_by(follower_id=1).count() == 0
+        assert User.query.get(1).total_following == 0
+        assert User.query.get(2).total_followers == 2
+
+    def test_400_no_ids_arg(self, user_client):
+        res = user_client.post(self.url, json={'id': 3})
+        assert res.status_code == 400
+
+    def test_400_non_integer_ids(self, user_client):
+        res = user_client.post(self.url, json={'ids': ['3']})
+        assert res.status_code == 400
+
+    def test_422_too_many_ids(self, user_client, app):
+        ids = list(range(1, app.config['FOLLOWS_BATCH_MAX'] + 2))
+        res = user_client.post(self.url, json={'ids': ids})
+        assert res.status_code == 422
+
+
+@pytest.mark.query_budget(6)
 class TestUnfollow:
 
     url = '/api/follows/2'
@@ -359,6 +644,7 @@ class TestUnfollow:
         assert res.status_code == 422
 
 
+@pytest.mark.query_budget(4)
 class TestDeleteUser:
 
     url = '/api/users/4'
@@ -385,3 +671,41 @@ class TestDeleteUser:
     def test_404_user_not_exist(self, mod_client):
         res = mod_client.delete('/api/users/10')
         assert res.status_code == 404
+
+    def test_delete_user_async(self, mod_client):
+        res = mod_client.delete(self.url + '?async=true')
+        data = json.loads(res.data)
+        assert res.status_code == 202
+        assert data['success']
+        assert data['id'] == 4
+
+        for _ in range(50):
+            res = mod_client.get(f'/api/jobs/{data["job_id"]}')
+            job = json.loads(res.data)
+            assert res.status_code == 200
+            if job['status'] not in ('pending', 'running'):
+                break
+            time.sleep(0.1)
+        assert job['status'] == 'done'
+        assert job['deleted_fleets'] == 5
+        assert User.query.get(4) is None
+
+
+@pytest.mark.query_budget(1)
+class TestGetJob:
+
+    url = '/api/jobs/1'
+
+    def test_401_unauthorized(self, client):
+        res = client.get(self.url)
+        assert res.status_code == 401
+        assert json.loads(res.data)['code'] == 'authorization_header_missing'
+
+    def test_403_user(self, user_client):
+        res = user_client.get(self.url)
+        assert res.status_code == 403
+        assert json.loads(res.data)['code'] == 'forbidden'
+
+    def test_404_job_not_exist(self, mod_client):
+        res = mod_client.get(self.url)
+        assert res.status_code == 404
@@ -0,0 +1,71 @@
+import pytest
+from fleeter import auth
+from fleeter.auth import AuthError, requires_auth, verify_decode_jwt
+
+
+@pytest.fixture(scope='function')
+def decode_calls(monkeypatch):
+    calls = []
+    decode = auth.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(auth.jwt, 'decode', counting_decode)
+    return calls
+
+
+class TestTokenCache:
+
+    def test_repeated_token_verified_once(self, sign_token, decode_calls):
+        token = sign_token(permissions=['get:newsfeed'])
+
+        for _ in range(3):
+            payload = verify_decode_jwt(token)
+            assert payload['permissions'] == ['get:newsfeed']
+        assert len(decode_calls) == 1
+        assert auth.token_cache.hits == 2
+        assert auth.token_cache.misses == 1
+
+    def test_expired_token_not_served(self, sign_token, decode_calls):
+        token = sign_token(ttl=-10)
+
+        for _ in range(2):
+            with pytest.raises(AuthError) as e:
+                verify_decode_jwt(token)
+            assert e.value.error['code'] == 'token_expired'
+        assert len(auth.token_cache) == 0
+        assert len(decode_calls) == 2
+
+    def test_bounded_size(self, sign_token):
+        auth.token_cache.max_size = 2
+        for sub in ['a', 'b', 'c']:
+            verify_decode_jwt(sign_token(sub=sub))
+        assert len(auth.token_cache) == 2
+        assert auth.token_cache.evictions == 1
+
+    def test_key_rotation_invalidates(self, sign_token, decode_calls):
+        token = sign_token()
+        verify_decode_jwt(token)
+        assert len(auth.token_cache) == 1
+
+        key = dict(auth.jwks.get_key('stub'), kid='rotated')
+        auth.jwks.fetcher = lambda url: {'keys': [key]}
+        auth.jwks.refresh()
+        assert len(auth.token_cache) == 0
+
+    def test_permissions_checked_on_cached_token(self, app, sign_token):
+        token = sign_token(permissions=['get:newsfeed'])
+        headers = {'Authorization': f'Bearer {token}'}
+
+        @requires_auth(permission='post:fleets')
+        def view(payload):
+            return payload
+
+        for _ in range(2):
+            with app.test_request_context(headers=headers):
+                with pytest.raises(AuthError) as e:
+                    view()
+                assert e.value.status_code == 403
+        assert auth.token_cache.hits == 1
@@ -0,0 +1,57 @@
+import pytest
+from fleeter.cache import LocalBackend, NewsfeedCache, RedisBackend
+
+
+@pytest.fixture(scope='function', params=['local', 'redis'])
+def cache(request):
+    if request.param == 'local':
+        return NewsfeedCache(LocalBackend(max_size=2))
+    server = request.getfixturevalue('redis_server')
+    return NewsfeedCache(RedisBackend(server.url))
+
+
+class TestNewsfeedCache:
+
+    page = {'newsfeed': [{'id': 1, 'post': 'Hood Safari'}], 'success': True}
+
+    def test_miss_then_hit(self, cache):
+        version, page = cache.get(1, 'page=1')
+        assert page is None
+        cache.set(1, version, 'page=1', self.page)
+
+        assert cache.get(1, 'page=1')[1] == self.page
+        assert cache.get(1, 'page=2')[1] is None
+        assert cache.get(2, 'page=1')[1] is None
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 3
+        assert cache.stats()['hit_ratio'] == 0.25
+
+    def test_invalidate_only_given_readers(self, cache):
+        for user_id in [1, 2]:
+            version, _ = cache.get(user_id, 'page=1')
+            cache.set(user_id, version, 'page=1', self.page)
+
+        cache.invalidate([1])
+        assert cache.get(1, 'page=1')[1] is None
+        assert cache.get(2, 'page=1')[1] == self.page
+
+    def test_page_rendered_before_invalidation_not_served(self, cache):
+        version, _ = cache.get(1, 'page=1')
+        cache.invalidate([1])  # A write lands while the page is rendered
+        cache.set(1, version, 'page=1', self.page)
+        assert cache.get(1, 'page=1')[1] is None
+
+
+def test_local_expiry():
+    cache = NewsfeedCache(LocalBackend(), ttl=-1)
+    cache.set(1, 0, 'page=1', {'page': 1})
+    assert cache.get(1, 'page=1')[1] is None
+
+
+def test_local_evictions():
+    cache = NewsfeedCache(LocalBackend(max_size=2))
+    for page in range(1, 4):
+        cache.set(1, 0, f'page={page}', {'page': page})
+    assert cache.get(1, 'page=1')[1] is None
+    assert cache.get(1, 'page=3')[1] == {'page': 3}
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,69 @@
+import json
+import pytest
+from fleeter.capture import TrafficCapture, read_capture
+
+
+@pytest.fixture(scope='function')
+def capture(app, tmp_path, monkeypatch):
+    path = tmp_path / 'capture.jsonl'
+    monkeypatch.setitem(app.config, 'CAPTURE_PATH', str(path))
+    capture = TrafficCapture()
+    capture.init_app(app)
+    yield capture
+    app.before_request_funcs[None].remove(capture.before_request)
+    app.after_request_funcs[None].remove(capture.after_request)
+    app.teardown_request_funcs[None].remove(capture.teardown_request)
+
+
+def _records(capture) -> list:
+    with open(capture.path) as f:
+        return read_capture(f)
+
+
+class TestTrafficCapture:
+
+    def test_anonymous_get(self, app, capture):
+        res = app.test_client().get(
+            '/api/users/4/fleets/export?page=2&secret=x')
+        assert res.status_code == 200
+        res.get_data()  # Recorded once the stream is done
+        record, = _records(capture)
+        assert record['method'] == 'GET'
+        assert record['route'] == '/api/users/<int:user_id>/fleets/export'
+        assert record['path'] == '/api/users/4/fleets/export'
+        assert record['query'] == [['page', '2']]
+        assert record['body'] is None
+        assert record['actor'] is None
+        assert record['status'] == 200
+        assert record['duration'] > 0
+
+    def test_sanitized(self, app, capture, sign_token):
+        token = sign_token(permissions=['post:fleets'])
+        client = app.test_client()
+        headers = {'Authorization': f'Bearer {token}'}
+        client.post('/api/fleets', json={'post': 'Grove Street 4 life'},
+                    headers=headers)
+        client.post('/api/fleets', json={'post': ''}, headers=headers)
+        with open(capture.path) as f:
+            text = f.read()
+        assert token not in text and 'Grove' not in text
+        first, second = [json.loads(line) for line in text.splitlines()]
+        assert first['body'] == {'post': 'x' * 19}
+        assert first['status'] == 200
+        assert second['status'] == 422
+        assert len(first['actor']) == 16
+        # The same caller keeps the same pseudonym
+        assert second['actor'] == first['actor']
+
+    def test_other_blueprints_and_sampling(self, app, capture, monkeypatch):
+        client = app.test_client()
+        client.get('/metrics')
+        monkeypatch.setattr(capture, 'sample_rate', 0)
+        client.get('/api/users/4/fleets')
+        assert _records(capture) == []
+
+    def test_off_by_default(self, app):
+        capture = TrafficCapture()
+        capture.init_app(app)
+        assert capture.path is None
+        assert capture.before_request not in app.before_request_funcs[None]
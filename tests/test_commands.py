@@ -0,0 +1,146 @@
+import json
+import pytest
+from fleeter.models import User
+
+
+@pytest.fixture(scope='function')
+def runner(app):
+    return app.test_cli_runner()
+
+
+class TestCheckCounters:
+
+    def test_no_drift(self, runner):
+        result = runner.invoke(args=['fleeter', 'check-counters'])
+        assert result.exit_code == 0
+        assert 'All counters are correct.' in result.output
+
+    def test_drift_reported(self, runner, users, session):
+        users['Trevor'].total_fleets = 42
+        session.commit()
+
+        result = runner.invoke(args=['fleeter', 'check-counters'])
+        assert result.exit_code == 1
+        assert 'user 4: total_fleets is 42, should be 5' in result.output
+        assert User.query.get(4).total_fleets == 42
+
+    def test_drift_repaired(self, runner, users, session):
+        users['Trevor'].total_fleets = 42
+        users['Michael'].total_followers = 0
+        session.commit()
+
+        result = runner.invoke(args=['fleeter', 'check-counters', '--repair'])
+        assert result.exit_code == 0
+        assert 'Repaired 2 counter(s).' in result.output
+        assert User.counter_drift() == []
+
+
+class TestImport:
+
+    events = [
+        {'type': 'user', 'username': 'Lester', 'auth0_id': 'auth0|lester'},
+        {'type': 'fleet', 'username': 'Lester', 'post': 'The Jewel Store Job',
+         'created_at': '2030-01-01T00:00:00'},
+        {'type': 'follow', 'follower': 'Lester', 'followee': 'Michael'},
+        {'type': 'follow', 'follower': 'Michael', 'followee': 'Lester'},
+        {'type': 'follow', 'follower': 'Lester', 'followee': 'Michael'},
+        {'type': 'follow', 'follower': 'Franklin', 'followee': 'Michael'},
+        {'type': 'fleet', 'username': 'Lamar', 'post': 'Lamar Roasts Franklin',
+         'created_at': '2030-01-01T00:00:01'},
+    ]
+
+    def check_imported(self):
+        lester = User.query.filter_by(username='Lester').one()
+        michael = User.query.filter_by(username='Michael').one()
+        assert lester.auth0_id == 'auth0|lester'
+        assert [f.post for f in lester.fleets] == ['The Jewel Store Job']
+        assert lester.following.all() == [michael]
+        assert lester in michael.followers.all()
+        assert User.query.filter_by(username='Lamar').one().total_fleets == 1
+        assert User.counter_drift() == []
+        for user in User.query:
+            assert user.timeline.all() == user.newsfeed.all()
+
+    def test_ndjson(self, runner, tmp_path):
+        path = tmp_path / 'events.ndjson'
+        path.write_text('\n'.join(json.dumps(e) for e in self.events))
+
+        result = runner.invoke(args=['fleeter', 'import', str(path),
+                                     '--chunk-size', '2'])
+        assert result.exit_code == 0, result.output
+        assert 'Imported 2 users' in result.output
+        assert 'Imported 2 fleets' in result.output
+        assert 'Imported 2 follows' in result.output
+        self.check_imported()
+
+    def test_timelines_disabled(self, runner, tmp_path, app, monkeypatch):
+        # Timelines are built all the same, for when they get enabled
+        monkeypatch.setitem(app.config, 'TIMELINE_ENABLED', False)
+        path = tmp_path / 'events.ndjson'
+        path.write_text('\n'.join(json.dumps(e) for e in self.events))
+
+        result = runner.invoke(args=['fleeter', 'import', str(path)])
+        assert result.exit_code == 0, result.output
+        self.check_imported()
+
+    def test_csv(self, runner, tmp_path):
+        path = tmp_path / 'events.csv'
+        path.write_text('Lester,The Jewel Store Job,2030-01-01T00:00:00\n'
+                        'Lester,follow Michael\n'
+                        'Michael,follow Lester\n'
+                        'Lamar,Lamar Roasts Franklin,2030-01-01T00:00:01\n')
+        User.query.session.execute(User.__table__.insert(), [
+            {'username': 'Lester', 'auth0_id': 'auth0|lester'}])
+        User.query.session.commit()
+
+        result = runner.invoke(args=['fleeter', 'import', str(path)])
+        assert result.exit_code == 0, result.output
+        assert 'Imported 1 users' in result.output
+        self.check_imported()
+
+    @pytest.mark.parametrize('line, message', [
+        ('{"type": "fleet", "username": "Lester"}',
+         'fleet event without post'),
+        ('{"username": "Lester"}', 'type must be one of'),
+        ('{"type": "follow"', 'invalid JSON'),
+        ('{"type": "user", "username": "Lester", "created_at": "soon"}',
+         "invalid created_at 'soon'"),
+        (json.dumps({'type': 'user', 'username': 'L' * 31}),
+         'username longer than 30 characters'),
+        (json.dumps({'type': 'fleet', 'username': 'Lester',
+                     'post': 'x' * 281}),
+         'post longer than 280 characters'),
+        ('{"type": "user", "username": "Lamar", "auth0_id": 4}',
+         'auth0_id must be a string'),
+        ('{"type": "user", "username": "Lamar", "auth0_id": "auth0|lester"}',
+         "auth0_id 'auth0|lester' already taken"),
+    ])
+    def test_invalid_ndjson(self, runner, tmp_path, line, message):
+        path = tmp_path / 'events.ndjson'
+        path.write_text('\n'.join(json.dumps(e) for e in self.events[:2]) +
+                        '\n\n' + line + '\n')
+
+        result = runner.invoke(args=['fleeter', 'import', str(path),
+                                     '--chunk-size', '1'])
+        assert result.exit_code == 2
+        assert f'events.ndjson, line 4: {message}' in result.output
+        assert User.query.filter_by(username='Lester').one().total_fleets == 1
+        assert User.counter_drift() == []
+
+    def test_auth0_id_twice_in_chunk(self, runner, tmp_path):
+        path = tmp_path / 'events.ndjson'
+        path.write_text(
+            '{"type": "user", "username": "Lamar", "auth0_id": "a|1"}\n'
+            '{"type": "user", "username": "Lester", "auth0_id": "a|1"}\n')
+
+        result = runner.invoke(args=['fleeter', 'import', str(path)])
+        assert result.exit_code == 2
+        assert "line 2: auth0_id 'a|1' already taken" in result.output
+
+    def test_invalid_csv(self, runner, tmp_path):
+        path = tmp_path / 'events.csv'
+        path.write_text('Lester,follow Michael\nLester\n')
+
+        result = runner.invoke(args=['fleeter', 'import', str(path)])
+        assert result.exit_code == 2
+        assert 'line 2: expected username,event[,created_at]' in result.output
@@ -0,0 +1,124 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from fleeter.models import User, Fleet, Follow, Timeline, seek_before
+
+
+USERS = 2000
+FLEETS_PER_USER = 5
+FOLLOWING_PER_USER = 5
+PER_PAGE = 11
+UNPUSHED_EVERY = 50  # Popular authors, the first reader follows one
+
+
+@pytest.fixture(scope='function')
+def reader(session):
+    """Seeds a graph large enough for the planner to prefer indexes."""
+    first = User.query.count() + 1
+    ids = range(first, first + USERS)
+    session.execute(User.__table__.insert(),
+                    [{'id': i, 'username': f'user{i}'} for i in ids])
+    start = datetime(2020, 1, 1)
+    session.execute(Fleet.__table__.insert(), [
+        {'post': f'fleet {n}', 'user_id': ids[n % USERS],
+         'created_at': start + timedelta(seconds=n),
+         'pushed': n % USERS % UNPUSHED_EVERY != 1}
+        for n in range(USERS * FLEETS_PER_USER)])
+    session.execute(Follow.__table__.insert(), [
+        {'follower_id': i, 'followee_id': ids[(k * 37 + n) % USERS],
+         'created_at': start + timedelta(seconds=n)}
+        for k, i in enumerate(ids) for n in range(1, FOLLOWING_PER_USER + 1)])
+    session.execute(Timeline.__table__.insert().from_select(
+        ['user_id', 'fleet_id', 'created_at'],
+        session.query(Follow.follower_id, Fleet.id, Fleet.created_at)
+        .join(Fleet, Fleet.user_id == Follow.followee_id)
+        .filter(Follow.follower_id >= first, Fleet.pushed)))
+    session.commit()
+    session.execute('ANALYZE')
+    return User.query.get(first)
+
+
+def _cursor(query, created_at, item_id):
+    """Seeks past the second item of query, as the second page would."""
+    row = query.offset(1).first()
+    key = (row.created_at, row.id)
+    return seek_before(query, created_at, item_id, key)
+
+
+# Name -> query built by each endpoint for a reader
+QUERIES = {
+    'user by auth0_id': lambda u: User.query.filter_by(auth0_id='x'),
+    'fleets': lambda u: u.fleets,
+    'fleets after cursor': lambda u: _cursor(u.fleets, Fleet.created_at,
+                                             Fleet.id),
+    'following': lambda u: u.following.add_columns(Follow.created_at),
+    'followers': lambda u: u.followers.add_columns(Follow.created_at),
+    'timeline': lambda u: u.timeline,
+    'timeline after cursor': lambda u: _cursor(
+        u.timeline, Timeline.created_at, Timeline.fleet_id),
+    # As deleted by the cascade from fleets
+    'timeline of a fleet': lambda u: Timeline.query.filter_by(
+        fleet_id=u.timeline.first().id),
+    'newsfeed readers': lambda u: User.query.session.query(
+        Follow.follower_id).filter(Follow.followee_id == u.id),
+    'newsfeed': lambda u: u.newsfeed,
+    # As summed by User.newsfeed_length
+    'newsfeed length': lambda u: User.query.session.query(
+        func.sum(User.total_fleets)).join(
+            Follow, Follow.followee_id == User.id).filter(
+                Follow.follower_id == u.id),
+    'pulled fleets': lambda u: u.pulled_fleets,
+}
+
+# Sorts accepted, as no single index range is in (created_at, id) order.
+# Both read fleets of several authors through their index, so the sort is
+# bounded by those authors' fleets: the newsfeed, only served with
+# TIMELINE_ENABLED off, by the reader's own and followees' fleets, and the
+# pulled fleets by those that followees posted above the fanout threshold.
+SORTED = {'newsfeed', 'pulled fleets'}
+
+
+def plan_problems(session, query) -> list:
+    """Lists sequential scans, skip-scans and explicit sorts in the plan of
+    query."""
+    connection = session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = [params[name] for name in compiled.positiontup]
+
+    problems = []
+    if connection.dialect.name == 'postgresql':
+        (plan,), = connection.execute(
+            f'EXPLAIN (FORMAT JSON) {compiled}', params)
+        nodes = [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            nodes += node.get('Plans', [])
+            if node['Node Type'] == 'Seq Scan':
+                problems.append(f'Seq Scan on {node["Relation Name"]}')
+            elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+                problems.append(node['Node Type'])
+    else:
+        for *_, detail in connection.execute(
+                f'EXPLAIN QUERY PLAN {compiled}', params):
+            # ANY() is a skip-scan, seeking every value of a leading column
+            if detail.startswith('SCAN') or 'TEMP B-TREE' in detail \
+                    or 'ANY(' in detail:
+                problems.append(detail)
+    return problems
+
+
+class TestQueryPlans:
+
+    @pytest.mark.parametrize('name', sorted(QUERIES))
+    def test_no_scan_or_sort(self, session, reader, name):
+        query = QUERIES[name](reader)
+        if name != 'user by auth0_id':
+            assert query.limit(PER_PAGE).all()
+        problems = plan_problems(session, query.limit(PER_PAGE))
+        if name in SORTED:
+            problems = [p for p in problems
+                        if p not in ('Sort', 'Incremental Sort')
+                        and 'TEMP B-TREE' not in p]
+        assert problems == []
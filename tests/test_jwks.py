@@ -0,0 +1,85 @@
+import time
+import threading
+import pytest
+from fleeter.jwks import JWKSKeyStore
+
+
+def _jwk(kid):
+    return {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n', 'e': 'AQAB'}
+
+
+class TestJWKSKeyStore:
+
+    def test_fetches_once_within_ttl(self, jwks_server):
+        jwks_server.jwks = {'keys': [_jwk('a'), _jwk('b')]}
+        store = JWKSKeyStore(jwks_server.url)
+
+        assert store.get_key('a')['kid'] == 'a'
+        assert store.get_key('b')['kid'] == 'b'
+        assert store.get_key('a')['kid'] == 'a'
+        assert jwks_server.hits == 1
+
+    def test_initial_fetch_failure_raises(self, jwks_server):
+        jwks_server.jwks = None
+        store = JWKSKeyStore(jwks_server.url)
+
+        with pytest.raises(Exception):
+            store.get_key('a')
+
+    def test_unknown_kid_refetches(self, jwks_server):
+        jwks_server.jwks = {'keys': [_jwk('a')]}
+        store = JWKSKeyStore(jwks_server.url, min_refetch_interval=0)
+        store.get_key('a')
+
+        jwks_server.jwks = {'keys': [_jwk('a'), _jwk('rotated')]}
+        assert store.get_key('rotated')['kid'] == 'rotated'
+        assert jwks_server.hits == 2
+
+    def test_unknown_kid_refetch_is_rate_limited(self, jwks_server):
+        jwks_server.jwks = {'keys': [_jwk('a')]}
+        store = JWKSKeyStore(jwks_server.url, min_refetch_interval=60)
+        store.get_key('a')
+
+        for _ in range(5):
+            assert store.get_key('forged') is None
+        assert jwks_server.hits == 1
+
+    def test_stale_keys_served_while_refreshing(self, jwks_server):
+        jwks_server.jwks = {'keys': [_jwk('a')]}
+        store = JWKSKeyStore(jwks_server.url, ttl=0, min_refetch_interval=0)
+        store.get_key('a')
+
+        release = threading.Event()
+        fetcher = store.fetcher
+
+        def slow_fetcher(url):
+            release.wait(5)
+            return fetcher(url)
+
+        store.fetcher = slow_fetcher
+        start = time.monotonic()
+        assert store.get_key('a')['kid'] == 'a'
+        assert time.monotonic() - start < 1  # Did not wait for the IdP
+        release.set()
+
+    def test_stale_keys_kept_when_idp_unreachable(self, jwks_server):
+        jwks_server.jwks = {'keys': [_jwk('a')]}
+        store = JWKSKeyStore(jwks_server.url, ttl=0, min_refetch_interval=0)
+        store.get_key('a')
+
+        jwks_server.jwks = None
+        for _ in range(3):
+            assert store.get_key('a')['kid'] == 'a'
+            time.sleep(0.05)
+        assert jwks_server.hits > 1
+
+    def test_pluggable_fetcher(self):
+        urls = []
+
+        def fetcher(url):
+            urls.append(url)
+            return {'keys': [_jwk('local')]}
+
+        store = JWKSKeyStore('stub://jwks', fetcher=fetcher)
+        assert store.get_key('local')['kid'] == 'local'
+        assert urls == ['stub://jwks']
@@ -0,0 +1,141 @@
+import os
+import subprocess
+import sys
+import pytest
+from fleeter.jwks import JWKSKeyStore
+from fleeter.metrics import Metrics
+
+
+@pytest.fixture(scope='module')
+def client(app):
+    return app.test_client()
+
+
+def _sample(text: str, series: str) -> float:
+    """Returns the value of series in a scrape, 0 when it is absent."""
+    for line in text.splitlines():
+        if line.startswith(series + ' '):
+            return float(line.split()[-1])
+    return 0
+
+
+def _scrape(client) -> str:
+    res = client.get('/metrics')
+    assert res.status_code == 200
+    assert res.content_type.startswith('text/plain; version=0.0.4')
+    return res.data.decode()
+
+
+class TestMetrics:
+
+    def test_histogram(self):
+        m = Metrics()
+        for value in [0.002, 0.002, 0.03, 20]:
+            m.observe('latency_seconds', value, {'route': '/a"b'})
+        text = m.render()
+        assert '# TYPE latency_seconds histogram' in text
+        assert 'latency_seconds_bucket{route="/a\\"b",le="0.0025"} 2' in text
+        assert 'latency_seconds_bucket{route="/a\\"b",le="0.05"} 3' in text
+        assert 'latency_seconds_bucket{route="/a\\"b",le="10"} 3' in text
+        assert 'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 4' in text
+        assert 'latency_seconds_count{route="/a\\"b"} 4' in text
+
+    def test_collector_gauges(self):
+        m = Metrics()
+        m.add_collector('cache', lambda: {'hits': 3, 'hit_ratio': 0.5})
+        text = m.render()
+        assert '# TYPE cache_hits gauge' in text
+        assert _sample(text, 'cache_hits') == 3
+        assert 'ratio' not in text
+
+    def test_collector_added_again(self):
+        m = Metrics()
+        m.add_collector('cache', lambda: {'size': 2})
+        m.add_collector('cache', lambda: {'size': 2})
+        text = m.render()
+        assert text.count('\ncache_size ') == 1
+        assert _sample(text, 'cache_size') == 2
+
+    def test_request_metrics(self, client):
+        series = 'fleeter_requests_total{method="GET",' \
+                 'route="/api/users/<int:user_id>/fleets",status="200"}'
+        queries = 'fleeter_request_db_queries_count' \
+                  '{route="/api/users/<int:user_id>/fleets"}'
+        before = _scrape(client)
+        client.get('/api/users/4/fleets')
+        client.get('/api/users/4/fleets/export')
+        after = _scrape(client)
+        assert _sample(after, series) == _sample(before, series) + 1
+        assert _sample(after, queries) == _sample(before, queries) + 1
+        assert _sample(after, 'fleeter_request_db_queries_sum'
+                              '{route="/api/users/<int:user_id>/fleets"}') > \
+            _sample(before, 'fleeter_request_db_queries_sum'
+                            '{route="/api/users/<int:user_id>/fleets"}')
+        # Counted once the stream is done, with the queries it ran
+        assert _sample(after, 'fleeter_request_db_queries_count'
+                              '{route="/api/users/<int:user_id>/fleets/'
+                              'export"}') >= 1
+        assert _sample(after, 'fleeter_serialize_seconds_count') > \
+            _sample(before, 'fleeter_serialize_seconds_count')
+
+    def test_unmatched_route(self, client):
+        client.get('/api/no/such/route/42')
+        assert 'route="unmatched",status="404"' in _scrape(client)
+
+    def test_auth_timed(self, client):
+        before = _sample(_scrape(client), 'fleeter_auth_seconds_count')
+        res = client.get('/api/fleets/newsfeed',
+                         headers={'Authorization': 'Bearer'})
+        assert res.status_code == 401
+        assert _sample(_scrape(client), 'fleeter_auth_seconds_count') == \
+            before + 1
+
+    def test_jwks_fetch_errors(self, client):
+        def fetcher(url):
+            raise OSError('unreachable')
+
+        store = JWKSKeyStore('https://example.invalid/', fetcher=fetcher)
+        before = _sample(_scrape(client), 'fleeter_jwks_fetch_errors_total')
+        with pytest.raises(OSError):
+            store.refresh()
+        after = _scrape(client)
+        assert _sample(after, 'fleeter_jwks_fetch_errors_total') == before + 1
+        assert _sample(after, 'fleeter_jwks_fetch_seconds_count') >= 1
+
+
+class TestMultiprocess:
+
+    def test_added_up_across_processes(self, tmp_path):
+        script = (f'from fleeter.metrics import Metrics\n'
+                  f'm = Metrics({str(tmp_path)!r})\n'
+                  f'm.add_collector("cache", lambda: {{"size": 5}})\n'
+                  f'm.inc("jobs_total", {{"kind": "purge"}}, 2)\n'
+                  f'm.observe("job_seconds", 0.3)\n'
+                  f'm.flush()\n')
+        for _ in range(2):
+            subprocess.run([sys.executable, '-c', script], check=True,
+                           cwd=os.getcwd())
+
+        m = Metrics(str(tmp_path))
+        m.add_collector('cache', lambda: {'size': 1})
+        m.inc('jobs_total', {'kind': 'purge'})
+        m.observe('job_seconds', 0.02)
+        text = m.render()
+        assert _sample(text, 'jobs_total{kind="purge"}') == 5
+        assert _sample(text, 'job_seconds_count') == 3
+        assert _sample(text, 'job_seconds_bucket{le="0.025"}') == 1
+        assert _sample(text, 'job_seconds_bucket{le="0.5"}') == 3
+        # Gauges of exited processes are dropped
+        assert _sample(text, 'cache_size') == 1
+        assert len(list(tmp_path.glob('metrics-*.json'))) == 3
+
+    def test_forked_child_starts_empty(self, tmp_path):
+        m = Metrics(str(tmp_path))
+        m.inc('jobs_total')
+        pid = os.fork()
+        if pid == 0:
+            m.inc('jobs_total')
+            m.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert _sample(m.render(), 'jobs_total') == 2
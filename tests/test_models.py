@@ -1,4 +1,9 @@
-from fleeter.models import Fleet, Follow
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from fleeter.models import Fleet, Follow, PurgeJob, Timeline, User, \
+    trim_timelines
+from fleeter.purge import purge_user
 
 
 class TestUser:
@@ -26,6 +31,11 @@ class TestUser:
                                  'Trevor Philips Industries', 'Nervous Ron',
                                  'Mr. Philips']
 
+    def test_export_fleets(self, users):
+        rows = list(users['Trevor'].export_fleets(chunk_size=2))
+        fleets = users['Trevor'].fleets.all()[::-1]
+        assert rows == [(f.id, f.post, f.created_at) for f in fleets]
+
     def test_following(self, users):
         player_following = [u.username for u in
                             users['player'].following.all()]
@@ -43,6 +53,32 @@ class TestUser:
         fleets.sort(key=lambda f: f.created_at, reverse=True)
         assert franklin_newsfeed == [f.post for f in fleets]
 
+    def test_newsfeed_length(self, users):
+        for user in users.values():
+            assert user.newsfeed_length == len(user.timeline.all())
+
+    def test_newsfeed_length_capped(self, users, app, session, monkeypatch):
+        player = users['player']
+        monkeypatch.setitem(app.config, 'TIMELINE_LENGTH', 3)
+        trim_timelines(session.connection(), [player.id])
+        session.commit()
+        assert player.newsfeed_length == 3
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', None)
+        assert player.newsfeed_length == 3
+        monkeypatch.setitem(app.config, 'TIMELINE_ENABLED', False)
+        assert player.newsfeed_length == len(player.newsfeed.all())
+
+    def test_newsfeed_length_with_pulled(self, users, app, session,
+                                         monkeypatch):
+        player = users['player']
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', 2)
+        Fleet(post='Bury the Hatchet', user=users['Michael']).insert()
+        monkeypatch.setitem(app.config, 'TIMELINE_LENGTH', 3)
+        trim_timelines(session.connection(), [player.id])
+        session.commit()
+        assert player.newsfeed_length == 4
+        assert len(player.merged_timeline(limit=100)) == 4
+
     def test_follow(self, users):
         michael = users['Michael']
         trevor = users['Trevor']
@@ -79,6 +115,311 @@ class TestUser:
         assert not trevor.is_following(michael)
         assert query.one_or_none() is None
 
+    def test_follow_idempotent(self, users, queries):
+        michael, trevor = users['Michael'], users['Trevor']
+        assert michael.follow(trevor)
+        queries.clear()
+        assert not michael.follow(trevor)
+        assert len(queries) == 1
+        michael.update()
+        assert michael.total_following == 2
+        assert trevor.total_followers == 2
+
+    def test_unfollow_idempotent(self, users):
+        trevor, michael = users['Trevor'], users['Michael']
+        assert trevor.unfollow(michael)
+        assert not trevor.unfollow(michael)
+        trevor.update()
+        assert trevor.total_following == 0
+        assert michael.total_followers == 2
+
+
+class TestCounters:
+
+    def test_seeded_counters_match(self, users):
+        assert User.counter_drift() == []
+
+    def test_fleet_insert_delete(self, users):
+        trevor = users['Trevor']
+        fleet = Fleet(post='Minor Turbulence', user=trevor)
+        fleet.insert()
+        assert trevor.total_fleets == 6
+
+        fleet.delete()
+        assert trevor.total_fleets == 5
+
+    def test_fleet_insert_many(self, users):
+        posts = ['Minor Turbulence', 'Predator']
+        ids = Fleet.insert_many(users['Trevor'].id, posts)
+        assert [Fleet.query.get(i).post for i in ids] == posts
+        assert users['Trevor'].total_fleets == 7
+        assert User.counter_drift() == []
+
+    def test_follow_unfollow(self, users):
+        michael, trevor = users['Michael'], users['Trevor']
+        michael.follow(trevor)
+        michael.update()
+        assert michael.total_following == 2
+        assert trevor.total_followers == 2
+
+        michael.unfollow(trevor)
+        michael.update()
+        assert michael.total_following == 1
+        assert trevor.total_followers == 1
+
+    def test_follow_many(self, users):
+        michael = users['Michael']
+        ids = [users['Trevor'].id, users['player'].id]
+        assert michael.follow_many(ids) == ids
+        assert michael.total_following == 3
+        assert users['Trevor'].total_followers == 2
+        assert User.counter_drift() == []
+
+        assert michael.unfollow_many(ids) == ids
+        assert michael.total_following == 1
+        assert User.counter_drift() == []
+
+    def test_many_skip_rows_written_concurrently(self, users):
+        # As if another request followed, then unfollowed, in between
+        michael, trevor = users['Michael'], users['Trevor']
+        michael.follow(trevor)
+        michael.update()
+        assert michael.follow_many([trevor.id, users['player'].id]) == [
+            users['player'].id]
+        assert michael.total_following == 3
+        assert User.counter_drift() == []
+
+        michael.unfollow(trevor)
+        michael.update()
+        assert michael.unfollow_many([trevor.id, users['player'].id]) == [
+            users['player'].id]
+        assert michael.total_following == 1
+        assert User.counter_drift() == []
+
+    def test_user_delete(self, users):
+        users['Michael'].delete()
+        assert User.query.count() == 3
+        assert users['player'].total_following == 1
+        assert users['Trevor'].total_following == 0
+        assert users['Franklin'].total_followers == 0
+        assert User.counter_drift() == []
+
+    def test_recount(self, users, session):
+        User.query.update({User.total_fleets: 0, User.total_followers: 9})
+        session.commit()
+        assert len(User.counter_drift()) == 8
+
+        User.recount([users['Michael'].id])
+        assert len(User.counter_drift()) == 6
+        User.recount()
+        assert User.counter_drift() == []
+
+
+class TestTimeline:
+
+    @staticmethod
+    def posts(user):
+        return [f.post for f in user.timeline.all()]
+
+    @staticmethod
+    def latest_fleet(user):
+        return Fleet(post='Minor Turbulence', user=user,
+                     created_at=datetime.now() + timedelta(days=1))
+
+    def test_matches_newsfeed(self, users):
+        for user in users.values():
+            fleets = user.fleets.all()
+            for followee in user.following:
+                fleets += followee.fleets.all()
+            fleets.sort(key=lambda f: (f.created_at, f.id), reverse=True)
+            assert self.posts(user) == [f.post for f in fleets]
+
+    def test_fleet_pushed_to_followers(self, users):
+        fleet = self.latest_fleet(users['Trevor'])
+        fleet.insert()
+        assert self.posts(users['Trevor'])[0] == 'Minor Turbulence'
+        assert self.posts(users['player'])[0] == 'Minor Turbulence'
+        assert 'Minor Turbulence' not in self.posts(users['Franklin'])
+
+        fleet.delete()
+        assert Timeline.query.filter_by(fleet_id=fleet.id).count() == 0
+
+    def test_insert_many_pushed_to_followers(self, users):
+        ids = Fleet.insert_many(users['Trevor'].id, ['Minor Turbulence'])
+        fleets = [f.id for f in users['player'].timeline]
+        assert ids[0] in fleets
+        assert ids[0] in [f.id for f in users['Trevor'].timeline]
+        assert ids[0] not in [f.id for f in users['Franklin'].timeline]
+
+    def test_follow_backfills(self, users):
+        michael, trevor = users['Michael'], users['Trevor']
+        trevor_posts = {f.post for f in trevor.fleets}
+        michael.follow(trevor)
+        michael.update()
+        assert trevor_posts <= set(self.posts(michael))
+
+        michael.unfollow(trevor)
+        michael.update()
+        assert not trevor_posts & set(self.posts(michael))
+
+    def test_follow_many_backfills(self, users):
+        michael, trevor = users['Michael'], users['Trevor']
+        trevor_posts = {f.post for f in trevor.fleets}
+        michael.follow_many([trevor.id])
+        assert trevor_posts <= set(self.posts(michael))
+
+        michael.unfollow_many([trevor.id])
+        assert not trevor_posts & set(self.posts(michael))
+
+    def test_length_capped(self, users, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'TIMELINE_LENGTH', 3)
+        self.latest_fleet(users['Trevor']).insert()
+        assert len(self.posts(users['player'])) == 3
+        assert self.posts(users['player'])[0] == 'Minor Turbulence'
+        assert self.posts(users['player']) == [
+            f.post for f in users['player'].newsfeed.limit(3)]
+
+    def test_trim_ties(self, users, app, monkeypatch, session):
+        player, franklin = users['player'], users['Franklin']
+        franklin_posts = self.posts(franklin)
+        created_at = datetime.now() + timedelta(days=1)
+        for post in ['Ballas', 'Vagos', 'Families']:
+            Fleet(post=post, user=users['Trevor'],
+                  created_at=created_at).insert()
+        monkeypatch.setitem(app.config, 'TIMELINE_LENGTH', 2)
+        trim_timelines(session.connection(), [player.id])
+        session.commit()
+        # Same created_at, the highest ids are the newest
+        assert self.posts(player) == ['Families', 'Vagos']
+        assert self.posts(franklin) == franklin_posts
+
+    def test_user_delete(self, users):
+        trevor_id = users['Trevor'].id
+        users['Trevor'].delete()
+        assert Timeline.query.filter_by(user_id=trevor_id).count() == 0
+        assert 'Friends Reunited' not in self.posts(users['player'])
+
+
+class TestPurge:
+
+    def test_purge_user(self, users, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'PURGE_CHUNK_SIZE', 2)
+        michael_id = users['Michael'].id
+        michael_fleets = [f.id for f in users['Michael'].fleets]
+        job = PurgeJob(user_id=michael_id)
+        job.insert()
+
+        purge_user(job.id)
+        job = PurgeJob.query.get(job.id)
+        assert job.status == 'done'
+        assert job.deleted_fleets == 7
+        assert job.deleted_follows == 4
+        assert job.finished_at is not None
+        assert User.query.get(michael_id) is None
+        assert User.query.count() == 3
+        assert User.counter_drift() == []
+        assert Timeline.query.filter(
+            Timeline.fleet_id.in_(michael_fleets)).count() == 0
+
+    def test_follower_left_meanwhile(self, users):
+        # As if player unfollowed between the purge reading the chunk and
+        # removing it
+        michael, player = users['Michael'], users['player']
+        follower_ids = [f.id for f in michael.followers]
+        assert player.id in follower_ids
+        player.unfollow(michael)
+        player.update()
+        removed = michael.remove_followers(follower_ids)
+        assert sorted(removed) == sorted(set(follower_ids) - {player.id})
+        assert michael.total_followers == 0
+        assert User.counter_drift() == []
+
+    def test_missing_user(self, users):
+        job = PurgeJob(user_id=10)
+        job.insert()
+        purge_user(job.id)
+        assert PurgeJob.query.get(job.id).status == 'done'
+
+
+class TestMergedTimeline:
+
+    @staticmethod
+    def expected(user):
+        fleets = user.fleets.all()
+        for followee in user.following:
+            fleets += followee.fleets.all()
+        fleets.sort(key=lambda f: (f.created_at, f.id), reverse=True)
+        return [f.id for f in fleets]
+
+    @staticmethod
+    def merged(user, **kwargs):
+        return [f.id for f in user.merged_timeline(limit=100, **kwargs)]
+
+    def test_matches_newsfeed(self, users, app, monkeypatch):
+        # Fleets were pushed before Michael crossed the threshold
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', 2)
+        for user in users.values():
+            assert self.merged(user) == self.expected(user)
+
+    def test_popular_author_not_pushed(self, users, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', 2)
+        fleet = Fleet(post='Bury the Hatchet', user=users['Michael'],
+                      created_at=datetime.now() + timedelta(days=1))
+        fleet.insert()
+        assert not Fleet.query.get(fleet.id).pushed
+        assert Timeline.query.filter_by(fleet_id=fleet.id).count() == 1
+        assert self.merged(users['player'])[0] == fleet.id
+        assert self.merged(users['Michael'])[0] == fleet.id
+
+    def test_pulled_after_dropping_below(self, users, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', 2)
+        fleet = Fleet(post='Bury the Hatchet', user=users['Michael'],
+                      created_at=datetime.now() + timedelta(days=1))
+        fleet.insert()
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', 100)
+        player = users['player']
+        assert self.merged(player)[0] == fleet.id
+        assert self.merged(player) == self.expected(player)
+
+    def test_popular_followee_not_backfilled(self, users, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', 0)
+        franklin, trevor = users['Franklin'], users['Trevor']
+        fleet = Fleet(post='Mr. Philips', user=trevor)
+        fleet.insert()
+        franklin.follow(trevor)
+        franklin.update()
+        assert fleet.id not in {f.id for f in franklin.timeline}
+        assert self.merged(franklin) == self.expected(franklin)
+
+    def test_one_query_for_pulled_authors(self, users, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', 0)
+        player = users['player']
+        for followee in player.following:
+            Fleet(post='Heist', user=followee).insert()
+        player.id  # Loaded before counting
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', record)
+        try:
+            merged = self.merged(player)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', record)
+        assert merged == self.expected(player)
+        assert len(statements) == 2
+
+    def test_pages(self, users, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'FANOUT_FOLLOWER_THRESHOLD', 2)
+        player = users['player']
+        first = player.merged_timeline(limit=5)
+        after = self.merged(player, before=(first[-1].created_at,
+                                            first[-1].id))
+        offset = self.merged(player, offset=5)
+        assert [f.id for f in first] + after == self.expected(player)
+        assert after == offset
+
 
 def test_fleet_to_dict():
     fleet1_dict = Fleet.query.get(11).to_dict()
@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from fleeter import db
+from fleeter.models import User, Fleet
+from tests.query_budget import QueryRecorder
+
+
+@pytest.fixture(scope='function')
+def recorder(app, monkeypatch):
+    recorder = QueryRecorder()
+    monkeypatch.setattr(app, 'wsgi_app', recorder.wrap(app.wsgi_app))
+    event.listen(Engine, 'before_cursor_execute',
+                 recorder.before_cursor_execute)
+    yield recorder
+    event.remove(Engine, 'before_cursor_execute',
+                 recorder.before_cursor_execute)
+
+
+class TestQueryRecorder:
+
+    url = '/api/users/4/fleets'  # Trevor
+
+    def test_statements_per_request(self, app, recorder):
+        client = app.test_client()
+        client.get(self.url)
+        db.session.query(User.username).filter(User.id == 2).scalar()
+        client.get(self.url + '/export')
+
+        assert [label for label, _ in recorder.requests] == \
+            [f'GET {self.url}', f'GET {self.url}/export']
+        statements = [st for _, sts in recorder.requests for st, _ in sts]
+        assert statements
+        assert not any(st.startswith('SELECT users.username')
+                       for st in statements)
+        assert recorder.problems(2) == []
+
+    def test_over_budget(self, app, recorder):
+        app.test_client().get(self.url)
+        problem, = recorder.problems(1)
+        assert problem.startswith(f'GET {self.url} ran 2 SQL statements, '
+                                  f'over its budget of 1:')
+        assert 'fleeter/api.py' in problem
+
+    def test_n_plus_one(self, app, recorder, monkeypatch):
+        to_dict = Fleet.to_dict
+
+        def lazy_to_dict(fleet):
+            # Looks the author up again for every fleet
+            username = db.session.query(User.username)\
+                .filter(User.id == fleet.user_id).scalar()
+            return dict(to_dict(fleet), username=username)
+
+        monkeypatch.setattr(Fleet, 'to_dict', lazy_to_dict)
+        app.test_client().get(self.url + '?per_page=3')
+        problem, = recorder.problems(10)
+        assert 'ran the same statement 3 times, likely an N+1 query' \
+            in problem
+        assert 'in _get_paginated_user_items' in problem
+        assert recorder.problems(10, repeats=3) == []
@@ -0,0 +1,146 @@
+import json
+import time
+import pytest
+from sqlalchemy import create_engine
+from fleeter.models import User
+from fleeter.replicas import replicas
+
+
+@pytest.fixture(scope='function')
+def replica_dbs(app, db, session, tmp_path, monkeypatch):
+    """Two SQLite files standing in for replicas, each with a single user
+    whose id is the one of player on the primary but named after the bind.
+    """
+    binds = {}
+    for name in ['replica0', 'replica1']:
+        url = f'sqlite:///{tmp_path / name}.db'
+        engine = create_engine(url)
+        db.Model.metadata.create_all(engine)
+        engine.execute(User.__table__.insert(), {'id': 1, 'username': name})
+        engine.dispose()
+        binds[name] = url
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', binds)
+    monkeypatch.setattr(replicas, 'binds', sorted(binds))
+    monkeypatch.setattr(replicas, '_next', 0)
+    monkeypatch.setattr(replicas, '_health', {})
+    monkeypatch.setattr(replicas, '_checking', {})
+    for name in binds:
+        assert replicas.check(name)
+    # Lets player be loaded again, from wherever requests are routed
+    session.expunge_all()
+    return binds
+
+
+@pytest.fixture(scope='module')
+def client(app):
+    return app.test_client()
+
+
+def _join_checks():
+    for _, thread in list(replicas._checking.values()):
+        thread.join()
+
+
+class FailingBackend:
+
+    def get_many(self, keys):
+        raise ConnectionError('Connection refused')
+
+    def set_many(self, mapping, ttl):
+        raise ConnectionError('Connection refused')
+
+
+def _username(client, **kwargs) -> str:
+    res = client.get('/api/users/1/fleets', **kwargs)
+    assert res.status_code == 200
+    return json.loads(res.data)['username']
+
+
+class TestReplicaRouter:
+
+    def test_round_robin(self, client, replica_dbs):
+        names = [_username(client) for _ in range(4)]
+        assert names == ['replica0', 'replica1', 'replica0', 'replica1']
+
+    def test_no_replicas(self, client, monkeypatch):
+        monkeypatch.setattr(replicas, 'binds', [])
+        assert _username(client) == 'player'
+
+    def test_unhealthy_skipped(self, client, replica_dbs, app, monkeypatch):
+        binds = dict(replica_dbs, replica1='sqlite:////nonexistent/r1.db')
+        monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', binds)
+        assert not replicas.check('replica1')
+        names = [_username(client) for _ in range(4)]
+        assert names == ['replica0'] * 4
+        assert replicas._health['replica1'][0] is False
+
+    def test_all_unhealthy_fall_back_to_primary(self, client, replica_dbs,
+                                                app, monkeypatch):
+        monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', {
+            name: f'sqlite:////nonexistent/{name}.db'
+            for name in replica_dbs})
+        for name in replica_dbs:
+            replicas.check(name)
+        assert _username(client) == 'player'
+
+    def test_health_rechecked_after_interval(self, client, replica_dbs,
+                                             monkeypatch):
+        monkeypatch.setitem(replicas._health, 'replica1',
+                            (False, time.monotonic() - 60))
+        # The due check runs in the background, the request reads on
+        assert [_username(client) for _ in range(2)] == ['replica0'] * 2
+        _join_checks()
+        assert replicas._checking == {}
+        assert [_username(client) for _ in range(2)] == \
+            ['replica0', 'replica1']
+
+    def test_unchecked_read_from_primary(self, client, replica_dbs,
+                                         monkeypatch):
+        monkeypatch.setattr(replicas, '_health', {})
+        assert _username(client) == 'player'
+        _join_checks()
+        assert _username(client) == 'replica1'
+
+    def test_hanging_check_unhealthy(self, client, replica_dbs, monkeypatch):
+        monkeypatch.setitem(replicas._checking, 'replica0',
+                            (time.monotonic() - 60, None))
+        assert _username(client) == 'replica1'
+        _join_checks()
+        assert [_username(client) for _ in range(2)] == \
+            ['replica1', 'replica0']
+
+    def test_read_your_writes(self, client, replica_dbs, sign_token,
+                              monkeypatch):
+        monkeypatch.setattr(replicas, 'window', 1)
+        writer = {'Authorization': 'Bearer ' +
+                  sign_token(permissions=['post:fleets'])}
+        other = {'Authorization': 'Bearer ' + sign_token()}
+        assert _username(client, headers=writer) == 'replica0'
+
+        res = client.post('/api/fleets', json={'post': 'Pulled over'},
+                          headers=writer)
+        assert res.status_code == 200
+        assert _username(client, headers=writer) == 'player'
+        assert _username(client, headers=other) == 'replica1'
+        assert _username(client) == 'replica0'
+
+        time.sleep(1.1)
+        assert _username(client, headers=writer) == 'replica1'
+
+    def test_failed_write_not_pinned(self, client, replica_dbs, sign_token):
+        writer = {'Authorization': 'Bearer ' + sign_token()}
+        res = client.post('/api/fleets', json={'post': 'Pulled over'},
+                          headers=writer)
+        assert res.status_code == 403
+        assert _username(client, headers=writer) == 'replica0'
+
+    def test_writers_store_down(self, client, replica_dbs, sign_token,
+                                monkeypatch):
+        monkeypatch.setattr(replicas, 'writes', FailingBackend())
+        writer = {'Authorization': 'Bearer ' +
+                  sign_token(permissions=['post:fleets'])}
+        res = client.post('/api/fleets', json={'post': 'Pulled over'},
+                          headers=writer)
+        assert res.status_code == 200
+        assert _username(client, headers=writer) == 'player'
+        assert _username(client) == 'replica0'
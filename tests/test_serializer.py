@@ -0,0 +1,67 @@
+import gzip
+import json
+import pytest
+from datetime import datetime, timezone
+from fleeter import serializer
+from fleeter.compress import compress
+
+
+@pytest.fixture(scope='module')
+def client(app):
+    return app.test_client()
+
+
+class TestSerializer:
+
+    data = {'id': 1, 'post': 'Fame or Shame', 'unicode': 'Los Santos ☀',
+            'created_at': datetime(2020, 5, 31, 14, 47, 38, 549421),
+            'finished_at': datetime(2020, 5, 31, tzinfo=timezone.utc),
+            'items': [None, True, 1.5]}
+
+    @pytest.mark.parametrize('name', sorted(serializer.SERIALIZERS))
+    def test_round_trip(self, app, monkeypatch, name):
+        monkeypatch.setitem(app.config, 'JSON_SERIALIZER', name)
+        decoded = json.loads(serializer.dumps(self.data))
+        assert decoded['created_at'] == '2020-05-31T14:47:38.549421'
+        assert decoded['finished_at'] == '2020-05-31T00:00:00+00:00'
+        assert decoded['unicode'] == self.data['unicode']
+        assert decoded['items'] == self.data['items']
+
+    def test_fleet_created_at_iso(self, client):
+        data = json.loads(client.get('/api/users/4/fleets').data)
+        for fleet in data['fleets']:
+            datetime.fromisoformat(fleet['created_at'])
+
+
+class TestCompress:
+
+    url = '/api/users/2/fleets?per_page=20'  # Michael
+
+    def test_gzip_above_threshold(self, client, monkeypatch):
+        monkeypatch.setattr(compress, 'min_size', 64)
+        monkeypatch.setattr(compress, 'encodings',
+                            [e for e in compress.encodings if e[0] == 'gzip'])
+        plain = client.get(self.url)
+        res = client.get(self.url, headers={'Accept-Encoding': 'gzip'})
+        assert res.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in res.headers['Vary']
+        assert gzip.decompress(res.data) == plain.data
+        assert len(res.data) < len(plain.data)
+
+    def test_brotli_preferred(self, client, monkeypatch):
+        brotli = pytest.importorskip('brotli')
+        monkeypatch.setattr(compress, 'min_size', 64)
+        res = client.get(self.url, headers={'Accept-Encoding': 'gzip, br'})
+        assert res.headers['Content-Encoding'] == 'br'
+        assert json.loads(brotli.decompress(res.data))['success']
+
+    def test_below_threshold_sent_as_is(self, client, monkeypatch):
+        monkeypatch.setattr(compress, 'min_size', 1 << 20)
+        res = client.get(self.url, headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in res.headers
+        assert json.loads(res.data)['success']
+
+    def test_not_acceptable_sent_as_is(self, client, monkeypatch):
+        monkeypatch.setattr(compress, 'min_size', 64)
+        res = client.get(self.url, headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in res.headers
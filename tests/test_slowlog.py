@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import pytest
+from fleeter.models import Fleet
+from fleeter.slowlog import SlowQueryLog, slowlog
+from tests.conftest import USER_CLIENT_ID
+
+
+@pytest.fixture(scope='function')
+def slow_queries(tmp_path, monkeypatch):
+    """Logs every statement to a file, returns a reader of its records."""
+    path = tmp_path / 'slow.jsonl'
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    monkeypatch.setattr(slowlog, 'threshold', 0)
+    monkeypatch.setattr(slowlog, '_fd', fd)
+
+    def read():
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    yield read
+    os.close(fd)
+
+
+@pytest.fixture(scope='module')
+def client(app):
+    return app.test_client()
+
+
+class TestSlowQueryLog:
+
+    def test_endpoint_and_user(self, client, users, slow_queries,
+                               sign_token):
+        token = sign_token(permissions=['get:newsfeed'])
+        res = client.get('/api/fleets/newsfeed',
+                         headers={'Authorization': f'Bearer {token}'})
+        assert res.status_code == 200
+        records = slow_queries()
+        assert records
+        assert {r['endpoint'] for r in records} == {'api.get_newsfeed'}
+        # Statements from the caller's lookup on are attributed to them
+        assert records[-1]['user_id'] == users['player'].id
+        assert any('in _get_paginated_user_items' in frame
+                   for r in records for frame in r['stack'])
+        assert all(r['duration'] >= 0 for r in records)
+        # Parameters are described, not written
+        assert USER_CLIENT_ID not in json.dumps(records)
+        assert any(r['params'] and 'str' in json.dumps(r['params'])
+                   for r in records)
+
+    def test_anonymous_request(self, client, users, slow_queries):
+        client.get(f'/api/users/{users["Trevor"].id}/fleets')
+        record = slow_queries()[-1]
+        assert record['endpoint'] == 'api.get_user_fleets'
+        assert record['method'] == 'GET'
+        assert record['view_args'] == {'user_id': users['Trevor'].id}
+        assert record['user_id'] is None
+
+    def test_outside_requests(self, session, slow_queries):
+        session.execute(Fleet.__table__.insert(),
+                        [{'post': 'Ballas', 'user_id': 1},
+                         {'post': 'Vagos', 'user_id': 1}])
+        record = slow_queries()[-1]
+        assert record['executemany']
+        assert record['params']['rows'] == 2
+        assert record['endpoint'] is None and record['user_id'] is None
+        assert 'Ballas' not in json.dumps(record)
+
+    def test_threshold(self, client, slow_queries, monkeypatch):
+        monkeypatch.setattr(slowlog, 'threshold', 60)
+        client.get('/api/users/1/fleets')
+        assert slow_queries() == []
+
+    def test_logger(self, client, monkeypatch, caplog):
+        monkeypatch.setattr(slowlog, 'threshold', 0)
+        monkeypatch.setattr(slowlog, '_fd', None)
+        with caplog.at_level(logging.WARNING, logger='fleeter.slowlog'):
+            client.get('/api/users/1/fleets')
+        records = [json.loads(r.getMessage()) for r in caplog.records
+                   if r.name == 'fleeter.slowlog']
+        assert records[-1]['endpoint'] == 'api.get_user_fleets'
+
+    def test_init_app_again(self, app, tmp_path, monkeypatch):
+        monkeypatch.setitem(app.config, 'SLOW_QUERY_THRESHOLD', 60)
+        monkeypatch.setitem(app.config, 'SLOW_QUERY_LOG_PATH',
+                            str(tmp_path / 'slow.jsonl'))
+        log = SlowQueryLog()
+        fds = set()
+        try:
+            for _ in range(3):
+                log.init_app(app)
+                fds.add(log._fd)
+        finally:
+            os.close(log._fd)
+            app.teardown_request_funcs[None] = [
+                f for f in app.teardown_request_funcs[None]
+                if getattr(f, '__self__', None) is not log]
+        # New descriptors take the lowest number free, the one just closed
+        assert len(fds) == 1
+
+    def test_explain(self, client, db, slow_queries, monkeypatch):
+        if db.engine.dialect.name != 'postgresql':
+            pytest.skip('EXPLAIN (ANALYZE) needs PostgreSQL')
+        monkeypatch.setattr(slowlog, 'explain', True)
+        monkeypatch.setattr(slowlog, '_explained', type(slowlog._explained)())
+        client.get('/api/users/1/fleets')
+        plans = [r['plan'] for r in slow_queries() if 'plan' in r]
+        assert plans and 'Plan' in plans[0][0]
+        # Explained once per interval
+        client.get('/api/users/1/fleets')
+        assert len([r for r in slow_queries() if 'plan' in r]) == len(plans)